@@ -0,0 +1,144 @@
+from itertools import islice
+
+import numpy as np
+
+from presenter import format_date
+
+# Day 0 of datetime64[D] is Thursday 1970-01-01, so adding 3 before dividing by 7 makes weeks start on Monday
+WEEK_OFFSET = 3
+
+class EntryColumns:
+    def __init__(self, user_ids, department_codes, departments, counted, days, hours_worked):
+        # One array per column, one element per timesheet entry. Departments are stored as codes into departments,
+        # and counted is False for entries on denied timesheets.
+        self.user_ids = user_ids
+        self.department_codes = department_codes
+        self.departments = departments
+        self.counted = counted
+        self.days = days
+        self.hours_worked = hours_worked
+
+    def __len__(self):
+        return len(self.hours_worked)
+
+def _no_entries(departments):
+    return EntryColumns(np.empty(0, np.int64), np.empty(0, np.int32), departments, np.empty(0, bool),
+                        np.empty(0, "datetime64[D]"), np.empty(0, np.float64))
+
+def _chunks(rows, chunk_size):
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield zip(*chunk)
+
+def load_entries(db_handler, department = None, start_date = None, end_date = None, chunk_size = 100000):
+    # Timesheets are loaded first into arrays looked up by timesheet ID, so each entry only needs its timesheet ID, date
+    # and hours from SQLite and its user, department and status are filled in by array indexing. Both queries are
+    # streamed chunk by chunk, so only one chunk of row tuples is held in memory alongside the columns.
+    timesheet_query = "SELECT timesheet_id, user_id, IFNULL(department, ''), status != 'Denied' FROM timesheets WHERE user_id IS NOT NULL"
+    # Hours are coerced the way SUM does in the balance queries, so blank and missing hours count as 0
+    entry_query = "SELECT timesheet_id, date, IFNULL(CAST(hours_worked AS REAL), 0) FROM timesheet_entries WHERE date IS NOT NULL"
+    timesheet_parameters = []
+    entry_parameters = []
+    if department is not None:
+        timesheet_query += " AND department = ?"
+        entry_query += " AND timesheet_id IN (SELECT timesheet_id FROM timesheets WHERE department = ?)"
+        timesheet_parameters.append(department)
+        entry_parameters.append(department)
+    if start_date is not None:
+        entry_query += " AND date >= ?"
+        entry_parameters.append(format_date(start_date))
+    if end_date is not None:
+        entry_query += " AND date <= ?"
+        entry_parameters.append(format_date(end_date))
+
+    rows, error = db_handler.iter_query_data(timesheet_query, timesheet_parameters, chunk_size, row_type=tuple)
+    if error:
+        return None
+
+    department_lookup = {}
+    timesheet_chunks = []
+    for timesheet_ids, user_ids, departments, counted in _chunks(rows, chunk_size):
+        # Each distinct department in the chunk is looked up once rather than once per row
+        names, inverse = np.unique(np.array(departments), return_inverse=True)
+        codes = np.array([department_lookup.setdefault(str(name), len(department_lookup)) for name in names], dtype=np.int32)
+        timesheet_chunks.append((np.array(timesheet_ids, dtype=np.int64), np.array(user_ids, dtype=np.int64), codes[inverse],
+                                 np.array(counted, dtype=bool)))
+    departments = sorted(department_lookup, key=department_lookup.get)
+
+    if not timesheet_chunks:
+        return _no_entries(departments)
+    rows, error = db_handler.iter_query_data(entry_query, entry_parameters, chunk_size, row_type=tuple)
+    if error:
+        return None
+
+    # The timesheet columns are sorted by ID and each entry's timesheet is found by binary search, since sharded IDs
+    # are far too sparse to index an array by
+    timesheet_ids, user_ids, department_codes, counted = [np.concatenate(column) for column in zip(*timesheet_chunks)]
+    order = np.argsort(timesheet_ids, kind="stable")
+    timesheet_ids, user_ids, department_codes, counted = timesheet_ids[order], user_ids[order], department_codes[order], counted[order]
+
+    entry_chunks = []
+    for entry_timesheet_ids, days, hours_worked in _chunks(rows, chunk_size):
+        entry_timesheet_ids = np.array(entry_timesheet_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(timesheet_ids, entry_timesheet_ids), len(timesheet_ids) - 1)
+        # Entries whose timesheet is missing or has no user are dropped, as the join would have done
+        keep = timesheet_ids[positions] == entry_timesheet_ids
+        positions = positions[keep]
+        entry_chunks.append((user_ids[positions], department_codes[positions], counted[positions],
+                             np.array(days, dtype="datetime64[D]")[keep], np.array(hours_worked, dtype=np.float64)[keep]))
+
+    if not entry_chunks:
+        return _no_entries(departments)
+
+    columns = [np.concatenate(column) for column in zip(*entry_chunks)]
+    return EntryColumns(columns[0], columns[1], departments, columns[2], columns[3], columns[4])
+
+def _weeks(days):
+    return (days.astype(np.int64) + WEEK_OFFSET) // 7
+
+def _week_start(week):
+    return str(np.datetime64(int(week) * 7 - WEEK_OFFSET, "D"))
+
+def weekly_department_hours(entries):
+    # Returns {(department, week start as yyyy-mm-dd): hours worked}, leaving out denied timesheets
+    counted = entries.counted
+    if not counted.any():
+        return {}
+
+    weeks = _weeks(entries.days[counted])
+    first_week = weeks.min()
+    week_count = int(weeks.max() - first_week) + 1
+
+    # Each (department, week) pair gets its own bin, so one bincount sums every group at once
+    keys = entries.department_codes[counted].astype(np.int64) * week_count + (weeks - first_week)
+    totals = np.bincount(keys, weights=entries.hours_worked[counted], minlength=len(entries.departments) * week_count)
+
+    return {(entries.departments[key // week_count], _week_start(first_week + key % week_count)): float(totals[key])
+            for key in np.flatnonzero(np.bincount(keys))}
+
+def overtime_distribution(entries, daily_expected_hours = 7.4, bins = (-24, -2, -1, -0.5, 0, 0.5, 1, 2, 24)):
+    # Returns (counts, bin edges) of the hours each counted entry is over or under the expected day
+    overtime = entries.hours_worked[entries.counted] - daily_expected_hours
+    counts, edges = np.histogram(overtime, bins=np.asarray(bins, dtype=np.float64))
+    return counts.tolist(), edges.tolist()
+
+def negative_trends(entries, daily_expected_hours = 7.4, weeks = 4):
+    # Returns [(user_id, flexi balance, change over the last weeks)] for users whose balance is negative and still
+    # falling, most negative change first
+    counted = entries.counted
+    if not counted.any():
+        return []
+
+    user_ids, inverse = np.unique(entries.user_ids[counted], return_inverse=True)
+    differences = entries.hours_worked[counted] - daily_expected_hours
+    balances = np.bincount(inverse, weights=differences, minlength=len(user_ids))
+
+    entry_weeks = _weeks(entries.days[counted])
+    recent = entry_weeks > entry_weeks.max() - weeks
+    changes = np.bincount(inverse[recent], weights=differences[recent], minlength=len(user_ids))
+
+    trending = np.flatnonzero((balances < 0) & (changes < 0))
+    trending = trending[np.argsort(changes[trending], kind="stable")]
+    return [(int(user_ids[i]), float(balances[i]), float(changes[i])) for i in trending]
@@ -0,0 +1,86 @@
+import unittest
+import tempfile
+import os
+import shutil
+from datetime import datetime
+
+import analytics
+from model import DatabaseHandler, ShardedDatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+class TestAnalytics(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.db_handler = self.create_db_handler(os.path.join(self.temp_folder, "test_db.sqlite"))
+        self.user_handler = UserHandler(self.db_handler)
+        self.timesheet_handler = TimesheetHandler(self.db_handler)
+
+        self.it_user = self.user_handler.get_user_by_id(self.user_handler.create_user("Bill Potts", "bill@example.com", "stars", "IT", "Employee"))
+        self.hr_user = self.user_handler.get_user_by_id(self.user_handler.create_user("Nardole", "nardole@example.com", "vault", "HR", "Employee"))
+        self.timesheet_handler.submit_timesheet(self.it_user, datetime(2023, 1, 2), [8.4] * 5)
+        self.timesheet_handler.submit_timesheet(self.it_user, datetime(2023, 1, 9), [5.9] * 5)
+        self.timesheet_handler.submit_timesheet(self.hr_user, datetime(2023, 1, 2), [7.4, 7.9])
+        denied_id = self.timesheet_handler.submit_timesheet(self.hr_user, datetime(2023, 1, 9), [12.0] * 5)
+        self.timesheet_handler.set_timesheet_status(denied_id, "Denied")
+
+    def create_db_handler(self, db_path):
+        return DatabaseHandler(db_path)
+
+    def tearDown(self):
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def test_load_entries(self):
+        entries = analytics.load_entries(self.db_handler, chunk_size = 3)
+        self.assertEqual(len(entries), 17)
+        self.assertEqual(sorted(entries.departments), ["HR", "IT"])
+        self.assertEqual(int(entries.counted.sum()), 12)
+        entries = analytics.load_entries(self.db_handler, department = "HR", start_date = datetime(2023, 1, 3))
+        self.assertEqual(len(entries), 6)
+        self.assertEqual(str(entries.days.min()), "2023-01-03")
+
+    def test_blank_hours_count_as_zero(self):
+        # The GUI submits the text of each day's field, which is blank for days left empty
+        user = self.user_handler.get_user_by_id(self.user_handler.create_user("Grant Gordon", "grant@example.com", "ghost", "Sales", "Employee"))
+        self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), ["7.5", "8", "", "7", "7"])
+        entries = analytics.load_entries(self.db_handler, department = "Sales")
+        self.assertEqual(entries.hours_worked.tolist(), [7.5, 8.0, 0.0, 7.0, 7.0])
+        self.assertAlmostEqual(float(entries.hours_worked.sum()) - 5 * 7.4, self.timesheet_handler.get_flexi_balance(user.user_id))
+
+    def test_weekly_department_hours(self):
+        hours = analytics.weekly_department_hours(analytics.load_entries(self.db_handler))
+        self.assertEqual(hours.keys(), {("IT", "2023-01-02"), ("IT", "2023-01-09"), ("HR", "2023-01-02")})
+        self.assertAlmostEqual(hours[("IT", "2023-01-02")], 42.0)
+        self.assertAlmostEqual(hours[("IT", "2023-01-09")], 29.5)
+        self.assertAlmostEqual(hours[("HR", "2023-01-02")], 15.3)
+
+    def test_overtime_distribution(self):
+        counts, edges = analytics.overtime_distribution(analytics.load_entries(self.db_handler), bins = (-2, 0, 2))
+        self.assertEqual(counts, [5, 7])
+        self.assertEqual(edges, [-2.0, 0.0, 2.0])
+
+    def test_negative_trends(self):
+        trends = analytics.negative_trends(analytics.load_entries(self.db_handler), weeks = 1)
+        self.assertEqual(len(trends), 1)
+        user_id, balance, change = trends[0]
+        self.assertEqual(user_id, self.it_user.user_id)
+        self.assertAlmostEqual(balance, -2.5)
+        self.assertAlmostEqual(change, -7.5)
+
+    def test_empty_database(self):
+        db_handler = DatabaseHandler(os.path.join(self.temp_folder, "empty.sqlite"))
+        TimesheetHandler(db_handler)
+        entries = analytics.load_entries(db_handler)
+        self.assertEqual(len(entries), 0)
+        self.assertEqual(analytics.weekly_department_hours(entries), {})
+        self.assertEqual(analytics.negative_trends(entries), [])
+        db_handler.close()
+
+class TestShardedAnalytics(TestAnalytics):
+    # Sharded timesheet IDs are spread billions apart, so the lookups can't be arrays indexed by ID
+    def create_db_handler(self, db_path):
+        return ShardedDatabaseHandler(db_path)
+
+if __name__ == "__main__":
+    unittest.main()
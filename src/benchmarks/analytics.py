@@ -0,0 +1,86 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import analytics
+from benchmarks.generator import generate
+from model import DatabaseHandler
+
+# Run from the src folder with: python -m benchmarks.analytics --entries 1000000
+
+def python_weekly_department_hours(db_handler):
+    # The per-row loop the analytics module replaces: every entry comes back as a dict and is grouped in Python
+    rows, error = db_handler.get_data(["department", "status", "date", "hours_worked"], "timesheet_entries", joins={"timesheets": "timesheet_id"})
+    totals = defaultdict(float)
+    for row in rows:
+        if row["status"] != "Denied":
+            entry_date = date.fromisoformat(row["date"])
+            totals[(row["department"], (entry_date - timedelta(days=entry_date.weekday())).isoformat())] += row["hours_worked"]
+    return dict(totals)
+
+def python_negative_trends(db_handler, daily_expected_hours = 7.4, weeks = 4):
+    rows, error = db_handler.get_data(["user_id", "status", "date", "hours_worked"], "timesheet_entries", joins={"timesheets": "timesheet_id"})
+    rows = [row for row in rows if row["status"] != "Denied"]
+    last_date = max(date.fromisoformat(row["date"]) for row in rows)
+    cutoff = last_date - timedelta(days=last_date.weekday(), weeks=weeks - 1)
+
+    balances = defaultdict(float)
+    changes = defaultdict(float)
+    for row in rows:
+        difference = row["hours_worked"] - daily_expected_hours
+        balances[row["user_id"]] += difference
+        if date.fromisoformat(row["date"]) >= cutoff:
+            changes[row["user_id"]] += difference
+
+    trending = [(user_id, balances[user_id], changes[user_id]) for user_id in balances if balances[user_id] < 0 and changes[user_id] < 0]
+    return sorted(trending, key=lambda trend: trend[2])
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the vectorized analytics against per-row Python loops.")
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--departments", type=int, default=100)
+    args = parser.parse_args()
+
+    temp_folder = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(temp_folder, "analytics.sqlite")
+        print(f"Generating {args.entries} entries")
+        generate(db_path, args.users, args.entries, args.departments)
+        db_handler = DatabaseHandler(db_path)
+
+        entries, load_seconds = timed(analytics.load_entries, db_handler)
+        vectorized_hours, hours_seconds = timed(analytics.weekly_department_hours, entries)
+        vectorized_trends, trends_seconds = timed(analytics.negative_trends, entries)
+        python_hours, python_hours_seconds = timed(python_weekly_department_hours, db_handler)
+        python_trends, python_trends_seconds = timed(python_negative_trends, db_handler)
+
+        assert vectorized_hours.keys() == python_hours.keys()
+        assert all(abs(vectorized_hours[key] - python_hours[key]) < 1e-6 for key in python_hours)
+        # Users with equal changes can come out in either order, so only the set of users and their figures are compared
+        python_by_user = {trend[0]: trend for trend in python_trends}
+        assert python_by_user.keys() == {trend[0] for trend in vectorized_trends}
+        assert all(abs(trend[2] - python_by_user[trend[0]][2]) < 1e-6 for trend in vectorized_trends)
+
+        print(f"{'operation':<26} {'python s':>9} {'numpy s':>9} {'speedup':>8}")
+        print(f"{'load_entries':<26} {'':>9} {load_seconds:>9.3f}")
+        print(f"{'weekly_department_hours':<26} {python_hours_seconds:>9.3f} {hours_seconds:>9.3f} {python_hours_seconds / hours_seconds:>7.0f}x")
+        print(f"{'negative_trends':<26} {python_trends_seconds:>9.3f} {trends_seconds:>9.3f} {python_trends_seconds / trends_seconds:>7.0f}x")
+        print(f"Including load_entries: {python_hours_seconds + python_trends_seconds:.3f}s python, "
+              f"{load_seconds + hours_seconds + trends_seconds:.3f}s numpy")
+
+        db_handler.close()
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == "__main__":
+    main()
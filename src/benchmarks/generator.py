@@ -0,0 +1,80 @@
+import argparse
+import random
+from datetime import date, timedelta
+
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+# Run from the src folder with: python -m benchmarks.generator database.sqlite --scale small
+SCALES = {
+    "small": {"users": 1000, "entries": 40000, "departments": 20},
+    "medium": {"users": 10000, "entries": 400000, "departments": 100},
+    "large": {"users": 50000, "entries": 2000000, "departments": 200},
+}
+STATUS_WEIGHTS = {"Approved": 70, "Pending": 20, "Denied": 10}
+DAYS_PER_TIMESHEET = 5
+CHUNK_SIZE = 50000
+
+def user_email(user_id):
+    return f"user{user_id}@example.com"
+
+def department_name(department):
+    return f"Department {department}"
+
+def generate(db_path, users, entries, departments, seed = 0):
+    # Fills db_path with users spread across departments, each with weekly timesheets of five entries.
+    # The same arguments and seed always produce the same rows, so results can be compared between commits.
+    rng = random.Random(seed)
+    db_handler = DatabaseHandler(db_path, journal_mode="WAL", synchronous="OFF")
+    UserHandler(db_handler)
+    TimesheetHandler(db_handler)
+
+    user_departments = [department_name(rng.randrange(departments)) for _ in range(users)]
+    with db_handler.transaction():
+        db_handler.insert_many("users", [(user_id, f"User {user_id}", user_email(user_id), "password", user_departments[user_id - 1],
+                                          "Manager" if user_id % 50 == 0 else "Employee") for user_id in range(1, users + 1)],
+                               ["user_id", "name", "email", "password", "department", "role"])
+
+    statuses = list(STATUS_WEIGHTS)
+    weights = list(STATUS_WEIGHTS.values())
+    timesheet_count = max(entries // DAYS_PER_TIMESHEET, 1)
+    start_date = date(2020, 1, 6)
+
+    for chunk_start in range(0, timesheet_count, CHUNK_SIZE):
+        timesheets = []
+        timesheet_entries = []
+
+        for timesheet_id in range(chunk_start + 1, min(chunk_start + CHUNK_SIZE, timesheet_count) + 1):
+            user_id = (timesheet_id - 1) % users + 1
+            week = (timesheet_id - 1) // users
+            timesheets.append((timesheet_id, user_id, user_departments[user_id - 1], rng.choices(statuses, weights)[0]))
+
+            for day in range(DAYS_PER_TIMESHEET):
+                entry_date = start_date + timedelta(weeks=week, days=day)
+                timesheet_entries.append((timesheet_id, entry_date.isoformat(), round(rng.uniform(6.0, 9.0), 2)))
+
+        with db_handler.transaction():
+            db_handler.insert_many("timesheets", timesheets, ["timesheet_id", "user_id", "department", "status"])
+            db_handler.insert_many("timesheet_entries", timesheet_entries, ["timesheet_id", "date", "hours_worked"])
+
+    db_handler.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a SQLite database with reproducible synthetic users and timesheets.")
+    parser.add_argument("database")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--entries", type=int)
+    parser.add_argument("--departments", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+
+    generate(args.database, seed=args.seed, **scale)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from benchmarks.generator import user_email
+
+# Start the server against a generated database, then run from the src folder with:
+# python -m benchmarks.http_load --port 8080 --users 1000 --clients 50 --requests 200
+
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.token = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body = None):
+        # Sends one request over the client's keep-alive connection, returning (status, payload)
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(data)}\r\n"
+        if self.token:
+            head += f"Authorization: Bearer {self.token}\r\n"
+        self.writer.write((head + "\r\n").encode("latin-1") + data)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        content_length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                content_length = int(value)
+
+        return status, json.loads(await self.reader.readexactly(content_length))
+
+    async def close(self):
+        self.writer.close()
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)] * 1000
+
+async def run_client(host, port, user_id, requests, rng, timings, statuses):
+    client = Client(host, port)
+    await client.connect()
+
+    status, payload = await client.request("POST", "/login", {"email": user_email(user_id), "password": "password"})
+    statuses[("login", status)] += 1
+    if status != 200:
+        await client.close()
+        return
+    client.token = payload["token"]
+    manager = payload["user"]["role"] == "Manager"
+
+    for _ in range(requests):
+        # Mostly balance checks, with submissions and, for managers, reviewing and approving the pending queue
+        roll = rng.random()
+        if manager and roll < 0.3:
+            operation, method, path, body = "pending", "GET", "/timesheets/pending?page_size=20", None
+        elif roll < 0.8:
+            operation, method, path, body = "balance", "GET", "/balance", None
+        else:
+            start_date = date(2030, 1, 7) + timedelta(weeks=rng.randrange(52))
+            operation, method, path, body = "submit", "POST", "/timesheets", {"start_date": start_date.isoformat(), "hours": [7.4] * 5}
+
+        start = time.perf_counter()
+        status, payload = await client.request(method, path, body)
+        timings[operation].append(time.perf_counter() - start)
+        statuses[(operation, status)] += 1
+
+        if operation == "pending" and status == 200 and payload["timesheets"]:
+            start = time.perf_counter()
+            status, payload = await client.request("POST", "/timesheets/status",
+                                                   {"timesheet_ids": [timesheet["timesheet_id"] for timesheet in payload["timesheets"]], "status": "Approved"})
+            timings["approve"].append(time.perf_counter() - start)
+            statuses[("approve", status)] += 1
+
+    await client.close()
+
+async def run(host, port, users, clients, requests, seed):
+    rng = random.Random(seed)
+    timings = {"balance": [], "submit": [], "pending": [], "approve": []}
+    statuses = Counter()
+
+    # Every 50th generated user is a manager, so a few clients log in as one
+    user_ids = [rng.randrange(1, users // 50 + 1) * 50 if i % 10 == 0 and users >= 50 else rng.randrange(users) + 1 for i in range(clients)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(host, port, user_id, requests, random.Random(rng.random()), timings, statuses) for user_id in user_ids])
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(operation_timings) for operation_timings in timings.values())
+    print(f"{total} requests from {clients} clients in {elapsed:.2f}s ({total / elapsed:,.0f} requests/s)")
+    print(f"{'operation':<10} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for operation, operation_timings in timings.items():
+        if operation_timings:
+            operation_timings.sort()
+            print(f"{operation:<10} {len(operation_timings):>7} {percentile(operation_timings, 0.5):>9.2f} "
+                  f"{percentile(operation_timings, 0.95):>9.2f} {percentile(operation_timings, 0.99):>9.2f}")
+
+    errors = {key: count for key, count in statuses.items() if key[1] >= 400}
+    if errors:
+        print(f"Errors: {errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a running flexi-time server with concurrent keep-alive clients.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--users", type=int, default=1000, help="number of users in the generated database")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.host, args.port, args.users, args.clients, args.requests, args.seed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.generator import SCALES, department_name, generate
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+# Run from the src folder with: python -m benchmarks.in_memory --scale small --operations 2000
+
+MODES = {
+    "file": {},
+    "memory, write-through": {"in_memory": True, "durability": "write-through"},
+    "memory, snapshot 60s": {"in_memory": True, "durability": "snapshot", "snapshot_interval": 60},
+}
+
+def timed(function, count):
+    timings = []
+    for i in range(count):
+        start = time.perf_counter()
+        function(i)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return statistics.median(timings) * 1e6, timings[int(len(timings) * 0.99)] * 1e6
+
+def run(db_path, scale, operations, options):
+    rng = random.Random(0)
+    start = time.perf_counter()
+    db_handler = DatabaseHandler(db_path, **options)
+    user_handler = UserHandler(db_handler)
+    timesheet_handler = TimesheetHandler(db_handler)
+    open_ms = (time.perf_counter() - start) * 1000
+
+    user_ids = [rng.randrange(1, scale["users"] + 1) for _ in range(operations)]
+    departments = [department_name(rng.randrange(scale["departments"])) for _ in range(operations)]
+    user = user_handler.get_user_by_id(1)
+
+    results = {
+        "open_ms": open_ms,
+        "balance": timed(lambda i: timesheet_handler.calculate_flexi_balance(user_ids[i]), operations),
+        "pending page": timed(lambda i: timesheet_handler.get_timesheets_page(departments[i], "Pending"), operations),
+        "login": timed(lambda i: user_handler.authenticate_user(f"user{user_ids[i]}@example.com", "password"), operations),
+        "submit": timed(lambda i: timesheet_handler.submit_timesheet(user, datetime(2030, 1, 7), [7.4] * 5), min(operations, 200)),
+    }
+    start = time.perf_counter()
+    db_handler.close()
+    results["close_ms"] = (time.perf_counter() - start) * 1000
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare read and write latency of the file-backed and in-memory modes.")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--operations", type=int, default=2000, help="reads of each kind; submissions are capped at 200")
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]
+    temp_folder = tempfile.mkdtemp()
+    try:
+        source_path = os.path.join(temp_folder, "source.sqlite")
+        generate(source_path, scale["users"], scale["entries"], scale["departments"])
+
+        operations = ["balance", "pending page", "login", "submit"]
+        print(f"{'mode':<22} {'open ms':>8} " + " ".join(f"{operation + ' p50/p99 us':>26}" for operation in operations) + f" {'close ms':>9}")
+        for name, options in MODES.items():
+            # Each mode starts from its own copy, so earlier submissions don't change later results
+            db_path = os.path.join(temp_folder, f"{len(os.listdir(temp_folder))}.sqlite")
+            shutil.copyfile(source_path, db_path)
+            result = run(db_path, scale, args.operations, options)
+            print(f"{name:<22} {result['open_ms']:>8.1f} " +
+                  " ".join(f"{result[operation][0]:>17.1f} / {result[operation][1]:>6.1f}" for operation in operations) + f" {result['close_ms']:>9.1f}")
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from model import DatabaseHandler, MIGRATIONS
+from presenter import UserHandler, TimesheetHandler
+
+# Run from the src folder with: python -m benchmarks.index_lookups [rows ...]
+DEPARTMENTS = ["IT", "HR", "Finance", "Sales", "Legal"]
+STATUSES = ["Pending", "Approved", "Denied"]
+LOOKUPS = 200
+
+def populate(db_handler, users):
+    rng = random.Random(0)
+    db_handler.cursor.executemany("INSERT INTO users VALUES (null, ?, ?, ?, ?, ?)",
+        ((f"User {i}", f"user{i}@example.com", "password", rng.choice(DEPARTMENTS), "Employee") for i in range(users)))
+    db_handler.cursor.executemany("INSERT INTO timesheets VALUES (null, ?, ?, ?)",
+        ((i % users + 1, rng.choice(DEPARTMENTS), rng.choice(STATUSES)) for i in range(users * 2)))
+    db_handler.cursor.executemany("INSERT INTO timesheet_entries VALUES (null, ?, ?, ?)",
+        ((i // 5 + 1, f"2023-01-0{i % 5 + 1}", rng.uniform(6, 9)) for i in range(users * 10)))
+    db_handler.conn.commit()
+
+def time_lookups(user_handler, timesheet_handler, users):
+    rng = random.Random(1)
+    timings = {}
+
+    start = time.perf_counter()
+    for _ in range(LOOKUPS):
+        user_handler.authenticate_user(f"user{rng.randrange(users)}@example.com", "password")
+    timings["authenticate_user"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(LOOKUPS):
+        timesheet_handler.get_entries_by_timesheet_id(rng.randrange(users * 2) + 1)
+    timings["get_entries_by_timesheet_id"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(LOOKUPS):
+        timesheet_handler.get_flexi_balance(rng.randrange(users) + 1)
+    timings["get_flexi_balance"] = time.perf_counter() - start
+
+    return {name: elapsed / LOOKUPS * 1e6 for name, elapsed in timings.items()}
+
+def run(users):
+    temp_folder = tempfile.mkdtemp()
+    try:
+        db_handler = DatabaseHandler(os.path.join(temp_folder, "benchmark.sqlite"))
+        user_handler = UserHandler(db_handler)
+        timesheet_handler = TimesheetHandler(db_handler)
+        populate(db_handler, users)
+
+        # Drop whichever indexes the migrations left, then replay the migrations' index statements in order to put them back
+        index_names = [row[0] for row in db_handler.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")]
+        for index_name in index_names:
+            db_handler.cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+        unindexed = time_lookups(user_handler, timesheet_handler, users)
+
+        for migration in MIGRATIONS:
+            for statement in migration.statements:
+                if statement.startswith(("CREATE INDEX", "DROP INDEX")):
+                    db_handler.cursor.execute(statement)
+        indexed = time_lookups(user_handler, timesheet_handler, users)
+
+        db_handler.close()
+        return indexed, unindexed
+    finally:
+        shutil.rmtree(temp_folder)
+
+def main(sizes):
+    print(f"{'users':>8} {'lookup':<30} {'no index (us)':>14} {'index (us)':>12}")
+    for users in sizes:
+        indexed, unindexed = run(users)
+        for name in indexed:
+            print(f"{users:>8} {name:<30} {unindexed[name]:>14.1f} {indexed[name]:>12.1f}")
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000, 100000])
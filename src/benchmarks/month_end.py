@@ -0,0 +1,203 @@
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+# Run from the src folder with: python -m benchmarks.month_end --processes 1 2 4 8 --duration 10
+
+OPERATIONS = ["login", "submit", "balance", "pending", "approve"]
+
+def employee_email(employee):
+    return f"employee{employee}@example.com"
+
+def manager_email(manager):
+    return f"manager{manager}@example.com"
+
+def create_users(db_path, employees, managers, departments):
+    db_handler = DatabaseHandler(db_path, pooled=True)
+    UserHandler(db_handler)
+    TimesheetHandler(db_handler)
+    with db_handler.transaction():
+        db_handler.insert_many("users", [(f"Employee {i}", employee_email(i), "password", departments[i % len(departments)], "Employee")
+                                         for i in range(employees)])
+        db_handler.insert_many("users", [(f"Manager {i}", manager_email(i), "password", departments[i % len(departments)], "Manager")
+                                         for i in range(managers)])
+    db_handler.close()
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)] * 1000
+
+class Recorder:
+    # Times one process's operations. Busy and locked errors, which SQLite raises once the busy timeout runs out, are
+    # counted apart from other exceptions and from operations that failed without raising.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.outcomes = defaultdict(lambda: {"failed": 0, "busy": 0, "errors": 0})
+
+    def run(self, operation, function, *args):
+        start = time.perf_counter()
+        try:
+            result = function(*args)
+        except sqlite3.OperationalError as e:
+            outcome = "busy" if "locked" in str(e) or "busy" in str(e) else "errors"
+            with self.lock:
+                self.outcomes[operation][outcome] += 1
+            return None
+        except Exception:
+            with self.lock:
+                self.outcomes[operation]["errors"] += 1
+            return None
+
+        with self.lock:
+            self.timings[operation].append(time.perf_counter() - start)
+            if result is None:
+                self.outcomes[operation]["failed"] += 1
+        return result
+
+def simulate(user_loop, recorder, user_handler, timesheet_handler, number, deadline, think_seconds, seed):
+    # Each simulated user's thread closes its pooled connection when it's done
+    try:
+        user_loop(recorder, user_handler, timesheet_handler, number, deadline, think_seconds, seed)
+    finally:
+        timesheet_handler.db_handler.release_connection()
+
+def employee(recorder, user_handler, timesheet_handler, employee_number, deadline, think_seconds, seed):
+    # Logs in, then submits a week's timesheet and checks the balance until the deadline
+    rng = random.Random(seed)
+    user = recorder.run("login", user_handler.authenticate_user, employee_email(employee_number), "password")
+    if user is None:
+        return
+
+    week = date(2030, 1, 7)
+    while time.perf_counter() < deadline:
+        hours = [round(rng.uniform(6.0, 9.0), 2) for _ in range(5)]
+        recorder.run("submit", timesheet_handler.submit_timesheet, user, week, hours)
+        recorder.run("balance", timesheet_handler.get_flexi_balance, user.user_id)
+        week += timedelta(weeks=1)
+        time.sleep(rng.uniform(0, think_seconds * 2))
+
+def manager(recorder, user_handler, timesheet_handler, manager_number, deadline, think_seconds, seed):
+    # Logs in, then approves their department's pending timesheets a page at a time until the deadline
+    rng = random.Random(seed)
+    user = recorder.run("login", user_handler.authenticate_user, manager_email(manager_number), "password")
+    if user is None:
+        return
+
+    while time.perf_counter() < deadline:
+        page = recorder.run("pending", timesheet_handler.get_timesheets_page, user.department, "Pending", None, 20)
+        if page and page[0]:
+            recorder.run("approve", timesheet_handler.set_timesheets_status,
+                         [timesheet.timesheet_id for timesheet in page[0]], "Approved", "Pending", user.department)
+        time.sleep(rng.uniform(0, think_seconds * 2))
+
+def worker(db_path, employees, managers, duration, think_seconds, busy_timeout, ready, go, results):
+    # One process of the rush: a thread for each of its employees and managers, sharing one pooled handler
+    sys.stdout = open(os.devnull, "w")
+    db_handler = DatabaseHandler(db_path, pooled=True, timeout=busy_timeout)
+    user_handler = UserHandler(db_handler)
+    timesheet_handler = TimesheetHandler(db_handler)
+    recorder = Recorder()
+
+    ready.put(os.getpid())
+    go.wait()
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=simulate, args=(employee, recorder, user_handler, timesheet_handler, number, deadline, think_seconds, number))
+               for number in employees]
+    threads += [threading.Thread(target=simulate, args=(manager, recorder, user_handler, timesheet_handler, number, deadline, think_seconds, -number - 1))
+                for number in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db_handler.close()
+    results.put((dict(recorder.timings), {operation: dict(outcome) for operation, outcome in recorder.outcomes.items()}))
+
+def run(db_path, processes, employees, managers, duration, think_seconds, busy_timeout):
+    # Employees and managers are dealt out to the processes in turn, then every process starts at once
+    context = multiprocessing.get_context()
+    ready = context.Queue()
+    results = context.Queue()
+    go = context.Event()
+    workers = [context.Process(target=worker, args=(db_path, list(range(employees))[i::processes], list(range(managers))[i::processes],
+                                                    duration, think_seconds, busy_timeout, ready, go, results))
+               for i in range(processes)]
+    for process in workers:
+        process.start()
+    for _ in workers:
+        ready.get()
+
+    start = time.perf_counter()
+    go.set()
+    timings = defaultdict(list)
+    outcomes = defaultdict(lambda: {"failed": 0, "busy": 0, "errors": 0})
+    for _ in workers:
+        process_timings, process_outcomes = results.get()
+        for operation, operation_timings in process_timings.items():
+            timings[operation].extend(operation_timings)
+        for operation, outcome in process_outcomes.items():
+            for key, count in outcome.items():
+                outcomes[operation][key] += count
+    elapsed = time.perf_counter() - start
+    for process in workers:
+        process.join()
+
+    return timings, outcomes, elapsed
+
+def report(processes, timings, outcomes, elapsed):
+    total = sum(len(operation_timings) for operation_timings in timings.values())
+    print(f"{processes} processes: {total} operations in {elapsed:.2f}s ({total / elapsed:,.0f} operations/s)")
+    print(f"{'operation':<10} {'count':>7} {'per s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'failed %':>9} {'busy %':>8} {'errors':>7}")
+    for operation in OPERATIONS:
+        operation_timings = sorted(timings.get(operation, []))
+        outcome = outcomes.get(operation, {"failed": 0, "busy": 0, "errors": 0})
+        attempts = len(operation_timings) + outcome["busy"] + outcome["errors"]
+        if not attempts:
+            continue
+
+        latencies = (f"{percentile(operation_timings, 0.5):>9.2f} {percentile(operation_timings, 0.95):>9.2f} {percentile(operation_timings, 0.99):>9.2f}"
+                     if operation_timings else f"{'-':>9} {'-':>9} {'-':>9}")
+        print(f"{operation:<10} {len(operation_timings):>7} {len(operation_timings) / elapsed:>8,.0f} {latencies} "
+              f"{outcome['failed'] / attempts * 100:>9.2f} {outcome['busy'] / attempts * 100:>8.2f} {outcome['errors']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a month-end rush of employees submitting and managers approving at once.")
+    parser.add_argument("--processes", type=int, nargs="+", default=[4], help="worker process counts to run, one after another")
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument("--managers", type=int, default=30)
+    parser.add_argument("--departments", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10, help="seconds each run lasts")
+    parser.add_argument("--think-ms", type=float, default=200, help="average pause between one user's actions")
+    parser.add_argument("--busy-timeout", type=float, default=5.0, help="seconds SQLite waits for a lock before giving up")
+    args = parser.parse_args()
+
+    departments = [f"Department {department}" for department in range(args.departments)]
+    temp_folder = tempfile.mkdtemp()
+    try:
+        source_path = os.path.join(temp_folder, "source.sqlite")
+        create_users(source_path, args.employees, args.managers, departments)
+
+        for processes in args.processes:
+            # Each run starts from the same users and no timesheets
+            db_path = os.path.join(temp_folder, f"{processes}.sqlite")
+            shutil.copyfile(source_path, db_path)
+            timings, outcomes, elapsed = run(db_path, processes, args.employees, args.managers, args.duration, args.think_ms / 1000, args.busy_timeout)
+            report(processes, timings, outcomes, elapsed)
+            print()
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.generator import SCALES, generate
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+# Run from the src folder with: python -m benchmarks.read_connection --scale medium --seconds 5
+
+MODES = {
+    "rollback journal": {"journal_mode": "DELETE"},
+    "WAL": {"journal_mode": "WAL"},
+    "separate reads": {"separate_reads": True},
+}
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)] * 1000
+
+def run(db_path, options, readers, seconds):
+    # Report threads stream every entry over and over while one thread submits timesheets, each thread on its own
+    # handler, as separate processes would be
+    stop = threading.Event()
+    timings = []
+    failures = []
+    reports = []
+
+    def reporter():
+        db_handler = DatabaseHandler(db_path, timeout=5.0, **options)
+        timesheet_handler = TimesheetHandler(db_handler)
+        while not stop.is_set():
+            hours = 0
+            for row in timesheet_handler.iter_entries(chunk_size=1000):
+                hours += row[-1] or 0
+            reports.append(hours)
+        db_handler.close()
+
+    def submitter():
+        db_handler = DatabaseHandler(db_path, timeout=5.0, **options)
+        user_handler = UserHandler(db_handler)
+        timesheet_handler = TimesheetHandler(db_handler)
+        user = user_handler.get_user_by_id(1)
+        while not stop.is_set():
+            start = time.perf_counter()
+            if timesheet_handler.submit_timesheet(user, datetime(2030, 1, 7), [7.4] * 5) is None:
+                failures.append(start)
+            else:
+                timings.append(time.perf_counter() - start)
+        db_handler.close()
+
+    threads = [threading.Thread(target=reporter) for _ in range(readers)] + [threading.Thread(target=submitter)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    timings.sort()
+    return {"submissions/s": len(timings) / seconds, "p50_ms": percentile(timings, 0.5) if timings else 0,
+            "p99_ms": percentile(timings, 0.99) if timings else 0, "failures": len(failures), "reports": len(reports)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure submission latency while long reports stream from the same database.")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--readers", type=int, default=2, help="threads streaming reports")
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]
+    temp_folder = tempfile.mkdtemp()
+    try:
+        source_path = os.path.join(temp_folder, "source.sqlite")
+        generate(source_path, scale["users"], scale["entries"], scale["departments"])
+
+        print(f"{'mode':<18} {'submissions/s':>14} {'p50 ms':>8} {'p99 ms':>8} {'failures':>9} {'reports':>8}")
+        for i, (name, options) in enumerate(MODES.items()):
+            db_path = os.path.join(temp_folder, f"{i}.sqlite")
+            shutil.copyfile(source_path, db_path)
+            result = run(db_path, options, args.readers, args.seconds)
+            print(f"{name:<18} {result['submissions/s']:>14,.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['failures']:>9} {result['reports']:>8}")
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from model import DatabaseHandler, ShardedDatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+# Run from the src folder with: python -m benchmarks.sharding --departments 8 --employees 8 --submissions 20
+
+def run(db_handler, departments, employees, submissions):
+    # Every employee thread submits timesheets to its own department, then an org-wide balance check reads every department
+    user_handler = UserHandler(db_handler)
+    timesheet_handler = TimesheetHandler(db_handler)
+    users = [user_handler.get_user_by_id(user_handler.create_user(f"Employee {d}-{i}", f"employee{d}-{i}@example.com", "password", f"Department {d}", "Employee"))
+             for d in range(departments) for i in range(employees)]
+    failures = []
+
+    def employee(user):
+        for week in range(submissions):
+            if timesheet_handler.submit_timesheet(user, datetime(2030, 1, 7), [7.4] * 5) is None:
+                failures.append(user.user_id)
+        db_handler.release_connection()
+
+    threads = [threading.Thread(target=employee, args=(user,)) for user in users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    submit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mismatches = timesheet_handler.check_flexi_balances()
+    check_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for user in users[:100]:
+        timesheet_handler.get_flexi_balance(user.user_id)
+    balance_ms = (time.perf_counter() - start) / min(len(users), 100) * 1000
+
+    assert mismatches == {}
+    return {"submissions/s": len(users) * submissions / submit_seconds, "check_s": check_seconds, "balance_ms": balance_ms, "failures": len(failures)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare one database with a shard per department.")
+    parser.add_argument("--departments", type=int, default=8)
+    parser.add_argument("--employees", type=int, default=8, help="employees, and so threads, per department")
+    parser.add_argument("--submissions", type=int, default=20, help="timesheets each employee submits")
+    parser.add_argument("--workers", type=int, default=8, help="threads the sharded handler fans queries out on")
+    args = parser.parse_args()
+
+    modes = {
+        "single database": lambda db_path: DatabaseHandler(db_path, pooled=True),
+        "sharded": lambda db_path: ShardedDatabaseHandler(db_path, max_workers=args.workers),
+        "sharded, serial": lambda db_path: ShardedDatabaseHandler(db_path, max_workers=0),
+    }
+
+    print(f"{'mode':<16} {'submissions/s':>14} {'balance check s':>16} {'balance ms':>11} {'failures':>9}")
+    for name, create_db_handler in modes.items():
+        temp_folder = tempfile.mkdtemp()
+        db_handler = create_db_handler(os.path.join(temp_folder, "sharding.sqlite"))
+        try:
+            result = run(db_handler, args.departments, args.employees, args.submissions)
+        finally:
+            db_handler.close()
+            shutil.rmtree(temp_folder)
+        print(f"{name:<16} {result['submissions/s']:>14,.0f} {result['check_s']:>16.3f} {result['balance_ms']:>11.3f} {result['failures']:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+# Run from the src folder with: python -m benchmarks.startup --runs 20
+
+# Each entry point is imported in a fresh interpreter, then builds its handlers and runs its first query
+ENTRY_POINTS = {
+    "presenter": "import presenter",
+    "main": "import main",
+    "server": "import server",
+    "importer": "import importer",
+    "exporter": "import exporter",
+}
+FIRST_QUERY = """
+import json, sys, time
+start = time.perf_counter()
+{import_statement}
+imported = time.perf_counter()
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+db_handler = DatabaseHandler(sys.argv[1])
+UserHandler(db_handler)
+TimesheetHandler(db_handler).get_flexi_balance(1)
+done = time.perf_counter()
+heavy = [name for name in ("PySimpleGUI", "tkinter", "numpy") if name in sys.modules]
+print(json.dumps({{"import_ms": (imported - start) * 1000, "first_query_ms": (done - imported) * 1000, "modules": len(sys.modules), "heavy": heavy}}))
+"""
+
+def run_entry_point(import_statement, db_path):
+    # Returns the timings printed by the child, plus the wall time of the whole interpreter
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", FIRST_QUERY.format(import_statement=import_statement), db_path],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["wall_ms"] = wall_ms
+    return timings, None
+
+def handler_construction_us(db_path, iterations):
+    db_handler = DatabaseHandler(db_path)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        UserHandler(db_handler)
+        TimesheetHandler(db_handler)
+    elapsed = time.perf_counter() - start
+    db_handler.close()
+    return elapsed / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Time cold imports and first queries of each entry point.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=1000, help="handler pairs built to time schema checks")
+    args = parser.parse_args()
+
+    temp_folder = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(temp_folder, "startup.sqlite")
+        handler_construction_us(db_path, 1)
+
+        print(f"{'entry point':<12} {'wall ms':>9} {'import ms':>10} {'query ms':>9} {'modules':>8}  heavy modules")
+        for name, import_statement in ENTRY_POINTS.items():
+            runs = []
+            for _ in range(args.runs):
+                timings, error = run_entry_point(import_statement, db_path)
+                if error:
+                    break
+                runs.append(timings)
+
+            if error:
+                print(f"{name:<12} failed: {error}")
+                continue
+
+            print(f"{name:<12} {statistics.median(run['wall_ms'] for run in runs):>9.1f} {statistics.median(run['import_ms'] for run in runs):>10.1f} "
+                  f"{statistics.median(run['first_query_ms'] for run in runs):>9.2f} {runs[0]['modules']:>8}  {', '.join(runs[0]['heavy']) or '-'}")
+
+        print(f"Building a UserHandler and TimesheetHandler on an open connection: {handler_construction_us(db_path, args.iterations):.1f} us")
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from model import DatabaseHandler
+from presenter import UserHandler
+
+# Run from the src folder with: python -m benchmarks.statement_cache [calls]
+USERS = 1000
+
+def time_calls(calls, function):
+    start = time.perf_counter()
+    for i in range(calls):
+        function(i % USERS)
+    return (time.perf_counter() - start) / calls * 1e6
+
+def main(calls):
+    temp_folder = tempfile.mkdtemp()
+    try:
+        db_handler = DatabaseHandler(os.path.join(temp_folder, "benchmark.sqlite"))
+        user_handler = UserHandler(db_handler)
+        db_handler.insert_many("users", [(f"User {i}", f"user{i}@example.com", "password", "IT", "Employee") for i in range(USERS)])
+
+        # Formatting values into the SQL text, as the presenters used to, gives a distinct statement per value
+        literal = {
+            "authenticate_user": lambda i: db_handler.get_data(["*"], "users", [f"email = 'user{i}@example.com'", "password = 'password'"]),
+            "get_user_by_id": lambda i: db_handler.get_data(["*"], "users", [f"user_id == {i + 1}"]),
+        }
+        bound = {
+            "authenticate_user": lambda i: user_handler.authenticate_user(f"user{i}@example.com", "password"),
+            "get_user_by_id": lambda i: user_handler.get_user_by_id(i + 1),
+        }
+
+        print(f"{'call':<20} {'literal SQL (us)':>17} {'bound params (us)':>18}")
+        for name in literal:
+            print(f"{name:<20} {time_calls(calls, literal[name]):>17.1f} {time_calls(calls, bound[name]):>18.1f}")
+        print(db_handler.get_statement_cache_stats())
+
+        db_handler.close()
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
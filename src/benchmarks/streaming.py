@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+# Run from the src folder with: python -m benchmarks.streaming [entries]
+QUERY = "SELECT entry_id, timesheet_id, date, hours_worked FROM timesheet_entries"
+
+def populate(db_path, entries):
+    db_handler = DatabaseHandler(db_path)
+    UserHandler(db_handler)
+    TimesheetHandler(db_handler)
+    db_handler.insert_many("timesheet_entries", ((i // 5 + 1, f"2023-01-0{i % 5 + 1}", 7.4) for i in range(entries)))
+    db_handler.close()
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def scan(db_path, mode, results):
+    db_handler = DatabaseHandler(db_path)
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    total = 0
+    if mode == "query_data":
+        rows, error = db_handler.query_data(QUERY)
+        for row in rows:
+            total += row["hours_worked"]
+    else:
+        row_type = {"iter dict": dict, "iter tuple": tuple, "iter sqlite3.Row": sqlite3.Row}[mode]
+        rows, error = db_handler.iter_query_data(QUERY, row_type=row_type)
+        for row in rows:
+            total += row[3] if row_type is tuple else row["hours_worked"]
+
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    db_handler.close()
+    results.put((mode, elapsed, peak / 1024 / 1024, peak_rss_kb()))
+
+def main(entries):
+    temp_folder = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(temp_folder, "benchmark.sqlite")
+        populate(db_path, entries)
+
+        print(f"{'mode':<18} {'seconds':>8} {'peak python MB':>15} {'peak RSS KB':>12}")
+        # Each scan runs in a fresh process so the peak RSS belongs to that scan alone
+        results = multiprocessing.Queue()
+        for mode in ["query_data", "iter dict", "iter tuple", "iter sqlite3.Row"]:
+            process = multiprocessing.Process(target=scan, args=(db_path, mode, results))
+            process.start()
+            mode, elapsed, peak, rss = results.get()
+            process.join()
+            print(f"{mode:<18} {elapsed:>8.2f} {peak:>15.1f} {rss if rss is not None else 'n/a':>12}")
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
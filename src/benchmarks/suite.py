@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.generator import SCALES, department_name, generate, user_email
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+# Run from the src folder with: python -m benchmarks.suite --scale small medium --output results.json
+# and compare two runs with: python -m benchmarks.suite --compare before.json after.json
+
+def time_operation(operation, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        operation(i)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": statistics.mean(timings) * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1000,
+        "max_ms": timings[-1] * 1000,
+        "ops_per_second": iterations / sum(timings),
+    }
+
+def run_scale(db_path, scale, iterations, seed):
+    rng = random.Random(seed)
+    db_handler = DatabaseHandler(db_path)
+    user_handler = UserHandler(db_handler)
+    timesheet_handler = TimesheetHandler(db_handler)
+
+    users = [rng.randrange(scale["users"]) + 1 for _ in range(iterations)]
+    departments = [department_name(rng.randrange(scale["departments"])) for _ in range(iterations)]
+
+    results = {
+        "authenticate_user": time_operation(lambda i: user_handler.authenticate_user(user_email(users[i]), "password"), iterations),
+        "get_timesheets_by_status": time_operation(lambda i: timesheet_handler.get_timesheets_by_status(departments[i], "Pending"), iterations),
+        "get_flexi_balance": time_operation(lambda i: timesheet_handler.get_flexi_balance(users[i]), iterations),
+    }
+
+    submitted = []
+    submitters = [user_handler.get_user_by_id(user_id) for user_id in users]
+    results["submit_timesheet"] = time_operation(
+        lambda i: submitted.append(timesheet_handler.submit_timesheet(submitters[i], datetime(2030, 1, 7), [7.4] * 5)), iterations)
+    results["set_timesheet_status"] = time_operation(lambda i: timesheet_handler.set_timesheet_status(submitted[i], "Approved"), iterations)
+
+    db_handler.close()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(scales, iterations, seed, data_folder = None):
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "seed": seed,
+        "scales": {},
+    }
+
+    temp_folder = tempfile.mkdtemp()
+    try:
+        for name in scales:
+            scale = SCALES[name]
+            db_path = os.path.join(temp_folder, f"{name}.sqlite")
+
+            # Generated databases can be kept in data_folder and reused, as the large scale takes a while to build
+            if data_folder:
+                cached_path = os.path.join(data_folder, f"{name}-{seed}.sqlite")
+                if not os.path.exists(cached_path):
+                    print(f"Generating {name} database")
+                    generate(cached_path, seed=seed, **scale)
+                shutil.copyfile(cached_path, db_path)
+            else:
+                print(f"Generating {name} database")
+                generate(db_path, seed=seed, **scale)
+
+            print(f"Running {name} benchmarks")
+            results["scales"][name] = {"parameters": scale, "operations": run_scale(db_path, scale, iterations, seed)}
+    finally:
+        shutil.rmtree(temp_folder)
+
+    return results
+
+def print_results(results):
+    print(f"{'scale':<8} {'operation':<26} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>10}")
+    for name, scale in results["scales"].items():
+        for operation, timing in scale["operations"].items():
+            print(f"{name:<8} {operation:<26} {timing['mean_ms']:>9.3f} {timing['p50_ms']:>9.3f} {timing['p95_ms']:>9.3f} {timing['ops_per_second']:>10.0f}")
+
+def compare(before, after):
+    print(f"{'scale':<8} {'operation':<26} {'before p50':>11} {'after p50':>10} {'change':>8}")
+    for name, scale in after["scales"].items():
+        for operation, timing in scale["operations"].items():
+            previous = before["scales"].get(name, {}).get("operations", {}).get(operation)
+            if previous:
+                change = (timing["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"] * 100
+                print(f"{name:<8} {operation:<26} {previous['p50_ms']:>11.3f} {timing['p50_ms']:>10.3f} {change:>+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the main presenter operations against generated databases.")
+    parser.add_argument("--scale", nargs="+", choices=SCALES, default=["small"])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-folder", help="folder to keep generated databases in between runs")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two results files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    results = run(args.scale, args.iterations, args.seed, args.data_folder)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler, WriteBehindQueue
+
+# Run from the src folder with: python -m benchmarks.write_behind --employees 64 --submissions 20
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)] * 1000
+
+def run(db_path, employees, submissions, write_behind_options):
+    # Each employee thread submits its timesheets one after another, waiting for each to be committed
+    db_handler = DatabaseHandler(db_path, pooled=True)
+    user_handler = UserHandler(db_handler)
+    write_behind = WriteBehindQueue(db_handler, **write_behind_options) if write_behind_options is not None else None
+    timesheet_handler = TimesheetHandler(db_handler, write_behind=write_behind)
+    users = [user_handler.get_user_by_id(user_handler.create_user(f"Employee {i}", f"employee{i}@example.com", "password", "IT", "Employee"))
+             for i in range(employees)]
+
+    timings = []
+    failures = []
+
+    def employee(user):
+        for week in range(submissions):
+            start = time.perf_counter()
+            if write_behind is None:
+                timesheet_id = timesheet_handler.submit_timesheet(user, datetime(2030, 1, 7), [7.4] * 5)
+            else:
+                timesheet_id = timesheet_handler.submit_timesheet_async(user, datetime(2030, 1, 7), [7.4] * 5).result()
+            timings.append(time.perf_counter() - start)
+            if timesheet_id is None:
+                failures.append(user.user_id)
+        db_handler.release_connection()
+
+    threads = [threading.Thread(target=employee, args=(user,)) for user in users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    commits = write_behind.batches if write_behind else len(timings)
+    if write_behind:
+        write_behind.close()
+    db_handler.close()
+
+    timings.sort()
+    return {"submissions/s": len(timings) / elapsed, "p50_ms": percentile(timings, 0.5), "p95_ms": percentile(timings, 0.95),
+            "p99_ms": percentile(timings, 0.99), "commits": commits, "failures": len(failures)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-row commits with the write-behind queue's group commits.")
+    parser.add_argument("--employees", type=int, default=64)
+    parser.add_argument("--submissions", type=int, default=20, help="timesheets each employee submits")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--batch-delay-ms", type=float, nargs="+", default=[2, 10])
+    args = parser.parse_args()
+
+    modes = {"per-row commits": None}
+    for delay in args.batch_delay_ms:
+        modes[f"write-behind {delay:g} ms"] = {"max_batch_size": args.batch_size, "max_delay_ms": delay}
+
+    print(f"{'mode':<22} {'submissions/s':>14} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'commits':>8} {'failures':>9}")
+    for name, options in modes.items():
+        temp_folder = tempfile.mkdtemp()
+        try:
+            result = run(os.path.join(temp_folder, "write_behind.sqlite"), args.employees, args.submissions, options)
+        finally:
+            shutil.rmtree(temp_folder)
+        print(f"{name:<22} {result['submissions/s']:>14,.0f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+              f"{result['commits']:>8} {result['failures']:>9}")
+
+if __name__ == "__main__":
+    main()
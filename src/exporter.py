@@ -0,0 +1,108 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from model import DatabaseHandler
+from presenter import TimesheetHandler
+
+ENTRY_FIELDS = ["timesheet_id", "user_id", "department", "status", "date", "hours_worked"]
+BALANCE_FIELDS = ["user_id", "name", "department", "flexi_balance"]
+
+def write_rows(path, fields, rows, file_format = "csv", chunk_size = 10000):
+    # Rows are pulled from the iterator and written a chunk at a time, so only one chunk is ever held in memory
+    row_count = 0
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            writer = csv.writer(file)
+            writer.writerow(fields)
+
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return row_count
+
+            if file_format == "csv":
+                writer.writerows(chunk)
+            else:
+                file.write("".join(json.dumps(dict(zip(fields, row))) + "\n" for row in chunk))
+            row_count += len(chunk)
+
+def output_path(output_folder, name, kind, file_format):
+    # Names that had to be changed get a hash of the original after a ".", which no unchanged name can contain, so
+    # "R&D" and "R D" don't both become R_D
+    safe_name = re.sub(r"[^A-Za-z0-9_-]", "_", str(name))
+    if safe_name != str(name):
+        safe_name += "." + hashlib.sha1(str(name).encode("utf-8")).hexdigest()[:10]
+    return os.path.join(output_folder, f"{safe_name}_{kind}.{file_format}")
+
+def export(db_path, output_folder, file_format = "csv", department = None, user_id = None):
+    # Exports one department's or one user's entries and flexi balances, returning (rows written, seconds taken).
+    # Opens its own DatabaseHandler so it can run in a separate process.
+    start = time.perf_counter()
+    db_handler = DatabaseHandler(db_path)
+    timesheet_handler = TimesheetHandler(db_handler)
+    name = department if department is not None else f"user_{user_id}"
+
+    row_count = write_rows(output_path(output_folder, name, "entries", file_format), ENTRY_FIELDS,
+                           timesheet_handler.iter_entries(department, user_id), file_format)
+    row_count += write_rows(output_path(output_folder, name, "balances", file_format), BALANCE_FIELDS,
+                            timesheet_handler.iter_flexi_balances(department, user_id), file_format)
+
+    db_handler.close()
+    return row_count, time.perf_counter() - start
+
+def export_departments(db_path, output_folder, departments, file_format = "csv", processes = 1):
+    # Returns {department: (rows written, seconds taken)}, exporting departments in parallel when processes > 1.
+    # Names differing only in case would share a file on Windows and macOS, so they are refused before anything is written.
+    paths = {}
+    for department in departments:
+        path = output_path(output_folder, department, "entries", file_format).lower()
+        if path in paths:
+            raise ValueError(f"Departments {paths[path]!r} and {department!r} would be exported to the same file")
+        paths[path] = department
+
+    if processes <= 1:
+        return {department: export(db_path, output_folder, file_format, department) for department in departments}
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {department: executor.submit(export, db_path, output_folder, file_format, department) for department in departments}
+        return {department: future.result() for department, future in futures.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Export timesheets, timesheet entries and flexi balances to CSV or JSONL files.")
+    parser.add_argument("--database", default="database.sqlite")
+    parser.add_argument("--output", default=".", help="folder to write the exported files to")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--department", action="append", default=[], help="department to export, all departments if omitted")
+    parser.add_argument("--user", action="append", type=int, default=[], help="user ID to export instead of departments")
+    parser.add_argument("--processes", type=int, default=1, help="number of departments to export in parallel")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    start = time.perf_counter()
+
+    if args.user:
+        results = {f"user {user_id}": export(args.database, args.output, args.format, user_id=user_id) for user_id in args.user}
+    else:
+        departments = args.department
+        if not departments:
+            db_handler = DatabaseHandler(args.database)
+            departments = TimesheetHandler(db_handler).get_departments()
+            db_handler.close()
+        results = export_departments(args.database, args.output, departments, args.format, args.processes)
+
+    for name, (row_count, elapsed) in results.items():
+        print(f"{name}: {row_count} rows in {elapsed:.1f}s ({row_count / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    total = sum(row_count for row_count, elapsed in results.values())
+    elapsed = time.perf_counter() - start
+    print(f"Exported {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import unittest
+import tempfile
+import os
+import shutil
+import csv
+import json
+from datetime import datetime
+
+from exporter import export, export_departments, output_path, write_rows
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_folder, "test_db.sqlite")
+        self.db_handler = DatabaseHandler(self.db_path)
+        self.user_handler = UserHandler(self.db_handler)
+        self.timesheet_handler = TimesheetHandler(self.db_handler)
+
+        for name, department in [("Donna Noble", "IT"), ("Martha Jones", "HR")]:
+            user = self.user_handler.get_user_by_id(self.user_handler.create_user(name, f"{name.split()[0].lower()}@example.com", "password", department, "Employee"))
+            self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [8.4] * 5)
+
+    def tearDown(self):
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def read_csv(self, name):
+        with open(os.path.join(self.temp_folder, name), newline="") as file:
+            return list(csv.DictReader(file))
+
+    def test_export_department_csv(self):
+        row_count, elapsed = export(self.db_path, self.temp_folder, department = "IT")
+        self.assertEqual(row_count, 6)
+        entries = self.read_csv("IT_entries.csv")
+        self.assertEqual(len(entries), 5)
+        self.assertEqual(entries[0]["date"], "2023-01-02")
+        self.assertEqual({entry["department"] for entry in entries}, {"IT"})
+        balances = self.read_csv("IT_balances.csv")
+        self.assertEqual(balances[0]["name"], "Donna Noble")
+        self.assertAlmostEqual(float(balances[0]["flexi_balance"]), 5.0)
+
+    def test_export_user_jsonl(self):
+        row_count, elapsed = export(self.db_path, self.temp_folder, "jsonl", user_id = 2)
+        with open(os.path.join(self.temp_folder, "user_2_entries.jsonl")) as file:
+            entries = [json.loads(line) for line in file]
+        self.assertEqual(len(entries), 5)
+        self.assertEqual(entries[0]["user_id"], 2)
+        self.assertEqual(entries[0]["hours_worked"], 8.4)
+
+    def test_export_departments_in_parallel(self):
+        results = export_departments(self.db_path, self.temp_folder, self.timesheet_handler.get_departments(), processes = 2)
+        self.assertEqual(sorted(results), ["HR", "IT"])
+        self.assertEqual(len(self.read_csv("HR_entries.csv")), 5)
+
+    def test_departments_with_the_same_safe_name(self):
+        for name, department in [("Rose Tyler", "R&D"), ("Mickey Smith", "R D")]:
+            user = self.user_handler.get_user_by_id(self.user_handler.create_user(name, f"{name.split()[0].lower()}@example.com", "password", department, "Employee"))
+            self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [7.4] * len(department))
+        export_departments(self.db_path, self.temp_folder, ["R&D", "R D"], processes = 2)
+
+        paths = [output_path(self.temp_folder, department, "entries", "csv") for department in ["R&D", "R D"]]
+        self.assertNotEqual(paths[0], paths[1])
+        self.assertEqual([len(self.read_csv(os.path.basename(path))) for path in paths], [3, 3])
+        self.assertEqual(self.read_csv(os.path.basename(paths[0]))[0]["department"], "R&D")
+        with self.assertRaises(ValueError):
+            export_departments(self.db_path, self.temp_folder, ["IT", "it"])
+
+    def test_write_rows_chunks(self):
+        path = os.path.join(self.temp_folder, "rows.csv")
+        row_count = write_rows(path, ["value"], iter([(i,) for i in range(25)]), chunk_size = 10)
+        self.assertEqual(row_count, 25)
+        self.assertEqual(len(self.read_csv("rows.csv")), 25)
@@ -0,0 +1,153 @@
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+STATUSES = {"Pending", "Approved", "Denied"}
+DATE_FORMATS = ["%d-%m-%Y", "%Y-%m-%d"]
+
+def optional_id(value):
+    return int(value) if value not in (None, "") else None
+
+def validate_user(record):
+    if not record.get("email"):
+        raise ValueError("missing email")
+    return (optional_id(record.get("user_id")), record.get("name", ""), record["email"], record.get("password", ""),
+            record.get("department", ""), record.get("role", "Employee"))
+
+def validate_timesheet(record):
+    if record.get("status") not in STATUSES:
+        raise ValueError(f"invalid status {record.get('status')!r}")
+    return (optional_id(record.get("timesheet_id")), int(record["user_id"]), record.get("department", ""), record["status"])
+
+# Imports repeat the same few thousand dates millions of times, and strptime dominates the cost of validation
+@lru_cache(maxsize=65536)
+def normalise_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            # Dates are stored as yyyy-mm-dd so they sort and compare in date order
+            return datetime.strptime(value, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    raise ValueError(f"invalid date {value!r}")
+
+def validate_entry(record):
+    date = normalise_date(str(record["date"]))
+
+    hours_worked = float(record["hours_worked"])
+    if not 0 <= hours_worked <= 24:
+        raise ValueError(f"hours worked {hours_worked} outside 0-24")
+
+    return (optional_id(record.get("entry_id")), int(record["timesheet_id"]), date, hours_worked)
+
+# Table, columns and validator for each kind of file that can be imported
+IMPORTS = {
+    "users": ("users", ["user_id", "name", "email", "password", "department", "role"], validate_user),
+    "timesheets": ("timesheets", ["timesheet_id", "user_id", "department", "status"], validate_timesheet),
+    "entries": ("timesheet_entries", ["entry_id", "timesheet_id", "date", "hours_worked"], validate_entry),
+}
+
+def read_records(path):
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+class Importer:
+    progress_table_name = "import_progress"
+
+    def __init__(self, db_handler, chunk_size = 50000):
+        self.db_handler = db_handler
+        self.chunk_size = chunk_size
+
+        UserHandler(db_handler)
+        TimesheetHandler(db_handler)
+        self.db_handler.create_table(self.progress_table_name, {"progress_id":"INTEGER PRIMARY KEY", "source":"TEXT UNIQUE", "rows_done":"INTEGER"})
+
+    def _get_progress(self, source):
+        result, error = self.db_handler.get_data(["rows_done"], self.progress_table_name, {"source": source})
+        if result:
+            return result[0]["rows_done"]
+
+        self.db_handler.insert_data(self.progress_table_name, (source, 0))
+        return 0
+
+    def _validate(self, records, validator, rejected):
+        for line, record in records:
+            try:
+                yield validator(record)
+            except (KeyError, TypeError, ValueError) as e:
+                rejected.append((line, str(e)))
+
+    def import_file(self, kind, path):
+        # Returns (rows imported, [(record number, reason)] rejected, error). Each chunk is committed together with the
+        # number of records consumed so far, so an interrupted import picks up after the last committed chunk.
+        table_name, columns, validator = IMPORTS[kind]
+        source = f"{kind}:{os.path.abspath(path)}"
+        rows_done = self._get_progress(source)
+
+        records = islice(enumerate(read_records(path), start=1), rows_done, None)
+        imported = 0
+        rejected = []
+
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                return imported, rejected, None
+
+            rows = list(self._validate(chunk, validator, rejected))
+            with self.db_handler.transaction():
+                row_count, error = self.db_handler.insert_many(table_name, rows, columns)
+                if not error:
+                    error = self.db_handler.update_data(self.progress_table_name, {"rows_done": chunk[-1][0]}, {"source": source})
+
+            if error:
+                return imported, rejected, error
+            imported += row_count
+
+def main():
+    parser = argparse.ArgumentParser(description="Import users, timesheets and timesheet entries from CSV or JSONL files.")
+    parser.add_argument("--database", default="database.sqlite")
+    parser.add_argument("--users", action="append", default=[], help="CSV or JSONL file of users")
+    parser.add_argument("--timesheets", action="append", default=[], help="CSV or JSONL file of timesheets")
+    parser.add_argument("--entries", action="append", default=[], help="CSV or JSONL file of timesheet entries")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    db_handler = DatabaseHandler(args.database, journal_mode="WAL", synchronous="NORMAL")
+    importer = Importer(db_handler, args.chunk_size)
+
+    # Users first, then timesheets, then entries, so every row's parent already exists
+    start = time.perf_counter()
+    total = 0
+    for kind in ["users", "timesheets", "entries"]:
+        for path in getattr(args, kind):
+            file_start = time.perf_counter()
+            imported, rejected, error = importer.import_file(kind, path)
+            elapsed = time.perf_counter() - file_start
+            total += imported
+
+            print(f"{path}: imported {imported} {kind} in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):,.0f} rows/s), rejected {len(rejected)}")
+            for line, reason in rejected[:10]:
+                print(f"  record {line}: {reason}")
+            if error:
+                print(f"Import stopped, re-run to resume from the last committed chunk: {error}")
+                db_handler.close()
+                return
+
+    elapsed = time.perf_counter() - start
+    print(f"Imported {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+    db_handler.close()
+
+if __name__ == "__main__":
+    main()
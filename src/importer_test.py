@@ -0,0 +1,69 @@
+import unittest
+import tempfile
+import os
+import shutil
+import json
+
+from importer import Importer
+from model import DatabaseHandler
+from presenter import TimesheetHandler
+
+class TestImporter(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        db_path = os.path.join(self.temp_folder, "test_db.sqlite")
+        self.db_handler = DatabaseHandler(db_path)
+        self.importer = Importer(self.db_handler, chunk_size = 2)
+
+    def tearDown(self):
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.temp_folder, name)
+        with open(path, "w", newline="") as file:
+            file.write(content)
+        return path
+
+    def test_import_users_timesheets_and_entries(self):
+        users = self.write_file("users.csv", "user_id,name,email,password,department,role\n7,Rory Williams,rory@example.com,pond,IT,Employee\n")
+        timesheets = self.write_file("timesheets.jsonl", json.dumps({"timesheet_id": 3, "user_id": 7, "department": "IT", "status": "Approved"}) + "\n")
+        entries = self.write_file("entries.csv", "timesheet_id,date,hours_worked\n3,2023-01-02,8.4\n3,03-01-2023,8.4\n3,04-01-2023,8.4\n")
+
+        self.assertEqual(self.importer.import_file("users", users), (1, [], None))
+        self.assertEqual(self.importer.import_file("timesheets", timesheets), (1, [], None))
+        self.assertEqual(self.importer.import_file("entries", entries), (3, [], None))
+
+        timesheet_handler = TimesheetHandler(self.db_handler)
+        timesheet = timesheet_handler.get_timesheet_by_id(3)
+        self.assertEqual(timesheet.employee_id, 7)
+        self.assertEqual(timesheet.worked_hours, {"2023-01-02": 8.4, "2023-01-03": 8.4, "2023-01-04": 8.4})
+        self.assertAlmostEqual(timesheet_handler.get_flexi_balance(7, daily_expected_hours=8), 1.2)
+
+    def test_import_rejects_invalid_records(self):
+        entries = self.write_file("entries.csv", "timesheet_id,date,hours_worked\n1,2023-01-02,8\n1,2023-02-30,8\n1,2023-01-03,25\n1,2023-01-04,seven\n")
+        imported, rejected, error = self.importer.import_file("entries", entries)
+        self.assertIsNone(error)
+        self.assertEqual(imported, 1)
+        self.assertEqual([line for line, reason in rejected], [2, 3, 4])
+
+    def test_import_resumes_after_committed_chunks(self):
+        users = self.write_file("users.jsonl", "".join(json.dumps({"user_id": i, "email": f"user{i}@example.com"}) + "\n" for i in range(1, 4)))
+        self.importer.import_file("users", users)
+        with open(users, "a") as file:
+            file.write(json.dumps({"user_id": 4, "email": "user4@example.com"}) + "\n")
+
+        imported, rejected, error = self.importer.import_file("users", users)
+        self.assertIsNone(error)
+        self.assertEqual(imported, 1)
+        result, error = self.db_handler.get_data(["COUNT(*) AS total"], "users")
+        self.assertEqual(result[0]["total"], 4)
+
+    def test_import_failed_chunk_is_rolled_back(self):
+        users = self.write_file("users.csv", "user_id,email\n1,one@example.com\n2,two@example.com\n3,three@example.com\n3,duplicate@example.com\n")
+        imported, rejected, error = self.importer.import_file("users", users)
+        self.assertIsNotNone(error)
+        self.assertEqual(imported, 2)
+        result, error = self.db_handler.get_data(["user_id"], "users")
+        self.assertEqual(result, [{"user_id": 1}, {"user_id": 2}])
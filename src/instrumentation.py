@@ -0,0 +1,170 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# Upper bounds, in milliseconds, of the latency histogram buckets
+HISTOGRAM_BUCKETS_MS = [0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, float("inf")]
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+def statement_shape(query):
+    # Collapses literals and IN lists so the same statement with different values or batch sizes counts as one shape
+    shape = STRING_LITERAL.sub("?", query)
+    shape = NUMBER_LITERAL.sub("?", shape)
+    shape = PLACEHOLDER_LIST.sub("(?, ...)", shape)
+    return WHITESPACE.sub(" ", shape).strip()
+
+class StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * len(HISTOGRAM_BUCKETS_MS)
+
+    def record(self, seconds, rows):
+        self.count += 1
+        self.rows += max(rows, 0)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+        milliseconds = seconds * 1000
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if milliseconds <= bound:
+                self.histogram[i] += 1
+                break
+
+    def to_dict(self):
+        return {"count": self.count, "rows": self.rows, "total_ms": self.total_seconds * 1000,
+                "mean_ms": self.total_seconds * 1000 / self.count if self.count else 0, "max_ms": self.max_seconds * 1000,
+                "histogram": dict(zip(map(str, HISTOGRAM_BUCKETS_MS), self.histogram))}
+
+class SpanStats:
+    def __init__(self):
+        self.calls = 0
+        self.queries = 0
+        self.total_seconds = 0.0
+        self.statements = Counter()
+
+    def to_dict(self):
+        return {"calls": self.calls, "queries": self.queries, "total_ms": self.total_seconds * 1000,
+                "statements": dict(self.statements)}
+
+class QueryInstrumentation:
+    def __init__(self, slow_query_ms = 100, slow_query_log_size = 100, explain_slow_queries = True):
+        # Passed to DatabaseHandler(instrumentation=...), which calls record_query, record_commit and record_rollback.
+        # Handlers without instrumentation skip all of this with a single None check per statement.
+        self.slow_query_ms = slow_query_ms
+        self.explain_slow_queries = explain_slow_queries
+        self.slow_queries = deque(maxlen=slow_query_log_size)
+        self.commits = 0
+        self.rollbacks = 0
+
+        self._statements = {}
+        self._shapes = {}
+        self._spans = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _shape(self, query):
+        shape = self._shapes.get(query)
+        if shape is None:
+            shape = statement_shape(query)
+            if len(self._shapes) < 10000:
+                self._shapes[query] = shape
+        return shape
+
+    def _current_span(self):
+        stack = getattr(self._local, "spans", None)
+        return stack[-1] if stack else None
+
+    def record_query(self, db_handler, query, parameters, seconds, rows):
+        shape = self._shape(query)
+        span = self._current_span()
+
+        with self._lock:
+            statement = self._statements.get(shape)
+            if statement is None:
+                statement = self._statements[shape] = StatementStats()
+            statement.record(seconds, rows)
+
+            if span is not None:
+                self._spans[span].queries += 1
+                self._spans[span].statements[shape] += 1
+
+        if seconds * 1000 >= self.slow_query_ms:
+            plan = db_handler.explain(query, parameters) if self.explain_slow_queries else None
+            self.slow_queries.append({"query": query, "parameters": list(parameters), "duration_ms": seconds * 1000,
+                                      "rows": rows, "span": span, "plan": plan})
+
+    def record_commit(self):
+        with self._lock:
+            self.commits += 1
+
+    def record_rollback(self):
+        with self._lock:
+            self.rollbacks += 1
+
+    @contextmanager
+    def span(self, name):
+        # Attributes every query run inside the block, on this thread, to the named action
+        stack = getattr(self._local, "spans", None)
+        if stack is None:
+            stack = self._local.spans = []
+
+        stack.append(name)
+        with self._lock:
+            if name not in self._spans:
+                self._spans[name] = SpanStats()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stack.pop()
+            with self._lock:
+                self._spans[name].calls += 1
+                self._spans[name].total_seconds += time.perf_counter() - start
+
+    def get_report(self):
+        with self._lock:
+            return {
+                "statements": {shape: statement.to_dict() for shape, statement in self._statements.items()},
+                "spans": {name: span.to_dict() for name, span in self._spans.items()},
+                "commits": self.commits,
+                "rollbacks": self.rollbacks,
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._spans.clear()
+            self.slow_queries.clear()
+            self.commits = 0
+            self.rollbacks = 0
+
+    def format_report(self, limit = 10):
+        report = self.get_report()
+        lines = [f"{report['commits']} commits, {report['rollbacks']} rollbacks", "",
+                 f"{'count':>8} {'rows':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9}  statement"]
+
+        statements = sorted(report["statements"].items(), key=lambda item: item[1]["total_ms"], reverse=True)
+        for shape, statement in statements[:limit]:
+            lines.append(f"{statement['count']:>8} {statement['rows']:>8} {statement['total_ms']:>10.2f} {statement['mean_ms']:>9.3f} {statement['max_ms']:>9.3f}  {shape[:100]}")
+
+        if report["spans"]:
+            lines += ["", f"{'calls':>8} {'queries':>8} {'total ms':>10}  span"]
+            for name, span in sorted(report["spans"].items(), key=lambda item: item[1]["total_ms"], reverse=True):
+                lines.append(f"{span['calls']:>8} {span['queries']:>8} {span['total_ms']:>10.2f}  {name}")
+
+        for slow_query in report["slow_queries"][-limit:]:
+            lines += ["", f"Slow query ({slow_query['duration_ms']:.1f} ms, span {slow_query['span']}): {slow_query['query']}"]
+            lines += [f"    {step}" for step in slow_query["plan"] or []]
+
+        return "\n".join(lines)
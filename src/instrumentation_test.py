@@ -0,0 +1,81 @@
+import unittest
+import tempfile
+import os
+import shutil
+from datetime import datetime
+
+from instrumentation import QueryInstrumentation, statement_shape
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+
+class TestQueryInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.instrumentation = QueryInstrumentation()
+        self.db_handler = DatabaseHandler(os.path.join(self.temp_folder, "test_db.sqlite"), instrumentation=self.instrumentation)
+        self.user_handler = UserHandler(self.db_handler)
+        self.timesheet_handler = TimesheetHandler(self.db_handler)
+        self.user = self.user_handler.get_user_by_id(self.user_handler.create_user("Rose Tyler", "rose@example.com", "password", "IT", "Employee"))
+        self.instrumentation.reset()
+
+    def tearDown(self):
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def test_statement_shape(self):
+        self.assertEqual(statement_shape("SELECT * FROM users WHERE email = 'rose@example.com' AND user_id = 12"),
+                         "SELECT * FROM users WHERE email = ? AND user_id = ?")
+        self.assertEqual(statement_shape("SELECT * FROM timesheet_entries WHERE timesheet_id IN (?, ?, ?)"),
+                         statement_shape("SELECT * FROM timesheet_entries WHERE timesheet_id IN (?,?)"))
+
+    def test_records_queries_by_shape(self):
+        for i in range(3):
+            self.db_handler.get_data(["*"], "users", {"user_id": self.user.user_id})
+
+        report = self.instrumentation.get_report()
+        statement = report["statements"]["SELECT * FROM users WHERE user_id = ?"]
+        self.assertEqual(statement["count"], 3)
+        self.assertEqual(statement["rows"], 3)
+        self.assertEqual(sum(statement["histogram"].values()), 3)
+
+    def test_submit_timesheet_commits_once(self):
+        self.timesheet_handler.submit_timesheet(self.user, datetime(2023, 1, 2), [7.4] * 5)
+        report = self.instrumentation.get_report()
+        self.assertEqual(report["commits"], 1)
+        self.assertEqual(report["rollbacks"], 0)
+
+    def test_rollback_recorded(self):
+        with self.db_handler.transaction():
+            self.db_handler.insert_data("users", (None, "Rose Tyler", "rose@example.com", "password", "IT", "Employee"))
+        self.assertEqual(self.instrumentation.get_report()["rollbacks"], 1)
+
+    def test_slow_query_log_captures_plan(self):
+        self.instrumentation.slow_query_ms = 0
+        self.db_handler.get_data(["*"], "users", {"email": "rose@example.com"})
+
+        slow_query = self.instrumentation.get_report()["slow_queries"][-1]
+        self.assertEqual(slow_query["parameters"], ["rose@example.com"])
+        self.assertTrue(any("idx_users_email" in step for step in slow_query["plan"]))
+
+    def test_span_attribution(self):
+        with self.db_handler.span("load balance"):
+            self.timesheet_handler.get_flexi_balance(self.user.user_id)
+        self.timesheet_handler.get_flexi_balance(self.user.user_id)
+
+        span = self.instrumentation.get_report()["spans"]["load balance"]
+        self.assertEqual(span["calls"], 1)
+        self.assertEqual(span["queries"], 1)
+        self.assertIn("load balance", self.instrumentation.format_report())
+
+    def test_disabled_by_default(self):
+        db_handler = DatabaseHandler(os.path.join(self.temp_folder, "plain.sqlite"))
+        UserHandler(db_handler)
+        with db_handler.span("unused"):
+            result, error = db_handler.get_data(["*"], "users")
+        self.assertEqual(result, [])
+        self.assertIsNone(error)
+        db_handler.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,21 +1,42 @@
-import PySimpleGUI
+import os
+from concurrent.futures import ThreadPoolExecutor
 
+from instrumentation import QueryInstrumentation
 from model import DatabaseHandler
-from presenter import UserHandler, TimesheetHandler
-from view import FlexiTimeGUI
+from presenter import LRUCache, UserHandler, TimesheetHandler
 
 def main():
     # Model
-    db_handler = DatabaseHandler("database.sqlite")
+    # Setting FLEXI_TIME_SLOW_QUERY_MS turns on query instrumentation and prints a report on exit
+    slow_query_ms = os.environ.get("FLEXI_TIME_SLOW_QUERY_MS")
+    instrumentation = QueryInstrumentation(slow_query_ms=float(slow_query_ms)) if slow_query_ms else None
+
+    # Setting FLEXI_TIME_IN_MEMORY to write-through or snapshot serves reads from a copy of the database held in memory.
+    # The copy is a single connection, so the GUI then makes its database calls from one worker thread.
+    in_memory = os.environ.get("FLEXI_TIME_IN_MEMORY")
+    if in_memory:
+        db_handler = DatabaseHandler("database.sqlite", instrumentation=instrumentation, in_memory=True, durability=in_memory)
+    else:
+        # Pooled so the GUI's worker threads each get their own connection
+        db_handler = DatabaseHandler("database.sqlite", pooled=True, instrumentation=instrumentation)
     # Presenter
-    user_handler = UserHandler(db_handler)
-    timesheet_handler = TimesheetHandler(db_handler)
+    cache = LRUCache(max_size=1024, ttl=300)
+    user_handler = UserHandler(db_handler, cache)
+    timesheet_handler = TimesheetHandler(db_handler, cache)
     # View
-    app = FlexiTimeGUI(user_handler, timesheet_handler, icon_path="icon.ico")
+    # Imported here so importing main, e.g. from scripts and tests, doesn't load PySimpleGUI and tkinter
+    from view import FlexiTimeGUI
+    executor = ThreadPoolExecutor(max_workers=1 if in_memory else 4)
+    app = FlexiTimeGUI(user_handler, timesheet_handler, icon_path="icon.ico", executor=executor)
 
     # Start application
     app.main_page()
 
+    executor.shutdown(wait=True)
+
+    if instrumentation:
+        print(instrumentation.format_report())
+
     # Closing connection to database is best practice
     db_handler.close()
 
@@ -1,10 +1,397 @@
+import heapq
+import os
+import pathlib
 import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from itertools import chain, islice
+
+class Migration:
+    def __init__(self, version, description, statements):
+        self.version = version
+        self.description = description
+        self.statements = statements
+
+# Migrations are applied in version order and each version is only ever applied once per database
+MIGRATIONS = [
+    Migration(1, "Create users, timesheets and timesheet entries tables", [
+        "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, name TEXT, email TEXT, password TEXT, department TEXT, role TEXT)",
+        "CREATE TABLE IF NOT EXISTS timesheets (timesheet_id INTEGER PRIMARY KEY, user_id INTEGER, department TEXT, status TEXT)",
+        "CREATE TABLE IF NOT EXISTS timesheet_entries (entry_id INTEGER PRIMARY KEY, timesheet_id INTEGER, date DATE, hours_worked REAL)",
+    ]),
+    Migration(2, "Index login, manager view and balance lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)",
+        "CREATE INDEX IF NOT EXISTS idx_timesheets_department_status ON timesheets (department, status)",
+        "CREATE INDEX IF NOT EXISTS idx_timesheets_user_id ON timesheets (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_timesheet_entries_timesheet_id ON timesheet_entries (timesheet_id)",
+    ]),
+    # Running totals of the entries counted towards each user's flexi balance, i.e. entries on timesheets that aren't denied.
+    # Triggers keep the totals in step with every write, so a balance read is a single primary key lookup.
+    Migration(3, "Add flexi balance ledger", [
+        "CREATE TABLE IF NOT EXISTS flexi_balances (user_id INTEGER PRIMARY KEY, hours_worked REAL NOT NULL, entry_count INTEGER NOT NULL)",
+        """INSERT INTO flexi_balances (user_id, hours_worked, entry_count)
+           SELECT timesheets.user_id, IFNULL(SUM(timesheet_entries.hours_worked), 0), COUNT(*) FROM timesheet_entries
+           JOIN timesheets ON timesheets.timesheet_id = timesheet_entries.timesheet_id
+           WHERE timesheets.user_id IS NOT NULL AND timesheets.status != 'Denied' GROUP BY timesheets.user_id""",
+        """CREATE TRIGGER IF NOT EXISTS trg_flexi_balances_entry_insert AFTER INSERT ON timesheet_entries
+           WHEN (SELECT user_id IS NOT NULL AND status != 'Denied' FROM timesheets WHERE timesheet_id = NEW.timesheet_id)
+           BEGIN
+               INSERT INTO flexi_balances (user_id, hours_worked, entry_count)
+               VALUES ((SELECT user_id FROM timesheets WHERE timesheet_id = NEW.timesheet_id), IFNULL(NEW.hours_worked, 0), 1)
+               ON CONFLICT(user_id) DO UPDATE SET hours_worked = hours_worked + excluded.hours_worked, entry_count = entry_count + 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_flexi_balances_entry_delete AFTER DELETE ON timesheet_entries
+           WHEN (SELECT user_id IS NOT NULL AND status != 'Denied' FROM timesheets WHERE timesheet_id = OLD.timesheet_id)
+           BEGIN
+               UPDATE flexi_balances SET hours_worked = hours_worked - IFNULL(OLD.hours_worked, 0), entry_count = entry_count - 1
+               WHERE user_id = (SELECT user_id FROM timesheets WHERE timesheet_id = OLD.timesheet_id);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_flexi_balances_entry_update AFTER UPDATE OF timesheet_id, hours_worked ON timesheet_entries
+           BEGIN
+               UPDATE flexi_balances SET hours_worked = hours_worked - IFNULL(OLD.hours_worked, 0), entry_count = entry_count - 1
+               WHERE user_id = (SELECT user_id FROM timesheets WHERE timesheet_id = OLD.timesheet_id AND status != 'Denied');
+               INSERT INTO flexi_balances (user_id, hours_worked, entry_count)
+               SELECT user_id, IFNULL(NEW.hours_worked, 0), 1 FROM timesheets
+               WHERE timesheet_id = NEW.timesheet_id AND user_id IS NOT NULL AND status != 'Denied'
+               ON CONFLICT(user_id) DO UPDATE SET hours_worked = hours_worked + excluded.hours_worked, entry_count = entry_count + 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_flexi_balances_status_counted AFTER UPDATE OF status ON timesheets
+           WHEN NEW.user_id IS NOT NULL AND IFNULL(NEW.status != 'Denied', 0) AND NOT IFNULL(OLD.status != 'Denied', 0)
+           BEGIN
+               INSERT INTO flexi_balances (user_id, hours_worked, entry_count)
+               SELECT NEW.user_id, IFNULL(SUM(hours_worked), 0), COUNT(*) FROM timesheet_entries WHERE timesheet_id = NEW.timesheet_id
+               ON CONFLICT(user_id) DO UPDATE SET hours_worked = hours_worked + excluded.hours_worked, entry_count = entry_count + excluded.entry_count;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_flexi_balances_status_uncounted AFTER UPDATE OF status ON timesheets
+           WHEN OLD.user_id IS NOT NULL AND IFNULL(OLD.status != 'Denied', 0) AND NOT IFNULL(NEW.status != 'Denied', 0)
+           BEGIN
+               UPDATE flexi_balances
+               SET hours_worked = hours_worked - (SELECT IFNULL(SUM(hours_worked), 0) FROM timesheet_entries WHERE timesheet_id = OLD.timesheet_id),
+                   entry_count = entry_count - (SELECT COUNT(*) FROM timesheet_entries WHERE timesheet_id = OLD.timesheet_id)
+               WHERE user_id = OLD.user_id;
+           END""",
+    ]),
+    # Dates were stored as dd-mm-yyyy, which doesn't sort or compare in date order. yyyy-mm-dd does, so date ranges
+    # can be answered by range scans. Each timesheet's entries are indexed by date, replacing the plain timesheet_id
+    # index, and the date index serves ranges across every timesheet.
+    Migration(4, "Store entry dates as yyyy-mm-dd and index them", [
+        """UPDATE timesheet_entries SET date = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2)
+           WHERE date GLOB '[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]'""",
+        "CREATE INDEX IF NOT EXISTS idx_timesheet_entries_timesheet_id_date ON timesheet_entries (timesheet_id, date)",
+        "DROP INDEX IF EXISTS idx_timesheet_entries_timesheet_id",
+        "CREATE INDEX IF NOT EXISTS idx_timesheet_entries_date ON timesheet_entries (date)",
+    ]),
+    # An append-only log of every timesheet created, entry added and status changed, so views can poll a department
+    # for what changed since the last sequence they saw instead of reloading everything
+    Migration(5, "Log timesheet changes for incremental refreshes", [
+        "CREATE TABLE IF NOT EXISTS timesheet_changes (sequence INTEGER PRIMARY KEY, timesheet_id INTEGER, department TEXT, change TEXT)",
+        "CREATE INDEX IF NOT EXISTS idx_timesheet_changes_department_sequence ON timesheet_changes (department, sequence)",
+        """CREATE TRIGGER IF NOT EXISTS trg_timesheet_changes_created AFTER INSERT ON timesheets
+           BEGIN
+               INSERT INTO timesheet_changes (timesheet_id, department, change) VALUES (NEW.timesheet_id, NEW.department, 'created');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_timesheet_changes_status AFTER UPDATE OF status ON timesheets
+           WHEN OLD.status IS NOT NEW.status
+           BEGIN
+               INSERT INTO timesheet_changes (timesheet_id, department, change) VALUES (NEW.timesheet_id, NEW.department, 'status');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_timesheet_changes_entry AFTER INSERT ON timesheet_entries
+           BEGIN
+               INSERT INTO timesheet_changes (timesheet_id, department, change)
+               SELECT timesheet_id, department, 'entry' FROM timesheets WHERE timesheet_id = NEW.timesheet_id;
+           END""",
+    ]),
+]
+
+def normalize_conditions(conditions):
+    # Conditions are a {column: value} dict or a list of (column, operator, value) tuples, with values bound as parameters.
+    # Plain SQL strings are still accepted for conditions that compare columns rather than values, and (clause, parameters)
+    # pairs for clauses with their own placeholders, like subqueries.
+    if not conditions:
+        return []
+
+    if isinstance(conditions, (str, tuple)):
+        return [conditions]
+    elif isinstance(conditions, dict):
+        return [(column, "=", value) for column, value in conditions.items()]
+    return conditions
+
+def build_conditions(conditions):
+    conditions = normalize_conditions(conditions)
+    if not conditions:
+        return "", []
+
+    clauses = []
+    parameters = []
+    for condition in conditions:
+        if isinstance(condition, str):
+            clauses.append(condition)
+            continue
+        if len(condition) == 2:
+            clause, clause_parameters = condition
+            clauses.append(clause)
+            parameters.extend(clause_parameters)
+            continue
+
+        column, operator, value = condition
+        if operator.upper() in ("IN", "NOT IN"):
+            value = list(value)
+            clauses.append(f"{column} {operator} ({', '.join(['?'] * len(value))})")
+            parameters.extend(value)
+        else:
+            clauses.append(f"{column} {operator} ?")
+            parameters.append(value)
+
+    return " AND ".join(clauses), parameters
+
+class ConnectionState:
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.transaction_depth = 0
+        self.transaction_error = None
+        # Schema version this connection has already checked, so handlers built later don't check it again
+        self.schema_version = None
+        # The read-only connection reads outside transactions go to, opened on first use when the handler has separate_reads
+        self.read_conn = None
+        self.read_cursor = None
+        # Cursors still streaming from the read connection. They hold its snapshot open, so reads go to the main connection
+        # until they finish, or the thread would stop seeing its own writes.
+        self.read_streams = weakref.WeakSet()
+
+        # Mirrors the LRU statement cache sqlite3 keeps per connection, which it doesn't expose itself
+        self.statement_cache = OrderedDict()
+        self.statement_cache_hits = 0
+        self.statement_cache_misses = 0
+        self.statement_cache_evictions = 0
+
+# Statements starting with these only read, so a mirrored connection runs them on its in-memory copy alone and a
+# handler with separate_reads can send them to its read-only connection
+READ_ONLY_PREFIXES = ("SELECT", "EXPLAIN")
+
+def is_read_only(query):
+    return query.lstrip()[:7].upper().startswith(READ_ONLY_PREFIXES)
+
+class MirroredCursor:
+    def __init__(self, memory_cursor, disk_cursor):
+        self.memory_cursor = memory_cursor
+        self.disk_cursor = disk_cursor
+
+    def execute(self, query, parameters = ()):
+        # The disk copy goes first, so a statement that fails there never reaches memory
+        if not is_read_only(query):
+            self.disk_cursor.execute(query, parameters)
+        self.memory_cursor.execute(query, parameters)
+        return self
+
+    def executemany(self, query, rows):
+        rows = list(rows)
+        self.disk_cursor.executemany(query, rows)
+        self.memory_cursor.executemany(query, rows)
+        return self
+
+    def fetchone(self):
+        return self.memory_cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.memory_cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.memory_cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self.memory_cursor)
+
+    @property
+    def description(self):
+        return self.memory_cursor.description
+
+    @property
+    def rowcount(self):
+        return self.memory_cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.memory_cursor.lastrowid
+
+    @property
+    def row_factory(self):
+        return self.memory_cursor.row_factory
+
+    @row_factory.setter
+    def row_factory(self, row_factory):
+        self.memory_cursor.row_factory = row_factory
+
+    def close(self):
+        self.memory_cursor.close()
+        self.disk_cursor.close()
+
+class MirroredConnection:
+    # Write-through in-memory mode: every write is made to the database file and then to its copy in memory, and
+    # reads are served from memory alone. Nothing else may write to the file while it's open, or the copies drift apart.
+    def __init__(self, memory, disk):
+        self.memory = memory
+        self.disk = disk
+
+    def cursor(self):
+        return MirroredCursor(self.memory.cursor(), self.disk.cursor())
+
+    def execute(self, query, parameters = ()):
+        return self.cursor().execute(query, parameters)
+
+    def commit(self):
+        try:
+            self.disk.commit()
+        except sqlite3.Error:
+            # What couldn't be made durable is dropped from memory too
+            self.disk.rollback()
+            self.memory.rollback()
+            raise
+        self.memory.commit()
+
+    def rollback(self):
+        self.disk.rollback()
+        self.memory.rollback()
+
+    def set_trace_callback(self, callback):
+        self.memory.set_trace_callback(callback)
+
+    def close(self):
+        self.disk.close()
+        self.memory.close()
 
 class DatabaseHandler:
-    def __init__(self, db_path, verbose = False):
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
+    schema_version_table_name = "schema_version"
+
+    def __init__(self, db_path, verbose = False, cached_statements = 128, pooled = False, timeout = 5.0,
+                 journal_mode = None, synchronous = None, cache_size = None, instrumentation = None, id_offset = 0,
+                 in_memory = False, durability = "write-through", snapshot_interval = 60, separate_reads = False):
+        self.db_path = db_path
         self.verbose = verbose
+        self.instrumentation = instrumentation
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.pooled = pooled
+        # New IDs start after id_offset rather than at 1, which is how each shard of a ShardedDatabaseHandler keeps its IDs apart
+        self.id_offset = id_offset
+
+        # in_memory copies the database into memory when it's opened and serves every read from there. With durability
+        # "write-through" each write also goes to the file before it returns. With "snapshot" writes only go to memory,
+        # and the whole database is copied back to the file by snapshot(), at the first commit snapshot_interval seconds
+        # after the last copy, and at close(), so a crash loses whatever was written since.
+        if in_memory and pooled:
+            raise ValueError("An in-memory database can't be pooled, as each connection would hold its own copy")
+        if durability not in ("write-through", "snapshot"):
+            raise ValueError(f"Unknown durability {durability!r}, expected 'write-through' or 'snapshot'")
+        self.in_memory = in_memory
+        self.durability = durability
+        self.snapshot_interval = snapshot_interval
+        self.last_snapshot = time.monotonic()
+
+        # separate_reads gives each connection a read-only partner that reads outside a transaction go to. In WAL mode
+        # each read sees the last committed snapshot, so long reports and writes on the same handler don't wait for each other.
+        if separate_reads and in_memory:
+            raise ValueError("An in-memory database has no file for a read-only connection to open")
+        self.separate_reads = separate_reads
+
+        # Pooled handlers give every thread its own connection, and default to WAL so readers don't block on writers.
+        # Connections are kept until close(), which suits long-lived worker threads like an executor's. A thread that
+        # is about to exit should call release_connection(), or each short-lived thread leaves a connection open.
+        if (pooled or separate_reads) and journal_mode is None:
+            journal_mode = "WAL"
+        self.pragmas = {pragma: value for pragma, value in
+                        {"journal_mode": journal_mode, "synchronous": synchronous, "cache_size": cache_size}.items() if value is not None}
+
+        self._states = []
+        self._states_lock = threading.Lock()
+        self._local = threading.local()
+        self._shared_state = None if pooled else self._connect()
+
+    def _connect(self):
+        if self.in_memory:
+            conn = self._load_into_memory()
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, cached_statements=self.cached_statements,
+                                   check_same_thread=not self.pooled)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+
+        state = ConnectionState(conn)
+        with self._states_lock:
+            self._states.append(state)
+        return state
+
+    def _reader(self, query):
+        # Returns the connection and cursor for a read. Inside a transaction reads stay on the main connection so they
+        # see its uncommitted writes, as do statements that might write.
+        state = self._state
+        if not self.separate_reads or state.conn.in_transaction or state.read_streams or not is_read_only(query):
+            return state.conn, state.cursor
+
+        if state.read_conn is None:
+            uri = f"{pathlib.Path(self.db_path).absolute().as_uri()}?mode=ro"
+            state.read_conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, cached_statements=self.cached_statements,
+                                              check_same_thread=not self.pooled)
+            if "cache_size" in self.pragmas:
+                state.read_conn.execute(f"PRAGMA cache_size = {self.pragmas['cache_size']}")
+            state.read_cursor = state.read_conn.cursor()
+        return state.read_conn, state.read_cursor
+
+    def _load_into_memory(self):
+        # The copy may be handed between threads, like the GUI's worker, as long as only one uses it at a time
+        memory = sqlite3.connect(":memory:", cached_statements=self.cached_statements, check_same_thread=False)
+        disk = sqlite3.connect(self.db_path, timeout=self.timeout, cached_statements=self.cached_statements, check_same_thread=False)
+        disk.backup(memory)
+        if self.durability == "write-through":
+            return MirroredConnection(memory, disk)
+        disk.close()
+        return memory
+
+    def snapshot(self):
+        # Copies the in-memory database back to its file in one step, replacing what was there
+        if not self.in_memory or self.durability != "snapshot" or not self._states:
+            return None
+        if self._shared_state.conn.in_transaction:
+            e = sqlite3.Error("Can't write a snapshot in the middle of a transaction")
+            print(f"Error writing the snapshot: {e}")
+            return e
+        try:
+            start = time.perf_counter()
+            disk = sqlite3.connect(self.db_path, timeout=self.timeout)
+            try:
+                self._shared_state.conn.backup(disk)
+            finally:
+                disk.close()
+            self.last_snapshot = time.monotonic()
+            if self.verbose:
+                print(f"Snapshot written to {self.db_path} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            return None
+        except sqlite3.Error as e:
+            print(f"Error writing the snapshot: {e}")
+            return e
+
+    @property
+    def _state(self):
+        if self._shared_state is not None:
+            return self._shared_state
+
+        state = getattr(self._local, "state", None)
+        if state is None:
+            state = self._connect()
+            self._local.state = state
+        return state
+
+    @property
+    def conn(self):
+        return self._state.conn
+
+    @property
+    def cursor(self):
+        return self._state.cursor
 
     def create_table(self, table_name, attributes):
         try:
@@ -18,80 +405,358 @@ class DatabaseHandler:
             print(f"Error creating the table: {e}")
             return e
 
+    def get_schema_version(self):
+        try:
+            query = f"CREATE TABLE IF NOT EXISTS {self.schema_version_table_name} (version INTEGER PRIMARY KEY, description TEXT, applied_at TEXT)"
+            if self.verbose:
+                print(query)
+            self.cursor.execute(query)
+            self.cursor.execute(f"SELECT MAX(version) FROM {self.schema_version_table_name}")
+            version = self.cursor.fetchone()[0]
+            return version or 0, None
+        except sqlite3.Error as e:
+            print(f"Error reading the schema version: {e}")
+            return None, e
+
+    def migrate(self, migrations = MIGRATIONS):
+        # Every handler calls this when it's built, so once a connection is known to be at the latest version it
+        # returns without touching the database
+        state = self._state
+        if migrations and state.schema_version is not None and state.schema_version >= max(migration.version for migration in migrations):
+            return None
+
+        version, error = self.get_schema_version()
+        if error:
+            return error
+
+        for migration in sorted(migrations, key=lambda migration: migration.version):
+            if migration.version <= version:
+                continue
+
+            try:
+                # IMMEDIATE takes the write lock up front so two processes can't apply the same migration
+                self.cursor.execute("BEGIN IMMEDIATE")
+                self.cursor.execute(f"SELECT MAX(version) FROM {self.schema_version_table_name}")
+                version = self.cursor.fetchone()[0] or 0
+
+                if migration.version > version:
+                    for statement in migration.statements:
+                        if self.verbose:
+                            print(statement)
+                        self.cursor.execute(statement)
+
+                    self.cursor.execute(f"INSERT INTO {self.schema_version_table_name} VALUES (?, ?, datetime('now'))", (migration.version, migration.description))
+                    version = migration.version
+
+                self.conn.commit()
+                self._after_commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                self._record_rollback()
+                print(f"Error applying migration {migration.version}: {e}")
+                return e
+
+        state.schema_version = version
+        return None
+
+    @contextmanager
+    def transaction(self):
+        # Writes inside the block are committed together when it exits, or all rolled back if any of them fails
+        state = self._state
+        if state.transaction_depth == 0:
+            if self.verbose:
+                print("BEGIN IMMEDIATE")
+            # IMMEDIATE takes the write lock up front, so the busy timeout applies instead of failing part way through
+            state.cursor.execute("BEGIN IMMEDIATE")
+            state.transaction_error = None
+
+        state.transaction_depth += 1
+        try:
+            # The connection's state is yielded so callers can see afterwards whether the block was rolled back
+            yield state
+        except BaseException:
+            state.transaction_error = state.transaction_error or sqlite3.Error("Transaction aborted")
+            raise
+        finally:
+            state.transaction_depth -= 1
+
+            if state.transaction_depth == 0:
+                if state.transaction_error:
+                    if self.verbose:
+                        print("ROLLBACK")
+                    state.conn.rollback()
+                    self._record_rollback()
+                else:
+                    if self.verbose:
+                        print("COMMIT")
+                    state.conn.commit()
+                    self._after_commit()
+
+    def get_statement_cache_stats(self):
+        with self._states_lock:
+            states = list(self._states)
+        return {"size": sum(len(state.statement_cache) for state in states), "capacity": self.cached_statements,
+                "hits": sum(state.statement_cache_hits for state in states), "misses": sum(state.statement_cache_misses for state in states),
+                "evictions": sum(state.statement_cache_evictions for state in states)}
+
+    def _track_statement(self, state, query):
+        if query in state.statement_cache:
+            state.statement_cache.move_to_end(query)
+            state.statement_cache_hits += 1
+            return
+
+        state.statement_cache_misses += 1
+        if self.cached_statements > 0:
+            state.statement_cache[query] = None
+            if len(state.statement_cache) > self.cached_statements:
+                state.statement_cache.popitem(last=False)
+                state.statement_cache_evictions += 1
+
+    def _execute(self, query, parameters = (), cursor = None, record = True):
+        # Reads that fetch their rows afterwards pass record = False and record themselves once the rows are fetched
+        state = self._state
+        self._track_statement(state, query)
+        cursor = cursor or state.cursor
+        if self.instrumentation is None or not record:
+            return cursor.execute(query, parameters)
+
+        start = time.perf_counter()
+        cursor.execute(query, parameters)
+        self.instrumentation.record_query(self, query, parameters, time.perf_counter() - start, cursor.rowcount)
+        return cursor
+
+    def _execute_many(self, query, rows):
+        state = self._state
+        self._track_statement(state, query)
+        if self.instrumentation is None:
+            return state.cursor.executemany(query, rows)
+
+        start = time.perf_counter()
+        state.cursor.executemany(query, rows)
+        self.instrumentation.record_query(self, query, (), time.perf_counter() - start, state.cursor.rowcount)
+        return state.cursor
+
+    def _commit(self):
+        # Inside a transaction the commit is deferred to the end of the outermost block
+        state = self._state
+        if state.transaction_depth == 0:
+            state.conn.commit()
+            self._after_commit()
+
+    def _after_commit(self):
+        if self.instrumentation is not None:
+            self.instrumentation.record_commit()
+        if self.in_memory and self.durability == "snapshot" and time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+            self.snapshot()
+
+    def _record_rollback(self):
+        if self.instrumentation is not None:
+            self.instrumentation.record_rollback()
+
+    def span(self, name):
+        # Groups the queries run inside the block under name in the instrumentation report
+        if self.instrumentation is None:
+            return nullcontext()
+        return self.instrumentation.span(name)
+
+    def explain(self, query, parameters = ()):
+        try:
+            cursor = self.conn.cursor()
+            plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {query}", parameters)]
+            cursor.close()
+            return plan
+        except sqlite3.Error as e:
+            return [f"Error explaining query: {e}"]
+
+    def _fail(self, e):
+        state = self._state
+        if state.transaction_depth > 0:
+            state.transaction_error = e
+        return e
+
     def update_data(self, table_name, data, condition):
+        row_count, error = self.update_rows(table_name, data, condition)
+        return error
+
+    def update_rows(self, table_name, data, condition):
+        # Same as update_data, but returns (number of rows changed, error) for set-based updates
         try:
             set_clause = ", ".join([f"{key} = ?" for key in data.keys()])
-            query = f"UPDATE {table_name} SET {set_clause} WHERE {condition}"
+            where_clause, where_parameters = build_conditions(condition)
+            query = f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}"
+            parameters = list(data.values()) + where_parameters
             if self.verbose:
                 print(query)
-                print(list(data.values()))
+                print(parameters)
 
-            self.cursor.execute(query, list(data.values()))
-            self.conn.commit()
-            return None
+            row_count = self._execute(query, parameters).rowcount
+            self._commit()
+            return row_count, None
         except sqlite3.Error as e:
             print(f"Error updating data: {e}")
-            return e
+            return None, self._fail(e)
+
+    def _new_id(self, table_name):
+        if not self.id_offset:
+            return "null"  # Null here autogenerates the ID
+        return f"(SELECT IFNULL(MAX(rowid), {self.id_offset}) + 1 FROM {table_name})"
 
     def insert_data(self, table_name, data):
         try:
-            placeholders = "null, " + ", ".join(["?"] * len(data))  # Null here autogenerates the ID
+            placeholders = f"{self._new_id(table_name)}, " + ", ".join(["?"] * len(data))
             query = f"INSERT INTO {table_name} VALUES ({placeholders})"
             if self.verbose:
                 print(query)
                 print(data)
 
-            self.cursor.execute(query, data)
-            self.conn.commit()
+            self._execute(query, data)
+            self._commit()
 
             inserted_id = self.cursor.lastrowid
             return inserted_id, None
         except sqlite3.Error as e:
             print(f"Error inserting data: {e}")
-            return None, e
+            return None, self._fail(e)
+
+    def insert_many(self, table_name, rows, columns = None):
+        try:
+            rows = list(rows)
+            if not rows:
+                return 0, None
+
+            if columns:
+                # Naming the columns lets rows carry their own IDs
+                query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+            else:
+                placeholders = f"{self._new_id(table_name)}, " + ", ".join(["?"] * len(rows[0]))
+                query = f"INSERT INTO {table_name} VALUES ({placeholders})"
+            if self.verbose:
+                print(query)
+                print(rows)
 
-    def get_data(self, data, table_name, conditions = None, joins = None):
+            self._execute_many(query, rows)
+            self._commit()
+
+            return len(rows), None
+        except sqlite3.Error as e:
+            print(f"Error inserting data: {e}")
+            return None, self._fail(e)
+
+    def _build_select(self, data, table_name, conditions = None, joins = None, order_by = None, limit = None):
         query =  f"SELECT {', '.join(data)} FROM {table_name} "
 
         if joins:
             for join_table, connection in joins.items():
                 query += f"LEFT JOIN {join_table} ON {join_table}.{connection}={table_name}.{connection} "
 
-        if conditions:
-            query += f"WHERE {' AND '.join(conditions)} "
+        where_clause, parameters = build_conditions(conditions)
+        if where_clause:
+            query += f"WHERE {where_clause} "
+
+        if order_by:
+            query += f"ORDER BY {order_by} "
+
+        if limit is not None:
+            query += "LIMIT ? "
+            parameters.append(limit)
 
-        return self.query_data(query)
+        return query, parameters
 
-    def query_data(self, query):
+    def get_data(self, data, table_name, conditions = None, joins = None, order_by = None, limit = None):
+        query, parameters = self._build_select(data, table_name, conditions, joins, order_by, limit)
+        return self.query_data(query, parameters)
+
+    def iter_data(self, data, table_name, conditions = None, joins = None, chunk_size = 1000, row_type = dict, order_by = None, limit = None):
+        query, parameters = self._build_select(data, table_name, conditions, joins, order_by, limit)
+        return self.iter_query_data(query, parameters, chunk_size, row_type)
+
+    def query_data(self, query, parameters = ()):
         try:
             if self.verbose:
                 print(query)
-            self.cursor.execute(query)
+                if parameters:
+                    print(list(parameters))
+            conn, cursor = self._reader(query)
+            start = time.perf_counter()
+            self._execute(query, parameters, cursor, record=False)
 
-            attributes = [column[0] for column in self.cursor.description]
+            attributes = [column[0] for column in cursor.description]
             results = []
 
-            for row in self.cursor.fetchall():
+            for row in cursor.fetchall():
                 row_dict = dict(zip(attributes, row))
                 results.append(row_dict)
 
+            if self.instrumentation is not None:
+                self.instrumentation.record_query(self, query, parameters, time.perf_counter() - start, len(results))
             return results, None
 
         except sqlite3.Error as e:
             print(f"Error querying data: {e}")
             return None, e
 
+    def iter_query_data(self, query, parameters = (), chunk_size = 1000, row_type = dict):
+        # Rows are fetched lazily in chunks on their own cursor, so other queries can run while the results are consumed.
+        # row_type is dict, tuple or sqlite3.Row; tuples and sqlite3.Row avoid building a dict for every row.
+        try:
+            if self.verbose:
+                print(query)
+                if parameters:
+                    print(list(parameters))
+            conn, cursor = self._reader(query)
+            cursor = conn.cursor()
+            if row_type is sqlite3.Row:
+                cursor.row_factory = sqlite3.Row
+            start = time.perf_counter()
+            self._execute(query, parameters, cursor, record=False)
+
+            read_streams = self._state.read_streams
+            if conn is self._state.read_conn:
+                read_streams.add(cursor)
+            return self._iter_rows(cursor, chunk_size, row_type, query, parameters, time.perf_counter() - start, read_streams), None
+
+        except sqlite3.Error as e:
+            print(f"Error querying data: {e}")
+            return None, e
+
+    def _iter_rows(self, cursor, chunk_size, row_type, query, parameters, elapsed, read_streams):
+        # elapsed only counts time spent in SQLite, not time the consumer spends between chunks
+        row_count = 0
+        try:
+            attributes = [column[0] for column in cursor.description]
+
+            while True:
+                start = time.perf_counter()
+                rows = cursor.fetchmany(chunk_size)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    break
+
+                row_count += len(rows)
+                if row_type is dict:
+                    for row in rows:
+                        yield dict(zip(attributes, row))
+                else:
+                    yield from rows
+        finally:
+            cursor.close()
+            read_streams.discard(cursor)
+            if self.instrumentation is not None:
+                self.instrumentation.record_query(self, query, parameters, elapsed, row_count)
+
     def delete_row(self, table_name, condition):
         try:
-            query = f"DELETE FROM {table_name} WHERE {condition}"
+            where_clause, parameters = build_conditions(condition)
+            query = f"DELETE FROM {table_name} WHERE {where_clause}"
             if self.verbose:
                 print(query)
-            self.cursor.execute(query)
-            self.conn.commit()
+                print(parameters)
+            self._execute(query, parameters)
+            self._commit()
             return None
         except sqlite3.Error as e:
             print(f"Error deleting row: {e}")
-            return e
+            return self._fail(e)
 
     def delete_table(self, table_name):
         try:
@@ -99,12 +764,399 @@ class DatabaseHandler:
             if self.verbose:
                 print(query)
             self.cursor.execute(query)
-            self.conn.commit()
+            self._commit()
             return None
         except sqlite3.Error as e:
             print(f"Error deleting table: {e}")
-            return e
+            return self._fail(e)
+
+    def release_connection(self):
+        # Closes and forgets the calling thread's connection, which rolls back anything it left uncommitted.
+        # A handler that isn't pooled shares one connection, which stays open until close().
+        if self._shared_state is not None:
+            return
+        state = getattr(self._local, "state", None)
+        if state is None:
+            return
+
+        self._local.state = None
+        with self._states_lock:
+            if state in self._states:
+                self._states.remove(state)
+        state.conn.close()
+        if state.read_conn is not None:
+            state.read_conn.close()
+
+    def close(self):
+        self.snapshot()
+        with self._states_lock:
+            states = self._states
+            self._states = []
+        for state in states:
+            state.conn.close()
+            if state.read_conn is not None:
+                state.read_conn.close()
+
+# A sharded row's ID keeps the shard it's in above these bits, so lookups by ID go straight to that shard
+SHARD_ID_BITS = 32
+
+class ShardedTable:
+    def __init__(self, columns, partition_column, id_columns):
+        self.columns = columns
+        self.partition_column = partition_column
+        self.id_columns = id_columns
+
+# Users and timesheets go to their department's shard and entries to their timesheet's, so the joins the handlers make
+# stay inside one shard. flexi_balances and timesheet_changes are only written by their triggers. Any other table lives
+# in the directory database.
+SHARDED_TABLES = {
+    "users": ShardedTable(["user_id", "name", "email", "password", "department", "role"], "department", ["user_id"]),
+    "timesheets": ShardedTable(["timesheet_id", "user_id", "department", "status"], "department", ["timesheet_id"]),
+    "timesheet_entries": ShardedTable(["entry_id", "timesheet_id", "date", "hours_worked"], "timesheet_id", ["entry_id", "timesheet_id"]),
+    "flexi_balances": ShardedTable(["user_id", "hours_worked", "entry_count"], None, []),
+    "timesheet_changes": ShardedTable(["sequence", "timesheet_id", "department", "change"], "department", []),
+}
+
+def merge_rows(results):
+    rows = []
+    for result, error in results:
+        if error:
+            return None, error
+        rows.extend(result)
+    return rows, None
+
+def order_key(data, order_by, row_type):
+    # Rows from several shards are merged on a single ORDER BY column. Anything more complex keeps each shard's own order.
+    if not order_by or "," in order_by:
+        return None, False
+
+    column, _, direction = order_by.partition(" ")
+    column = column.rpartition(".")[2]
+    names = [item.split()[-1].rpartition(".")[2] for item in data]
+    if row_type is dict and (column in names or "*" in names):
+        value = lambda row: row[column]
+    elif row_type is not dict and column in names:
+        index = names.index(column)
+        value = lambda row: row[index]
+    else:
+        return None, False
+
+    # NULLs sort first, as they do in SQLite
+    return (lambda row: (value(row) is not None, value(row))), direction.strip().upper() == "DESC"
+
+class ShardedTransaction:
+    def __init__(self):
+        self.exit_stack = ExitStack()
+        # Shard ID -> the state of the connection the shard's transaction is open on
+        self.states = {}
+        self.transaction_error = None
+
+class ShardedDatabaseHandler:
+    # Keeps each department in its own SQLite file, so departments don't wait on each other's write locks and queries
+    # across departments run on every shard at once. It has DatabaseHandler's methods, so the handlers built on it don't
+    # need to know the database is sharded. Queries that don't name a department or a sharded ID run on every shard and
+    # their rows are concatenated, so aggregates come back as one row per shard.
+    shard_table_name = "shards"
+
+    def __init__(self, db_path, verbose = False, cached_statements = 128, timeout = 5.0, journal_mode = None, synchronous = None,
+                 cache_size = None, instrumentation = None, max_workers = 8):
+        # db_path holds the directory of shards, along with any table that isn't sharded, like the importer's progress
+        self.db_path = db_path
+        self.verbose = verbose
+        self.instrumentation = instrumentation
+        self.options = {"cached_statements": cached_statements, "timeout": timeout, "journal_mode": journal_mode,
+                        "synchronous": synchronous, "cache_size": cache_size, "instrumentation": instrumentation}
+        # Every database is pooled so the fan-out threads each query it on their own connection
+        self.pooled = True
+        self.migrations = None
+
+        self.directory = DatabaseHandler(db_path, verbose, pooled=True, **self.options)
+        self.directory.create_table(self.shard_table_name, {"shard_id": "INTEGER PRIMARY KEY", "department": "TEXT UNIQUE"})
+        self.shards = {}
+        self.departments = {}
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+        # With max_workers = 0 queries visit the shards one after another, which is quicker for small indexed lookups
+        self.executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers else None
+        self._load_shards()
+
+    def shard_path(self, shard_id):
+        root, extension = os.path.splitext(self.db_path)
+        return f"{root}.shard{shard_id}{extension}"
+
+    def _load_shards(self):
+        # Also picks up shards other processes have added since
+        rows, error = self.directory.get_data(["shard_id", "department"], self.shard_table_name)
+        with self._shards_lock:
+            for row in rows or []:
+                if row["shard_id"] not in self.shards:
+                    shard = DatabaseHandler(self.shard_path(row["shard_id"]), self.verbose, pooled=True,
+                                            id_offset=row["shard_id"] << SHARD_ID_BITS, **self.options)
+                    if self.migrations is not None:
+                        shard.migrate(self.migrations)
+                    self.shards[row["shard_id"]] = shard
+                self.departments[row["department"]] = row["shard_id"]
+
+    def _all_shard_ids(self):
+        with self._shards_lock:
+            return list(self.shards)
+
+    def _shard_for_department(self, department, create = False):
+        shard_id = self.departments.get(department)
+        if shard_id is None:
+            self._load_shards()
+            shard_id = self.departments.get(department)
+
+        if shard_id is None and create and department is not None:
+            # The directory's write lock stops two processes adding a shard for the same department
+            with self.directory.transaction():
+                rows, error = self.directory.get_data(["shard_id"], self.shard_table_name, {"department": department})
+                if not rows:
+                    self.directory.insert_data(self.shard_table_name, (department,))
+            self._load_shards()
+            shard_id = self.departments.get(department)
+        return shard_id
+
+    def _shard_for_id(self, row_id):
+        if not isinstance(row_id, int):
+            return None
+        shard_id = row_id >> SHARD_ID_BITS
+        if shard_id not in self.shards:
+            self._load_shards()
+        return shard_id if shard_id in self.shards else None
+
+    def _shard_ids_for(self, table_name, conditions):
+        # A department or sharded ID in the conditions narrows the query to the shards holding it
+        for condition in normalize_conditions(conditions):
+            if isinstance(condition, str) or len(condition) == 2:
+                continue
+
+            column, operator, value = condition
+            table, _, column = column.rpartition(".")
+            table = SHARDED_TABLES.get(table or table_name)
+            operator = operator.upper()
+            if column == "department" and operator == "=":
+                shard_id = self._shard_for_department(value)
+                return [shard_id] if shard_id is not None else []
+            if table is not None and column in table.id_columns and operator in ("=", "IN"):
+                shard_ids = {self._shard_for_id(row_id) for row_id in ([value] if operator == "=" else value)}
+                return sorted(shard_ids - {None})
+
+        return self._all_shard_ids()
+
+    def _shard_id_for_row(self, table_name, row, columns):
+        table = SHARDED_TABLES[table_name]
+        shard_id = None
+        if table.partition_column in columns:
+            value = row[columns.index(table.partition_column)]
+            if table.partition_column in table.id_columns:
+                shard_id = self._shard_for_id(value)
+            else:
+                shard_id = self._shard_for_department(value, create=True)
+
+        if shard_id is None:
+            e = sqlite3.Error(f"No shard for {table_name} row {row}")
+            print(f"Error inserting data: {e}")
+            return None, self._fail(e)
+        return shard_id, None
+
+    def _fail(self, e):
+        transaction = getattr(self._local, "transaction", None)
+        if transaction is not None:
+            transaction.transaction_error = e
+        return e
+
+    def _shard(self, shard_id):
+        # Inside a transaction, each shard joins it the first time it's used
+        shard = self.shards[shard_id]
+        transaction = getattr(self._local, "transaction", None)
+        if transaction is not None and shard_id not in transaction.states:
+            transaction.states[shard_id] = transaction.exit_stack.enter_context(shard.transaction())
+        return shard
+
+    def _fan_out(self, shard_ids, function):
+        # Runs function on every shard at once, unless this thread is in a transaction, whose uncommitted writes only
+        # this thread's connections can see
+        if len(shard_ids) <= 1 or self.executor is None or getattr(self._local, "transaction", None) is not None:
+            return [function(self._shard(shard_id)) for shard_id in shard_ids]
+        return list(self.executor.map(function, [self.shards[shard_id] for shard_id in shard_ids]))
+
+    def create_table(self, table_name, attributes):
+        if table_name not in SHARDED_TABLES:
+            return self.directory.create_table(table_name, attributes)
+        errors = self._fan_out(self._all_shard_ids(), lambda shard: shard.create_table(table_name, attributes))
+        return next((error for error in errors if error), None)
+
+    def get_schema_version(self):
+        versions = []
+        for shard_id in self._all_shard_ids():
+            version, error = self.shards[shard_id].get_schema_version()
+            if error:
+                return None, error
+            versions.append(version)
+        return min(versions, default=0), None
+
+    def migrate(self, migrations = MIGRATIONS):
+        # Shards added later are migrated as soon as they're opened
+        self.migrations = migrations
+        for shard_id in self._all_shard_ids():
+            error = self.shards[shard_id].migrate(migrations)
+            if error:
+                return error
+        return None
+
+    @contextmanager
+    def transaction(self):
+        # Each shard used inside the block begins its own transaction when it's first used. If anything fails they all
+        # roll back, otherwise they commit one after another, so only a block spanning departments whose commit fails
+        # part way through can be left partly committed.
+        transaction = getattr(self._local, "transaction", None)
+        if transaction is not None:
+            yield transaction
+            return
+
+        transaction = ShardedTransaction()
+        self._local.transaction = transaction
+        try:
+            with transaction.exit_stack:
+                try:
+                    yield transaction
+                except BaseException:
+                    transaction.transaction_error = transaction.transaction_error or sqlite3.Error("Transaction aborted")
+                    raise
+                finally:
+                    states = transaction.states.values()
+                    transaction.transaction_error = transaction.transaction_error or next(
+                        (state.transaction_error for state in states if state.transaction_error), None)
+                    for state in states:
+                        state.transaction_error = state.transaction_error or transaction.transaction_error
+        finally:
+            self._local.transaction = None
+
+    def get_statement_cache_stats(self):
+        stats = [self.directory.get_statement_cache_stats()] + [self.shards[shard_id].get_statement_cache_stats() for shard_id in self._all_shard_ids()]
+        return {key: sum(stat[key] for stat in stats) for key in ("size", "capacity", "hits", "misses", "evictions")}
+
+    def span(self, name):
+        if self.instrumentation is None:
+            return nullcontext()
+        return self.instrumentation.span(name)
+
+    def explain(self, query, parameters = ()):
+        shard_ids = self._all_shard_ids()
+        return (self.shards[shard_ids[0]] if shard_ids else self.directory).explain(query, parameters)
+
+    def update_data(self, table_name, data, condition):
+        row_count, error = self.update_rows(table_name, data, condition)
+        return error
+
+    def update_rows(self, table_name, data, condition):
+        if table_name not in SHARDED_TABLES:
+            return self.directory.update_rows(table_name, data, condition)
+
+        row_count = 0
+        for count, error in self._fan_out(self._shard_ids_for(table_name, condition), lambda shard: shard.update_rows(table_name, data, condition)):
+            if error:
+                return None, error
+            row_count += count
+        return row_count, None
+
+    def insert_data(self, table_name, data):
+        if table_name not in SHARDED_TABLES:
+            return self.directory.insert_data(table_name, data)
+
+        shard_id, error = self._shard_id_for_row(table_name, data, SHARDED_TABLES[table_name].columns[1:])
+        if error:
+            return None, error
+        return self._shard(shard_id).insert_data(table_name, data)
+
+    def insert_many(self, table_name, rows, columns = None):
+        # Rows that carry their own IDs need the shard in them, as IDs from this handler have, to be found by ID later
+        if table_name not in SHARDED_TABLES:
+            return self.directory.insert_many(table_name, rows, columns)
+
+        row_columns = list(columns) if columns else SHARDED_TABLES[table_name].columns[1:]
+        shard_rows = {}
+        for row in rows:
+            shard_id, error = self._shard_id_for_row(table_name, row, row_columns)
+            if error:
+                return None, error
+            shard_rows.setdefault(shard_id, []).append(row)
+
+        row_count = 0
+        for shard_id, rows in shard_rows.items():
+            count, error = self._shard(shard_id).insert_many(table_name, rows, columns)
+            if error:
+                return None, error
+            row_count += count
+        return row_count, None
+
+    def get_data(self, data, table_name, conditions = None, joins = None, order_by = None, limit = None):
+        if table_name not in SHARDED_TABLES:
+            return self.directory.get_data(data, table_name, conditions, joins, order_by, limit)
+
+        results = self._fan_out(self._shard_ids_for(table_name, conditions),
+                                lambda shard: shard.get_data(data, table_name, conditions, joins, order_by, limit))
+        rows, error = merge_rows(results)
+        if error or len(results) <= 1:
+            return rows, error
+
+        key, descending = order_key(data, order_by, dict)
+        if key:
+            rows.sort(key=key, reverse=descending)
+        return (rows[:limit] if limit is not None else rows), None
+
+    def iter_data(self, data, table_name, conditions = None, joins = None, chunk_size = 1000, row_type = dict, order_by = None, limit = None):
+        # Streams from each shard on this thread. Rows ordered on one column are merged in order as they're read.
+        if table_name not in SHARDED_TABLES:
+            return self.directory.iter_data(data, table_name, conditions, joins, chunk_size, row_type, order_by, limit)
+
+        iterators = []
+        for shard_id in self._shard_ids_for(table_name, conditions):
+            rows, error = self._shard(shard_id).iter_data(data, table_name, conditions, joins, chunk_size, row_type, order_by, limit)
+            if error:
+                return None, error
+            iterators.append(rows)
+        if len(iterators) == 1:
+            return iterators[0], None
+
+        key, descending = order_key(data, order_by, row_type)
+        rows = heapq.merge(*iterators, key=key, reverse=descending) if key else chain(*iterators)
+        return (islice(rows, limit) if limit is not None else rows), None
+
+    def query_data(self, query, parameters = ()):
+        # SQL can't be routed, so it runs on every shard
+        return merge_rows(self._fan_out(self._all_shard_ids(), lambda shard: shard.query_data(query, parameters)))
+
+    def iter_query_data(self, query, parameters = (), chunk_size = 1000, row_type = dict):
+        iterators = []
+        for shard_id in self._all_shard_ids():
+            rows, error = self._shard(shard_id).iter_query_data(query, parameters, chunk_size, row_type)
+            if error:
+                return None, error
+            iterators.append(rows)
+        return chain(*iterators), None
+
+    def delete_row(self, table_name, condition):
+        if table_name not in SHARDED_TABLES:
+            return self.directory.delete_row(table_name, condition)
+        errors = self._fan_out(self._shard_ids_for(table_name, condition), lambda shard: shard.delete_row(table_name, condition))
+        return next((error for error in errors if error), None)
+
+    def delete_table(self, table_name):
+        if table_name not in SHARDED_TABLES:
+            return self.directory.delete_table(table_name)
+        errors = self._fan_out(self._all_shard_ids(), lambda shard: shard.delete_table(table_name))
+        return next((error for error in errors if error), None)
+
+    def release_connection(self):
+        self.directory.release_connection()
+        for shard_id in self._all_shard_ids():
+            self.shards[shard_id].release_connection()
 
     def close(self):
-        if self.conn:
-            self.conn.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.directory.close()
+        for shard_id in self._all_shard_ids():
+            self.shards[shard_id].close()
@@ -3,8 +3,10 @@ import sqlite3
 import tempfile
 import shutil
 import os
+import threading
+import gc
 
-from model import DatabaseHandler
+from model import DatabaseHandler, ShardedDatabaseHandler, Migration, MIGRATIONS, SHARD_ID_BITS, build_conditions
 
 class TestDatabaseHandler(unittest.TestCase):
     def setUp(self):
@@ -109,3 +111,536 @@ class TestDatabaseHandler(unittest.TestCase):
         id, error = self.db_handler.insert_data(table_name, data)
         error = self.db_handler.delete_row(table_name, f"invalid_column = {id}")
         self.assertIsInstance(error, sqlite3.Error)
+
+    def test_migrate_success(self):
+        error = self.db_handler.migrate()
+        self.assertIsNone(error)
+        version, error = self.db_handler.get_schema_version()
+        self.assertEqual(version, MIGRATIONS[-1].version)
+        indexes, error = self.db_handler.query_data("SELECT name FROM sqlite_master WHERE type='index'")
+        index_names = [index["name"] for index in indexes]
+        self.assertIn("idx_users_email", index_names)
+        self.assertIn("idx_timesheets_department_status", index_names)
+        self.assertIn("idx_timesheets_user_id", index_names)
+        self.assertIn("idx_timesheet_entries_timesheet_id_date", index_names)
+        self.assertIn("idx_timesheet_entries_date", index_names)
+
+    def test_migrate_applies_each_version_once(self):
+        self.db_handler.migrate()
+        error = self.db_handler.migrate()
+        self.assertIsNone(error)
+        versions, error = self.db_handler.query_data("SELECT version FROM schema_version")
+        self.assertEqual([version["version"] for version in versions], [migration.version for migration in MIGRATIONS])
+
+    def test_migrate_upgrades_existing_database(self):
+        self.db_handler.create_table("users", {"user_id":"INTEGER PRIMARY KEY", "name":"TEXT", "email":"TEXT", "password":"TEXT", "department":"TEXT", "role":"TEXT"})
+        self.db_handler.insert_data("users", ("John", "john@example.com", "password123", "IT", "Employee"))
+        error = self.db_handler.migrate()
+        self.assertIsNone(error)
+        result, error = self.db_handler.get_data(["name"], "users", ["email = 'john@example.com'"])
+        self.assertEqual(result, [{"name": "John"}])
+        plan, error = self.db_handler.query_data("EXPLAIN QUERY PLAN SELECT * FROM users WHERE email = 'john@example.com'")
+        self.assertIn("idx_users_email", plan[0]["detail"])
+
+    def test_migrate_backfills_flexi_balances(self):
+        self.db_handler.migrate(MIGRATIONS[:2])
+        self.db_handler.insert_data("timesheets", (1, "IT", "Approved"))
+        self.db_handler.insert_data("timesheets", (1, "IT", "Denied"))
+        self.db_handler.insert_many("timesheet_entries", [(1, "2023-01-01", 8.0), (1, "2023-01-02", 6.0), (2, "2023-01-03", 12.0)])
+        self.db_handler.migrate()
+        result, error = self.db_handler.get_data(["user_id", "hours_worked", "entry_count"], "flexi_balances")
+        self.assertEqual(result, [{"user_id": 1, "hours_worked": 14.0, "entry_count": 2}])
+
+    def test_migrate_converts_entry_dates(self):
+        self.db_handler.migrate(MIGRATIONS[:3])
+        self.db_handler.insert_data("timesheets", (1, "IT", "Approved"))
+        self.db_handler.insert_many("timesheet_entries", [(1, "02-01-2023", 8.0), (1, "31-12-2022", 6.0), (1, "2023-01-03", 7.0)])
+        self.db_handler.migrate()
+        result, error = self.db_handler.get_data(["date"], "timesheet_entries", order_by="date")
+        self.assertEqual([row["date"] for row in result], ["2022-12-31", "2023-01-02", "2023-01-03"])
+        result, error = self.db_handler.get_data(["hours_worked", "entry_count"], "flexi_balances")
+        self.assertEqual(result, [{"hours_worked": 21.0, "entry_count": 3}])
+
+    def test_migrate_invalid_statement_rolls_back(self):
+        migrations = [Migration(1, "Valid", ["CREATE TABLE first_table (id INTEGER PRIMARY KEY)"]),
+                      Migration(2, "Invalid", ["CREATE TABLE second_table (id INTEGER PRIMARY KEY)", "CREATE INDEX idx_missing ON missing_table (id)"])]
+        error = self.db_handler.migrate(migrations)
+        self.assertIsInstance(error, sqlite3.Error)
+        version, error = self.db_handler.get_schema_version()
+        self.assertEqual(version, 1)
+        tables, error = self.db_handler.query_data("SELECT name FROM sqlite_master WHERE type='table'")
+        table_names = [table["name"] for table in tables]
+        self.assertIn("first_table", table_names)
+        self.assertNotIn("second_table", table_names)
+
+    def test_insert_many_success(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        row_count, error = self.db_handler.insert_many(table_name, [("John", "Smith"), ("Jane", "Doe")])
+        self.assertIsNone(error)
+        self.assertEqual(row_count, 2)
+        result, error = self.db_handler.get_data(["first_name", "last_name"], table_name)
+        self.assertEqual(result, [{"first_name": "John", "last_name": "Smith"}, {"first_name": "Jane", "last_name": "Doe"}])
+
+    def test_insert_many_empty_table_name(self):
+        row_count, error = self.db_handler.insert_many("", [("John", "Smith")])
+        self.assertIsInstance(error, sqlite3.Error)
+
+    def test_transaction_commits_once(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        with self.db_handler.transaction():
+            self.db_handler.insert_data(table_name, ("John", "Smith"))
+            self.db_handler.insert_many(table_name, [("Jane", "Doe"), ("Jim", "Beam")])
+        self.db_handler.conn.set_trace_callback(None)
+        self.assertEqual(statements.count("COMMIT"), 1)
+        result, error = self.db_handler.get_data(["first_name"], table_name)
+        self.assertEqual(len(result), 3)
+
+    def test_transaction_rolls_back_on_error(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        with self.db_handler.transaction():
+            self.db_handler.insert_data(table_name, ("John", "Smith"))
+            id, error = self.db_handler.insert_data(table_name, ("Too", "Many", "Values"))
+        self.assertIsInstance(error, sqlite3.Error)
+        result, error = self.db_handler.get_data(["first_name"], table_name)
+        self.assertEqual(result, [])
+
+    def test_transaction_rolls_back_on_exception(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        with self.assertRaises(ValueError):
+            with self.db_handler.transaction():
+                self.db_handler.insert_data(table_name, ("John", "Smith"))
+                raise ValueError()
+        result, error = self.db_handler.get_data(["first_name"], table_name)
+        self.assertEqual(result, [])
+
+    def test_build_conditions_success(self):
+        self.assertEqual(build_conditions({"id": 1, "name": "John"}), ("id = ? AND name = ?", [1, "John"]))
+        self.assertEqual(build_conditions([("id", "IN", [1, 2]), ("name", "!=", "John")]), ("id IN (?, ?) AND name != ?", [1, 2, "John"]))
+        self.assertEqual(build_conditions(["id = 1"]), ("id = 1", []))
+        self.assertEqual(build_conditions(None), ("", []))
+
+    def test_structured_conditions_success(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        id, error = self.db_handler.insert_data(table_name, ["John", "O'Brien"])
+        self.db_handler.insert_data(table_name, ["Jane", "Doe"])
+        self.db_handler.update_data(table_name, {"first_name": "Jack"}, {"last_name": "O'Brien"})
+        result, error = self.db_handler.get_data(["first_name"], table_name, {"id": id})
+        self.assertIsNone(error)
+        self.assertEqual(result, [{"first_name": "Jack"}])
+        self.db_handler.delete_row(table_name, {"id": id})
+        result, error = self.db_handler.get_data(["first_name"], table_name)
+        self.assertEqual(result, [{"first_name": "Jane"}])
+
+    def test_statement_cache_stats(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        for id in range(10):
+            self.db_handler.get_data(["first_name"], table_name, {"id": id})
+        stats = self.db_handler.get_statement_cache_stats()
+        self.assertEqual(stats["capacity"], 128)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 9)
+
+    def test_statement_cache_evictions(self):
+        db_handler = DatabaseHandler(os.path.join(self.temp_folder, "small_cache.sqlite"), cached_statements = 2)
+        for id in range(3):
+            db_handler.query_data(f"SELECT {id}")
+        db_handler.query_data("SELECT 0")
+        stats = db_handler.get_statement_cache_stats()
+        db_handler.close()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["evictions"], 2)
+        self.assertEqual(stats["hits"], 0)
+
+    def test_iter_data_success(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        self.db_handler.insert_many(table_name, [(f"John {i}", "Smith") for i in range(5)])
+        rows, error = self.db_handler.iter_data(["first_name", "last_name"], table_name, {"last_name": "Smith"}, chunk_size = 2)
+        self.assertIsNone(error)
+        self.assertEqual(list(rows), [{"first_name": f"John {i}", "last_name": "Smith"} for i in range(5)])
+
+    def test_iter_query_data_row_types(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        self.db_handler.insert_data(table_name, ["John", "Smith"])
+        rows, error = self.db_handler.iter_query_data(f"SELECT first_name, last_name FROM {table_name}", row_type = tuple)
+        self.assertEqual(list(rows), [("John", "Smith")])
+        rows, error = self.db_handler.iter_query_data(f"SELECT first_name, last_name FROM {table_name}", row_type = sqlite3.Row)
+        row = next(rows)
+        self.assertEqual(row["last_name"], "Smith")
+
+    def test_iter_query_data_interleaved_queries(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        self.db_handler.insert_many(table_name, [(f"John {i}", "Smith") for i in range(5)])
+        rows, error = self.db_handler.iter_data(["id"], table_name, chunk_size = 2, row_type = tuple)
+        ids = []
+        for (id,) in rows:
+            result, error = self.db_handler.get_data(["first_name"], table_name, {"id": id})
+            ids.append(id)
+        self.assertEqual(len(ids), 5)
+
+    def test_iter_query_data_nonexistent_table(self):
+        rows, error = self.db_handler.iter_query_data("SELECT * FROM nonexistent_table")
+        self.assertIsNone(rows)
+        self.assertIsInstance(error, sqlite3.Error)
+
+    def test_get_data_order_by_and_limit(self):
+        table_name = "test_table"
+        attributes = {"id":"INTEGER PRIMARY KEY", "first_name":"TEXT", "last_name":"TEXT"}
+        self.db_handler.create_table(table_name, attributes)
+        self.db_handler.insert_many(table_name, [("John", "Smith"), ("Adam", "Smith"), ("Zoe", "Smith")])
+        result, error = self.db_handler.get_data(["first_name"], table_name, order_by = "first_name DESC", limit = 2)
+        self.assertIsNone(error)
+        self.assertEqual(result, [{"first_name": "Zoe"}, {"first_name": "John"}])
+
+
+class TestPooledDatabaseHandler(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        db_path = os.path.join(self.temp_folder, "test_db.sqlite")
+        self.db_handler = DatabaseHandler(db_path, pooled = True, synchronous = "NORMAL", cache_size = -4000)
+        self.db_handler.create_table("test_table", {"id":"INTEGER PRIMARY KEY", "thread":"INTEGER", "value":"INTEGER"})
+
+    def tearDown(self):
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def run_threads(self, target, thread_count):
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_pragmas_applied(self):
+        result, error = self.db_handler.query_data("PRAGMA journal_mode")
+        self.assertEqual(result[0]["journal_mode"], "wal")
+        result, error = self.db_handler.query_data("PRAGMA synchronous")
+        self.assertEqual(result[0]["synchronous"], 1)
+        result, error = self.db_handler.query_data("PRAGMA cache_size")
+        self.assertEqual(result[0]["cache_size"], -4000)
+
+    def test_connection_per_thread(self):
+        connections = []
+        self.run_threads(lambda i: connections.append(self.db_handler.conn), 4)
+        self.assertEqual(len(set(map(id, connections))), 4)
+        self.assertNotIn(self.db_handler.conn, connections)
+
+    def test_release_connection(self):
+        connections = []
+
+        def short_lived(thread):
+            self.db_handler.insert_data("test_table", (thread, thread))
+            connections.append(self.db_handler.conn)
+            self.db_handler.release_connection()
+
+        main_connection = self.db_handler.conn
+        self.run_threads(short_lived, 4)
+        self.assertEqual(self.db_handler._states, [self.db_handler._state])
+        for conn in connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+
+        # A released thread gets a new connection if it uses the handler again
+        self.db_handler.release_connection()
+        self.assertIsNot(self.db_handler.conn, main_connection)
+        result, error = self.db_handler.get_data(["COUNT(*) AS total"], "test_table")
+        self.assertEqual(result[0]["total"], 4)
+
+    def test_concurrent_reads_and_writes(self):
+        errors = []
+        thread_count = 8
+        writes_per_thread = 50
+
+        def worker(thread):
+            for value in range(writes_per_thread):
+                if value % 2:
+                    id, error = self.db_handler.insert_data("test_table", (thread, value))
+                else:
+                    with self.db_handler.transaction():
+                        row_count, error = self.db_handler.insert_many("test_table", [(thread, value)])
+                if error:
+                    errors.append(error)
+                result, error = self.db_handler.get_data(["COUNT(*) AS total"], "test_table", {"thread": thread})
+                if error:
+                    errors.append(error)
+
+        self.run_threads(worker, thread_count)
+
+        self.assertEqual(errors, [])
+        result, error = self.db_handler.get_data(["COUNT(*) AS total"], "test_table")
+        self.assertEqual(result[0]["total"], thread_count * writes_per_thread)
+
+class TestInMemoryDatabaseHandler(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_folder, "test_db.sqlite")
+        db_handler = DatabaseHandler(self.db_path)
+        db_handler.create_table("test_table", {"id":"INTEGER PRIMARY KEY", "name":"TEXT"})
+        db_handler.insert_data("test_table", ("on disk",))
+        db_handler.close()
+
+    def tearDown(self):
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def disk_names(self):
+        conn = sqlite3.connect(self.db_path)
+        names = [row[0] for row in conn.execute("SELECT name FROM test_table ORDER BY id")]
+        conn.close()
+        return names
+
+    def test_write_through(self):
+        db_handler = DatabaseHandler(self.db_path, in_memory = True)
+        self.assertEqual(db_handler.get_data(["name"], "test_table"), ([{"name": "on disk"}], None))
+        self.assertEqual(db_handler.insert_data("test_table", ("written",)), (2, None))
+        with db_handler.transaction():
+            db_handler.insert_many("test_table", [("batch 1",), ("batch 2",)])
+            db_handler.update_data("test_table", {"name": "updated"}, {"id": 1})
+        self.assertEqual(self.disk_names(), ["updated", "written", "batch 1", "batch 2"])
+
+        # Reads come from memory, so a change made to the file behind the handler's back isn't seen
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DELETE FROM test_table")
+        conn.commit()
+        result, error = db_handler.get_data(["COUNT(*) AS total"], "test_table")
+        self.assertEqual(result[0]["total"], 4)
+        rows, error = db_handler.iter_data(["name"], "test_table", row_type = sqlite3.Row, order_by = "id")
+        self.assertEqual([row["name"] for row in rows], ["updated", "written", "batch 1", "batch 2"])
+        conn.close()
+        db_handler.close()
+
+    def test_failed_disk_write_is_not_kept_in_memory(self):
+        db_handler = DatabaseHandler(self.db_path, timeout = 0.05, in_memory = True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("BEGIN IMMEDIATE")
+        id, error = db_handler.insert_data("test_table", ("blocked",))
+        self.assertIsInstance(error, sqlite3.OperationalError)
+        conn.rollback()
+        conn.close()
+        self.assertEqual(db_handler.get_data(["name"], "test_table"), ([{"name": "on disk"}], None))
+        self.assertEqual(db_handler.insert_data("test_table", ("retried",)), (2, None))
+        db_handler.close()
+        self.assertEqual(self.disk_names(), ["on disk", "retried"])
+
+    def test_snapshot(self):
+        db_handler = DatabaseHandler(self.db_path, in_memory = True, durability = "snapshot", snapshot_interval = 3600)
+        db_handler.insert_data("test_table", ("in memory",))
+        self.assertEqual(self.disk_names(), ["on disk"])
+        self.assertIsNone(db_handler.snapshot())
+        self.assertEqual(self.disk_names(), ["on disk", "in memory"])
+
+        with db_handler.transaction():
+            db_handler.insert_data("test_table", ("at close",))
+            self.assertIsNotNone(db_handler.snapshot())
+        db_handler.close()
+        self.assertEqual(self.disk_names(), ["on disk", "in memory", "at close"])
+
+    def test_snapshot_interval(self):
+        db_handler = DatabaseHandler(self.db_path, in_memory = True, durability = "snapshot", snapshot_interval = 0)
+        db_handler.insert_data("test_table", ("committed",))
+        self.assertEqual(self.disk_names(), ["on disk", "committed"])
+        db_handler.close()
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            DatabaseHandler(self.db_path, pooled = True, in_memory = True)
+        with self.assertRaises(ValueError):
+            DatabaseHandler(self.db_path, in_memory = True, durability = "never")
+
+class TestSeparateReads(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.db_handler = DatabaseHandler(os.path.join(self.temp_folder, "test_db.sqlite"), separate_reads = True)
+        self.db_handler.create_table("test_table", {"id":"INTEGER PRIMARY KEY", "value":"INTEGER"})
+        self.db_handler.insert_many("test_table", [(value,) for value in range(100)])
+
+    def tearDown(self):
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def test_reads_use_read_only_connection(self):
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        result, error = self.db_handler.get_data(["COUNT(*) AS total"], "test_table")
+        self.assertEqual(result[0]["total"], 100)
+        rows, error = self.db_handler.iter_data(["value"], "test_table", row_type = tuple)
+        self.assertEqual(len(list(rows)), 100)
+        self.assertEqual(statements, [])
+        self.assertIsNotNone(self.db_handler._state.read_conn)
+
+        # Statements that might write, like PRAGMAs, stay on the main connection
+        result, error = self.db_handler.query_data("PRAGMA journal_mode")
+        self.assertEqual(result[0]["journal_mode"], "wal")
+        with self.assertRaises(sqlite3.OperationalError):
+            self.db_handler._state.read_conn.execute("DELETE FROM test_table")
+        self.db_handler.conn.set_trace_callback(None)
+
+    def test_transaction_reads_see_own_writes(self):
+        with self.db_handler.transaction():
+            self.db_handler.insert_data("test_table", (100,))
+            result, error = self.db_handler.get_data(["COUNT(*) AS total"], "test_table")
+            self.assertEqual(result[0]["total"], 101)
+        result, error = self.db_handler.get_data(["COUNT(*) AS total"], "test_table")
+        self.assertEqual(result[0]["total"], 101)
+
+    def test_report_reads_one_snapshot_while_writes_commit(self):
+        rows, error = self.db_handler.iter_data(["value"], "test_table", chunk_size = 10, row_type = tuple)
+        first_rows = [next(rows) for _ in range(10)]
+        self.assertEqual(self.db_handler.insert_many("test_table", [(100,), (101,)]), (2, None))
+        self.assertEqual(len(first_rows + list(rows)), 100)
+        result, error = self.db_handler.get_data(["COUNT(*) AS total"], "test_table")
+        self.assertEqual(result[0]["total"], 102)
+
+    def test_reads_see_own_writes_while_streaming(self):
+        rows, error = self.db_handler.iter_data(["value"], "test_table", chunk_size = 1, row_type = tuple)
+        next(rows)
+        row_id, error = self.db_handler.insert_data("test_table", (100,))
+        result, error = self.db_handler.get_data(["value"], "test_table", {"id": row_id})
+        self.assertEqual(result, [{"value": 100}])
+        self.assertEqual(len(list(rows)), 99)
+
+        # Once the stream is done reads go back to the read-only connection
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        result, error = self.db_handler.get_data(["COUNT(*) AS total"], "test_table")
+        self.db_handler.conn.set_trace_callback(None)
+        self.assertEqual(result[0]["total"], 101)
+        self.assertEqual(statements, [])
+
+    def test_abandoned_stream_releases_read_connection(self):
+        rows, error = self.db_handler.iter_data(["value"], "test_table", chunk_size = 1, row_type = tuple)
+        del rows
+        gc.collect()
+        self.assertEqual(len(self.db_handler._state.read_streams), 0)
+
+    def test_not_with_in_memory(self):
+        with self.assertRaises(ValueError):
+            DatabaseHandler(os.path.join(self.temp_folder, "memory.sqlite"), in_memory = True, separate_reads = True)
+
+class TestShardedDatabaseHandler(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_folder, "test_db.sqlite")
+        self.db_handler = ShardedDatabaseHandler(self.db_path, max_workers = 4)
+        self.db_handler.migrate()
+
+    def tearDown(self):
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def test_departments_get_their_own_shards(self):
+        it_id, error = self.db_handler.insert_data("timesheets", (1, "IT", "Pending"))
+        hr_id, error = self.db_handler.insert_data("timesheets", (2, "HR", "Pending"))
+        second_it_id, error = self.db_handler.insert_data("timesheets", (3, "IT", "Pending"))
+
+        self.assertEqual(len(self.db_handler.shards), 2)
+        self.assertTrue(os.path.exists(self.db_handler.shard_path(it_id >> SHARD_ID_BITS)))
+        self.assertEqual(second_it_id, it_id + 1)
+        self.assertNotEqual(it_id >> SHARD_ID_BITS, hr_id >> SHARD_ID_BITS)
+
+        shard = DatabaseHandler(self.db_handler.shard_path(hr_id >> SHARD_ID_BITS))
+        rows, error = shard.get_data(["timesheet_id"], "timesheets")
+        shard.close()
+        self.assertEqual(rows, [{"timesheet_id": hr_id}])
+
+    def test_queries_are_routed_or_fanned_out(self):
+        it_id, error = self.db_handler.insert_data("timesheets", (1, "IT", "Pending"))
+        hr_id, error = self.db_handler.insert_data("timesheets", (1, "HR", "Approved"))
+        self.db_handler.insert_many("timesheet_entries", [(it_id, "2023-01-02", 8), (hr_id, "2023-01-02", 6), (hr_id, "2023-01-03", 7)])
+
+        self.assertEqual(self.db_handler._shard_ids_for("timesheets", {"department": "HR"}), [hr_id >> SHARD_ID_BITS])
+        self.assertEqual(self.db_handler._shard_ids_for("timesheet_entries", [("timesheet_id", "IN", [it_id])]), [it_id >> SHARD_ID_BITS])
+        self.assertEqual(self.db_handler._shard_ids_for("timesheets", {"department": "Sales"}), [])
+        self.assertEqual(len(self.db_handler._shard_ids_for("timesheets", {"user_id": 1})), 2)
+
+        rows, error = self.db_handler.get_data(["timesheet_id"], "timesheets", {"user_id": 1}, order_by = "timesheet_id DESC")
+        self.assertEqual([row["timesheet_id"] for row in rows], sorted([it_id, hr_id], reverse = True))
+        rows, error = self.db_handler.get_data(["hours_worked"], "flexi_balances", {"user_id": 1})
+        self.assertEqual(sorted(row["hours_worked"] for row in rows), [8, 13])
+        rows, error = self.db_handler.iter_data(["timesheet_id", "date"], "timesheet_entries", order_by = "date", row_type = tuple, limit = 2)
+        self.assertEqual([date for timesheet_id, date in rows], ["2023-01-02", "2023-01-02"])
+        rows, error = self.db_handler.query_data("SELECT COUNT(*) AS total FROM timesheet_entries")
+        self.assertEqual(sorted(row["total"] for row in rows), [1, 2])
+
+        self.assertEqual(self.db_handler.update_rows("timesheets", {"status": "Denied"}, {"user_id": 1}), (2, None))
+        self.assertIsNone(self.db_handler.delete_row("timesheet_entries", {"timesheet_id": hr_id}))
+        rows, error = self.db_handler.get_data(["entry_id"], "timesheet_entries")
+        self.assertEqual(len(rows), 1)
+
+    def test_release_connection(self):
+        states = []
+
+        def short_lived():
+            with self.db_handler.transaction():
+                self.db_handler.insert_data("timesheets", (1, "IT", "Pending"))
+                self.db_handler.insert_data("timesheets", (1, "HR", "Pending"))
+            states.extend((handler, handler._state) for handler in [self.db_handler.directory] + list(self.db_handler.shards.values()))
+            self.db_handler.release_connection()
+
+        thread = threading.Thread(target = short_lived)
+        thread.start()
+        thread.join()
+        self.assertEqual(len(states), 3)
+        for handler, state in states:
+            self.assertNotIn(state, handler._states)
+        rows, error = self.db_handler.get_data(["timesheet_id"], "timesheets")
+        self.assertEqual(len(rows), 2)
+
+    def test_transaction_rolls_back_every_shard(self):
+        with self.db_handler.transaction() as transaction:
+            self.db_handler.insert_data("timesheets", (1, "IT", "Pending"))
+            self.db_handler.insert_data("timesheets", (1, "HR", "Pending"))
+            self.db_handler.insert_data("timesheet_entries", (12345, "2023-01-02", 8))
+        self.assertIsNotNone(transaction.transaction_error)
+        rows, error = self.db_handler.get_data(["timesheet_id"], "timesheets")
+        self.assertEqual(rows, [])
+
+        with self.db_handler.transaction() as transaction:
+            it_id, error = self.db_handler.insert_data("timesheets", (1, "IT", "Pending"))
+            self.db_handler.insert_many("timesheet_entries", [(it_id, "2023-01-02", 8)])
+            # Uncommitted writes are visible to this thread's reads
+            rows, error = self.db_handler.get_data(["timesheet_id"], "timesheets")
+            self.assertEqual(len(rows), 1)
+        self.assertIsNone(transaction.transaction_error)
+        rows, error = self.db_handler.get_data(["entry_id"], "timesheet_entries", {"timesheet_id": it_id})
+        self.assertEqual(len(rows), 1)
+
+    def test_unsharded_tables_live_in_the_directory(self):
+        self.db_handler.create_table("import_progress", {"progress_id":"INTEGER PRIMARY KEY", "source":"TEXT"})
+        progress_id, error = self.db_handler.insert_data("import_progress", ("users.csv",))
+        self.assertEqual(progress_id, 1)
+        rows, error = self.db_handler.directory.get_data(["source"], "import_progress")
+        self.assertEqual(rows, [{"source": "users.csv"}])
+
+    def test_shards_added_by_another_handler_are_found(self):
+        other_handler = ShardedDatabaseHandler(self.db_path)
+        other_handler.migrate()
+        timesheet_id, error = other_handler.insert_data("timesheets", (1, "Finance", "Pending"))
+        other_handler.close()
+
+        rows, error = self.db_handler.get_data(["timesheet_id"], "timesheets", {"timesheet_id": timesheet_id})
+        self.assertEqual(rows, [{"timesheet_id": timesheet_id}])
+        rows, error = self.db_handler.get_data(["timesheet_id"], "timesheets", {"department": "Finance"})
+        self.assertEqual(len(rows), 1)
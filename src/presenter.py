@@ -1,31 +1,322 @@
+import copy
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError
+from datetime import datetime, timedelta
+
 from structures import User, Timesheet
 
+# Entry dates are stored in this format so that they sort and compare in date order
+DATE_FORMAT = "%Y-%m-%d"
+
+def format_date(value):
+    # Strings must already be in DATE_FORMAT, anything else would sort out of order and drop out of range queries
+    if hasattr(value, "strftime"):
+        return value.strftime(DATE_FORMAT)
+    try:
+        if datetime.strptime(value, DATE_FORMAT).strftime(DATE_FORMAT) == value:
+            return value
+    except (TypeError, ValueError):
+        pass
+    raise ValueError(f"Dates must be dates or yyyy-mm-dd strings, not {value!r}")
+
+class LRUCache:
+    def __init__(self, max_size = 1024, ttl = None):
+        # ttl is in seconds, None keeps entries until they are evicted or invalidated
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Every invalidation ticks the clock. A put is dropped if its key was invalidated after the version it was read
+        # at, so a reader that loses a race with a writer can't store what it read after the writer's invalidate.
+        # Only the latest max_size invalidated keys are remembered, older versions than _floor are always dropped.
+        self._clock = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+
+    def get(self, key, default = None):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # Values are copied in and out, so callers can't change what other callers get
+            return copy.deepcopy(entry[0])
+
+    def version(self):
+        # Taken before reading the value to put
+        with self._lock:
+            return self._clock
+
+    def put(self, key, value, version = None):
+        with self._lock:
+            if version is not None and (version < self._floor or self._invalidated.get(key, version) > version):
+                return
+
+            self._entries[key] = (copy.deepcopy(value), time.monotonic())
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._clock += 1
+            self._invalidated[key] = self._clock
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_size:
+                _, self._floor = self._invalidated.popitem(last=False)
+
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_where(self, predicate):
+        # Drops every entry for which predicate(key, value) is true
+        with self._lock:
+            # Keys that aren't cached yet can't be tested, so every put read before now is dropped
+            self._clock += 1
+            self._floor = self._clock
+            keys = [key for key, (value, stored_at) in self._entries.items() if predicate(key, value)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._clock += 1
+            self._floor = self._clock
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expirations": self.expirations, "invalidations": self.invalidations}
+
+class BackgroundTasks:
+    def __init__(self, executor):
+        # Runs presenter calls on the executor's worker threads so the caller's event loop stays responsive.
+        # Each window keeps its own BackgroundTasks and cancels it on close, so late results are dropped.
+        self.executor = executor
+        self.cancelled = False
+        self._futures = set()
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, on_done = None):
+        future = self.executor.submit(function, *args)
+
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(lambda future: self._finish(future, on_done))
+        return future
+
+    def _finish(self, future, on_done):
+        with self._lock:
+            self._futures.discard(future)
+
+        if self.cancelled or future.cancelled():
+            return
+
+        error = future.exception()
+        if error:
+            print(f"Error running background task: {error}")
+        if on_done:
+            on_done(None if error else future.result(), error)
+
+    def cancel(self):
+        self.cancelled = True
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+
+    def pending(self):
+        with self._lock:
+            return len(self._futures)
+
+class WriteBehindQueue:
+    def __init__(self, db_handler, max_batch_size = 500, max_delay_ms = 10, max_queue_size = 10000):
+        # Writes are queued and a single writer thread runs them in groups, one transaction and commit per group.
+        # A group is written once it has max_batch_size writes or its first write has waited max_delay_ms.
+        # Futures only resolve once their write is committed, so a result is never returned for a lost write.
+        # The writer thread needs its own connection, so db_handler must be pooled.
+        if not db_handler.pooled:
+            raise ValueError("WriteBehindQueue needs a pooled DatabaseHandler")
+
+        self.db_handler = db_handler
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.batches = 0
+        self.writes = 0
+        self.closed = False
+
+        # Bounded, so callers block instead of queueing without limit when writes arrive faster than they commit
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args):
+        # function runs on the writer thread inside the group's transaction and should return None on failure,
+        # like the presenter methods do. Returns a Future of its result.
+        future = Future()
+        with self._close_lock:
+            if self.closed:
+                raise RuntimeError("WriteBehindQueue is closed")
+            self._queue.put((function, args, future))
+        return future
+
+    def flush(self, timeout = None):
+        # Blocks until everything submitted before the call is committed
+        future = Future()
+        with self._close_lock:
+            if self.closed:
+                return
+            self._queue.put((None, (), future))
+        future.result(timeout)
+
+    def close(self):
+        # Commits everything already submitted, then stops the writer thread
+        with self._close_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        try:
+            self._write_until_closed()
+        finally:
+            self.db_handler.release_connection()
+
+    def _write_until_closed(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            # A flush marker ends the group early so flush() doesn't wait out the delay
+            while len(batch) < self.max_batch_size and batch[-1][0] is not None:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._write_safely(batch)
+                    return
+                batch.append(item)
+
+            self._write_safely(batch)
+
+    def _write_safely(self, batch):
+        # An error here must not end the writer thread, or every later submission and flush would wait forever
+        try:
+            self._write(batch)
+        except Exception as e:
+            print(f"Error writing batch: {e}")
+            for function, args, future in batch:
+                try:
+                    if not future.done():
+                        future.set_exception(e)
+                except InvalidStateError:
+                    pass
+
+    def _write(self, batch):
+        # Writes whose futures were cancelled while queued are dropped, the rest can no longer be cancelled
+        writes = [(function, args, future) for function, args, future in batch
+                  if function is not None and future.set_running_or_notify_cancel()]
+        results = None
+
+        if writes:
+            try:
+                with self.db_handler.transaction() as transaction:
+                    results = [function(*args) for function, args, future in writes]
+                rolled_back = transaction.transaction_error is not None
+            except Exception as e:
+                print(f"Error writing batch: {e}")
+                rolled_back = True
+
+            # One failed write rolls back the whole group, so each write is retried in its own transaction
+            if rolled_back:
+                results = [self._write_one(function, args) for function, args, future in writes]
+
+            self.batches += 1
+            self.writes += len(writes)
+
+        for i, (function, args, future) in enumerate(writes):
+            if isinstance(results[i], Exception):
+                future.set_exception(results[i])
+            else:
+                future.set_result(results[i])
+        for function, args, future in batch:
+            if function is None:
+                future.set_result(None)
+
+    def _write_one(self, function, args):
+        try:
+            with self.db_handler.transaction() as transaction:
+                result = function(*args)
+            return None if transaction.transaction_error else result
+        except Exception as e:
+            return e
+
 class UserHandler:
-    def __init__(self, db_handler):
+    def __init__(self, db_handler, cache = None):
         self.table_name = "users"
-        table_attributes = {"user_id":"INTEGER PRIMARY KEY", "name":"TEXT", "email":"TEXT", "password":"TEXT", "department":"TEXT", "role":"TEXT"}
 
         self.db_handler = db_handler
-        self.db_handler.create_table(self.table_name, table_attributes)
+        self.db_handler.migrate()
+        self.cache = cache
 
     def create_user(self, name, email, password, department, role):
         user_id, error = self.db_handler.insert_data(self.table_name, (name, email, password, department, role))
         return user_id
 
     def get_user_by_id(self, user_id):
+        if self.cache:
+            user = self.cache.get(("user", user_id))
+            if user:
+                return user
+            version = self.cache.version()
+
         data =  ["*"]
-        conditions = [f"user_id == {user_id}"]
+        conditions = {"user_id": user_id}
 
         result, error = self.db_handler.get_data(data, self.table_name, conditions)
         
         if result:
             user = result[0] # Return the first matching record
-            return User(user['user_id'], user['name'], user['email'], user['department'], 'User') 
+            user = User(user['user_id'], user['name'], user['email'], user['department'], 'User') 
+            if self.cache:
+                self.cache.put(("user", user_id), user, version)
+            return user
         return None
 
     def authenticate_user(self, email, password):
         data =  ["*"]
-        conditions = [f"email = '{email}'", f"password = '{password}'"]
+        conditions = {"email": email, "password": password}
 
         result, error = self.db_handler.get_data(data, self.table_name, conditions)
         
@@ -35,74 +326,348 @@ class UserHandler:
         return None
 
 class TimesheetHandler:
-    def __init__(self, db_handler):
+    entry_batch_size = 500
+
+    def __init__(self, db_handler, cache = None, write_behind = None):
         self.timesheet_table_name = "timesheets"
         self.timesheet_entry_table_name = "timesheet_entries"
-        
-        timesheet_table_attributes = {"timesheet_id":"INTEGER PRIMARY KEY", "user_id":"INTEGER", "department":"TEXT", "status":"TEXT"}
-        timesheet_entry_table_attributes =  {"entry_id":"INTEGER PRIMARY KEY", "timesheet_id":"INTEGER", "date":"DATE", "hours_worked":"REAL"}
+        self.flexi_balance_table_name = "flexi_balances"
+        self.change_table_name = "timesheet_changes"
         
         self.db_handler = db_handler
-        self.db_handler.create_table(self.timesheet_table_name, timesheet_table_attributes)
-        self.db_handler.create_table(self.timesheet_entry_table_name, timesheet_entry_table_attributes)
+        self.db_handler.migrate()
+        self.cache = cache
+        self.write_behind = write_behind
 
     def create_timesheet(self, user_id, department, status):
         timesheet_id, error = self.db_handler.insert_data(self.timesheet_table_name, (user_id, department, status))
         return timesheet_id
 
+    def submit_timesheet(self, user, start_date, hours):
+        # The timesheet and all of its entries are written in one commit, so a failure leaves nothing behind
+        with self.db_handler.transaction():
+            timesheet_id, error = self.db_handler.insert_data(self.timesheet_table_name, (user.user_id, user.department, "Pending"))
+            if error:
+                return None
+
+            entries = [(timesheet_id, format_date(start_date + timedelta(days=i)), worked_hours) for i, worked_hours in enumerate(hours)]
+            row_count, error = self.db_handler.insert_many(self.timesheet_entry_table_name, entries)
+            if error:
+                return None
+
+        return timesheet_id
+
+    def submit_timesheet_async(self, user, start_date, hours):
+        # Returns a Future of the timesheet ID, or of None if it couldn't be submitted. With a write-behind queue the
+        # submission is committed together with others, otherwise it's written straight away.
+        if self.write_behind is not None:
+            return self.write_behind.submit(self.submit_timesheet, user, start_date, hours)
+
+        future = Future()
+        future.set_result(self.submit_timesheet(user, start_date, hours))
+        return future
+
     def get_timesheet_by_id(self, timesheet_id):
+        if self.cache:
+            timesheet = self.cache.get(("timesheet", timesheet_id))
+            if timesheet:
+                return timesheet
+        version = self.cache.version() if self.cache else None
+
         data =  ["*"]
-        conditions = [f"timesheet_id = {timesheet_id}"]
+        conditions = {"timesheet_id": timesheet_id}
 
         result, error = self.db_handler.get_data(data, self.timesheet_table_name, conditions)
 
         if result:
-            timesheet = result[0]
-            worked_hours = self.get_entries_by_timesheet_id(timesheet["timesheet_id"])
-            return Timesheet(timesheet["timesheet_id"], timesheet["user_id"], timesheet["department"], worked_hours, timesheet["status"])
+            return self._build_timesheets(result, version)[0]
         return None
 
     def get_timesheets_by_status(self, department, status):
         data =  ["*"]
-        conditions = [f"department = '{department}'", f"status = '{status}'"]
+        conditions = {"department": department, "status": status}
+        version = self.cache.version() if self.cache else None
 
         result, error = self.db_handler.get_data(data, self.timesheet_table_name, conditions)
 
         if result:
-            timesheets = []
+            return self._build_timesheets(result, version)
+        return None
 
-            for timesheet in result:
-                worked_hours = self.get_entries_by_timesheet_id(timesheet["timesheet_id"])
-                timesheets.append(Timesheet(timesheet["timesheet_id"], timesheet["user_id"], timesheet["department"], worked_hours, timesheet["status"]))
+    def get_timesheets_page(self, department, status, after_timesheet_id = None, page_size = 10):
+        # Keyset pagination: each page starts after the last timesheet ID of the previous one, so fetching any page
+        # is an index range scan no matter how deep it is. Returns the page and the cursor for the next page, or None.
+        if page_size < 1:
+            raise ValueError(f"page_size must be at least 1, not {page_size}")
 
-            return timesheets
-        return None
+        data =  ["*"]
+        conditions = [("department", "=", department), ("status", "=", status)]
+        if after_timesheet_id is not None:
+            conditions.append(("timesheet_id", ">", after_timesheet_id))
+
+        version = self.cache.version() if self.cache else None
+        # One extra row tells us whether there is another page without a separate COUNT
+        result, error = self.db_handler.get_data(data, self.timesheet_table_name, conditions, order_by="timesheet_id", limit=page_size + 1)
+
+        if not result:
+            return [], None
+
+        timesheets = self._build_timesheets(result[:page_size], version)
+        next_timesheet_id = timesheets[-1].timesheet_id if len(result) > page_size else None
+        return timesheets, next_timesheet_id
+
+    def get_changes(self, department, after_sequence = 0, limit = 1000):
+        # Returns the department's (sequence, timesheet_id, change) rows logged after after_sequence, oldest first.
+        # change is "created", "entry" or "status".
+        data = ["sequence", "timesheet_id", "change"]
+        conditions = [("department", "=", department), ("sequence", ">", after_sequence)]
+
+        changes, error = self.db_handler.iter_data(data, self.change_table_name, conditions, row_type=tuple, order_by="sequence", limit=limit)
+        return list(changes or [])
+
+    def get_changed_timesheets(self, department, after_sequence = None, limit = 1000):
+        # Returns the department's timesheets changed after after_sequence, as they are now, and the sequence to poll
+        # from next. With after_sequence None nothing is returned, only the sequence to start polling from.
+        if after_sequence is None:
+            result, error = self.db_handler.get_data(["MAX(sequence) AS sequence"], self.change_table_name, {"department": department})
+            return [], max([row["sequence"] or 0 for row in result or []], default=0)
+
+        changes = self.get_changes(department, after_sequence, limit)
+        if not changes:
+            return [], after_sequence
+
+        timesheet_ids = list(dict.fromkeys(timesheet_id for sequence, timesheet_id, change in changes))
+        if self.cache:
+            # Cached copies don't know about entries added by other handlers
+            for timesheet_id in timesheet_ids:
+                self.cache.invalidate(("timesheet", timesheet_id))
+
+        timesheets = []
+        version = self.cache.version() if self.cache else None
+        for i in range(0, len(timesheet_ids), self.entry_batch_size):
+            result, error = self.db_handler.get_data(["*"], self.timesheet_table_name, [("timesheet_id", "IN", timesheet_ids[i:i + self.entry_batch_size])])
+            if error:
+                return [], after_sequence
+            timesheets.extend(self._build_timesheets(result, version))
+
+        return timesheets, changes[-1][0]
+
+    def _build_timesheets(self, timesheet_rows, version = None):
+        # version is the cache's version from before the rows were read, so rows changed since aren't cached
+        cached = {}
+        if self.cache:
+            for timesheet in timesheet_rows:
+                cached_timesheet = self.cache.get(("timesheet", timesheet["timesheet_id"]))
+                # Rows changed by another handler since they were cached are reloaded
+                if cached_timesheet and (cached_timesheet.employee_id, cached_timesheet.department, cached_timesheet.status) == (timesheet["user_id"], timesheet["department"], timesheet["status"]):
+                    cached[timesheet["timesheet_id"]] = cached_timesheet
+
+        # Entries for every uncached row are loaded in a single query rather than one query per timesheet
+        entries = self.get_entries_by_timesheet_ids([timesheet["timesheet_id"] for timesheet in timesheet_rows if timesheet["timesheet_id"] not in cached])
+
+        timesheets = []
+        for timesheet in timesheet_rows:
+            if timesheet["timesheet_id"] in cached:
+                timesheets.append(cached[timesheet["timesheet_id"]])
+                continue
+
+            worked_hours = entries.get(timesheet["timesheet_id"], {})
+            timesheets.append(Timesheet(timesheet["timesheet_id"], timesheet["user_id"], timesheet["department"], worked_hours, timesheet["status"]))
+            if self.cache:
+                self.cache.put(("timesheet", timesheet["timesheet_id"]), timesheets[-1], version)
+
+        return timesheets
     
     def set_timesheet_status(self, timesheet_id, status):
         data = {"status": status}
-        condition = f"timesheet_id = {timesheet_id}"
+        condition = {"timesheet_id": timesheet_id}
         self.db_handler.update_data(self.timesheet_table_name, data, condition)
+        if self.cache:
+            self.cache.invalidate(("timesheet", timesheet_id))
+
+    def set_timesheets_status(self, timesheet_ids, status, from_status = None, department = None):
+        # Changes every timesheet in one transaction and commit, with one UPDATE per batch of IDs. With from_status
+        # or department, only timesheets in that status or department change. Returns the number changed, or None on error.
+        timesheet_ids = list(timesheet_ids)
+        row_count = 0
+
+        with self.db_handler.transaction():
+            for i in range(0, len(timesheet_ids), self.entry_batch_size):
+                conditions = [("timesheet_id", "IN", timesheet_ids[i:i + self.entry_batch_size])]
+                if from_status is not None:
+                    conditions.append(("status", "=", from_status))
+                if department is not None:
+                    conditions.append(("department", "=", department))
+
+                updated, error = self.db_handler.update_rows(self.timesheet_table_name, {"status": status}, conditions)
+                if error:
+                    return None
+                row_count += updated
+
+        if self.cache:
+            for timesheet_id in timesheet_ids:
+                self.cache.invalidate(("timesheet", timesheet_id))
+        return row_count
+
+    def set_department_status(self, department, status, from_status = "Pending", up_to_date = None):
+        # Changes every timesheet in the department that is in from_status, optionally only those with no entries
+        # after up_to_date, in a single UPDATE. Returns the number changed, or None on error.
+        conditions = [("department", "=", department), ("status", "=", from_status)]
+        if up_to_date is not None:
+            conditions.append((f"NOT EXISTS (SELECT 1 FROM {self.timesheet_entry_table_name} entries WHERE entries.timesheet_id = {self.timesheet_table_name}.timesheet_id"
+                               " AND entries.date > ?)", [format_date(up_to_date)]))
+
+        row_count, error = self.db_handler.update_rows(self.timesheet_table_name, {"status": status}, conditions)
+        if error:
+            return None
+
+        if self.cache:
+            self.cache.invalidate_where(lambda key, timesheet: key[0] == "timesheet" and timesheet.department == department)
+        return row_count
 
     def create_timesheet_entry(self, timesheet_id, date, hours_worked):
-        self.db_handler.insert_data(self.timesheet_entry_table_name, (timesheet_id, date, hours_worked)) 
+        self.db_handler.insert_data(self.timesheet_entry_table_name, (timesheet_id, format_date(date), hours_worked))
+        if self.cache:
+            self.cache.invalidate(("timesheet", timesheet_id))
 
     def get_entries_by_timesheet_id(self, timesheet_id):
         data =  ["*"]
-        conditions = [f"timesheet_id = {timesheet_id}"]
+        conditions = {"timesheet_id": timesheet_id}
 
         timesheet_entries, error = self.db_handler.get_data(data, self.timesheet_entry_table_name, conditions)
         
         return {timesheet_entry["date"]: timesheet_entry["hours_worked"] for timesheet_entry in timesheet_entries}
+
+    def get_entries_by_timesheet_ids(self, timesheet_ids):
+        if not timesheet_ids:
+            return {}
+
+        data =  ["timesheet_id", "date", "hours_worked"]
+        entries = {timesheet_id: {} for timesheet_id in timesheet_ids}
+
+        # Batches stay well under SQLite's limit on bound parameters per statement
+        for i in range(0, len(timesheet_ids), self.entry_batch_size):
+            conditions = [("timesheet_id", "IN", timesheet_ids[i:i + self.entry_batch_size])]
+
+            timesheet_entries, error = self.db_handler.iter_data(data, self.timesheet_entry_table_name, conditions, row_type=tuple)
+
+            for timesheet_id, date, hours_worked in timesheet_entries or []:
+                entries[timesheet_id][date] = hours_worked
+
+        return entries
     
     def get_flexi_balance(self, user_id, daily_expected_hours = 7.4):
-        data =  ["hours_worked"]
+        data = ["hours_worked", "entry_count"]
+        conditions = {"user_id": user_id}
+
+        result, error = self.db_handler.get_data(data, self.flexi_balance_table_name, conditions)
+
+        if error:
+            return self.calculate_flexi_balance(user_id, daily_expected_hours)
+
+        return self._balance(result, daily_expected_hours)
+
+    def _balance(self, rows, daily_expected_hours):
+        # A sharded database returns a row for each shard the user has entries in, so the rows are added up
+        hours_worked = sum(row["hours_worked"] for row in rows or [])
+        entry_count = sum(row["entry_count"] for row in rows or [])
+        return hours_worked - (daily_expected_hours * entry_count) if entry_count else 0
+
+    def calculate_flexi_balance(self, user_id, daily_expected_hours = 7.4):
+        # Aggregates the user's entries directly instead of reading the ledger
+        data = ["IFNULL(SUM(hours_worked), 0) AS hours_worked", "COUNT(*) AS entry_count"]
         joins = {self.timesheet_table_name:"timesheet_id"}
-        conditions = [f"user_id = {user_id}", "status != 'Denied'"]
-        
-        timesheet_entries, error = self.db_handler.get_data(data, self.timesheet_entry_table_name, conditions, joins)
+        conditions = [("user_id", "=", user_id), ("status", "!=", "Denied")]
+
+        result, error = self.db_handler.get_data(data, self.timesheet_entry_table_name, conditions, joins)
+
+        return self._balance(result, daily_expected_hours)
+
+    def get_entries_between(self, user_id, start_date, end_date):
+        # Returns the user's (timesheet_id, date, hours_worked, status) entries from start_date to end_date inclusive, in date order
+        data = [f"{self.timesheet_table_name}.timesheet_id", "date", "hours_worked", "status"]
+        joins = {self.timesheet_table_name:"timesheet_id"}
+        conditions = [("user_id", "=", user_id), ("date", ">=", format_date(start_date)), ("date", "<=", format_date(end_date))]
+
+        entries, error = self.db_handler.iter_data(data, self.timesheet_entry_table_name, conditions, joins, row_type=tuple, order_by="date")
+        return list(entries or [])
+
+    def get_flexi_balance_between(self, user_id, start_date, end_date, daily_expected_hours = 7.4):
+        # Like calculate_flexi_balance, but only counts entries from start_date to end_date inclusive
+        data = ["IFNULL(SUM(hours_worked), 0) AS hours_worked", "COUNT(*) AS entry_count"]
+        joins = {self.timesheet_table_name:"timesheet_id"}
+        conditions = [("user_id", "=", user_id), ("status", "!=", "Denied"), ("date", ">=", format_date(start_date)), ("date", "<=", format_date(end_date))]
+
+        result, error = self.db_handler.get_data(data, self.timesheet_entry_table_name, conditions, joins)
+
+        return self._balance(result, daily_expected_hours)
+
+    def get_department_hours(self, department, week_start):
+        # Returns {user_id: hours worked} for the department in the seven days from week_start, leaving out denied timesheets
+        query = (f"SELECT user_id, SUM(hours_worked) AS hours_worked FROM {self.timesheet_entry_table_name} "
+                 f"JOIN {self.timesheet_table_name} ON {self.timesheet_table_name}.timesheet_id = {self.timesheet_entry_table_name}.timesheet_id "
+                 f"WHERE department = ? AND status != 'Denied' AND date >= ? AND date <= ? GROUP BY user_id")
+        parameters = (department, format_date(week_start), format_date(week_start + timedelta(days=6)))
+
+        result, error = self.db_handler.query_data(query, parameters)
+        return {row["user_id"]: row["hours_worked"] for row in result or [] if row["user_id"] is not None}
+
+    def check_flexi_balances(self, tolerance = 1e-6):
+        # Compares the ledger against the aggregate for every user, returning {user_id: (ledger totals, actual totals)} for any that disagree
+        query = (f"SELECT user_id, IFNULL(SUM(hours_worked), 0), COUNT(*) FROM {self.timesheet_entry_table_name} "
+                 f"JOIN {self.timesheet_table_name} ON {self.timesheet_table_name}.timesheet_id = {self.timesheet_entry_table_name}.timesheet_id "
+                 f"WHERE user_id IS NOT NULL AND status != 'Denied' GROUP BY user_id")
+        actual_rows, error = self.db_handler.iter_query_data(query, row_type=tuple)
+        ledger_rows, error = self.db_handler.iter_data(["user_id", "hours_worked", "entry_count"], self.flexi_balance_table_name, row_type=tuple)
+
+        # Totals are added up in case the user has entries in more than one shard
+        actual = {}
+        ledger = {}
+        for totals, rows in ((actual, actual_rows), (ledger, ledger_rows)):
+            for user_id, hours_worked, entry_count in rows or []:
+                user_hours, user_count = totals.get(user_id, (0, 0))
+                totals[user_id] = (user_hours + hours_worked, user_count + entry_count)
+
+        mismatches = {}
+        for user_id in actual.keys() | ledger.keys():
+            ledger_hours, ledger_count = ledger.get(user_id, (0, 0))
+            actual_hours, actual_count = actual.get(user_id, (0, 0))
+
+            if ledger_count != actual_count or abs(ledger_hours - actual_hours) > tolerance:
+                mismatches[user_id] = ((ledger_hours, ledger_count), (actual_hours, actual_count))
+
+        return mismatches
+
+    def get_departments(self):
+        result, error = self.db_handler.get_data(["DISTINCT department"], self.timesheet_table_name, order_by="department")
+        return [row["department"] for row in result or []]
+
+    def iter_entries(self, department = None, user_id = None, chunk_size = 1000):
+        # Streams (timesheet_id, user_id, department, status, date, hours_worked) tuples, with a single row of None date
+        # and hours for timesheets that have no entries. Rows come out in index order, grouped by timesheet, because
+        # sorting by timesheet ID would make SQLite buffer the whole result in a temporary B-tree first.
+        data = [f"{self.timesheet_table_name}.timesheet_id", "user_id", "department", "status", "date", "hours_worked"]
+        joins = {self.timesheet_entry_table_name:"timesheet_id"}
+        conditions = {}
+        if department is not None:
+            conditions["department"] = department
+        if user_id is not None:
+            conditions["user_id"] = user_id
+
+        rows, error = self.db_handler.iter_data(data, self.timesheet_table_name, conditions, joins, chunk_size, tuple)
+        return rows or iter([])
+
+    def iter_flexi_balances(self, department = None, user_id = None, daily_expected_hours = 7.4, chunk_size = 1000):
+        # Streams (user_id, name, department, flexi_balance) tuples from the ledger
+        data = [f"{self.flexi_balance_table_name}.user_id", "name", "department", "hours_worked", "entry_count"]
+        joins = {"users":"user_id"}
+        conditions = {}
+        if department is not None:
+            conditions["department"] = department
+        if user_id is not None:
+            conditions[f"{self.flexi_balance_table_name}.user_id"] = user_id
 
-        if timesheet_entries:
-            total_worked_hours = sum(timesheet_entry['hours_worked'] for timesheet_entry in timesheet_entries)
-            return total_worked_hours - (daily_expected_hours * len(timesheet_entries))
-        else:
-            return 0
\ No newline at end of file
+        rows, error = self.db_handler.iter_data(data, self.flexi_balance_table_name, conditions, joins, chunk_size, tuple,
+                                                order_by=f"{self.flexi_balance_table_name}.user_id")
+        for user_id, name, department, hours_worked, entry_count in rows or []:
+            yield user_id, name, department, (hours_worked - daily_expected_hours * entry_count) if entry_count else 0
@@ -2,9 +2,14 @@ import unittest
 import tempfile
 import os
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-from presenter import UserHandler, TimesheetHandler
-from model import DatabaseHandler
+from presenter import BackgroundTasks, LRUCache, UserHandler, TimesheetHandler, WriteBehindQueue
+from model import DatabaseHandler, ShardedDatabaseHandler
+from instrumentation import QueryInstrumentation
 
 class TestUserHandler(unittest.TestCase):
     def setUp(self):
@@ -61,10 +66,33 @@ class TestUserHandler(unittest.TestCase):
         authenticated_user_empty = self.user_handler.authenticate_user("", "")
         self.assertIsNone(authenticated_user_empty)
 
+    def test_authenticate_user_sql_injection(self):
+        self.user_handler.create_user("Jenna Coleman", "clara@example.com", "impossible", "IT", "User")
+        authenticated_user = self.user_handler.authenticate_user("clara@example.com", "' OR '1'='1")
+        self.assertIsNone(authenticated_user)
+
+    def test_authenticate_user_reuses_statement(self):
+        self.user_handler.create_user("Karen Gillan", "amy@example.com", "pond", "IT", "User")
+        for _ in range(5):
+            self.user_handler.authenticate_user("amy@example.com", "pond")
+        stats = self.db_handler.get_statement_cache_stats()
+        self.assertGreaterEqual(stats["hits"], 4)
+
     def test_authenticate_user_invalid_email(self):
         authenticated_user_invalid_email = self.user_handler.authenticate_user("invalidemail", "password123")
         self.assertIsNone(authenticated_user_invalid_email)
 
+    def test_get_user_by_id_cached(self):
+        user_handler = UserHandler(self.db_handler, LRUCache())
+        user_id = user_handler.create_user("Wendy Padbury", "zoe@example.com", "heriot", "IT", "Employee")
+        user_handler.get_user_by_id(user_id)
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        user = user_handler.get_user_by_id(user_id)
+        self.db_handler.conn.set_trace_callback(None)
+        self.assertEqual(user.name, "Wendy Padbury")
+        self.assertEqual(statements, [])
+
 class TestTimesheetHandler(unittest.TestCase):
     def setUp(self):
         self.temp_folder = tempfile.mkdtemp()
@@ -126,6 +154,16 @@ class TestTimesheetHandler(unittest.TestCase):
         entries = self.timesheet_handler.get_entries_by_timesheet_id(timesheet_id)
         self.assertEqual(len(entries), 1)
 
+    def test_create_timesheet_entry_normalises_dates(self):
+        user_id = self.user_handler.create_user("Nardole", "nardole@example.com", "vault", "IT", "Employee")
+        timesheet_id = self.timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+        self.timesheet_handler.create_timesheet_entry(timesheet_id, datetime(2023, 1, 2), 7.5)
+        for legacy_date in ["02-01-2023", "2023-1-3", "20230104", None]:
+            with self.assertRaises(ValueError):
+                self.timesheet_handler.create_timesheet_entry(timesheet_id, legacy_date, 7.5)
+        self.assertEqual(self.timesheet_handler.get_entries_by_timesheet_id(timesheet_id), {"2023-01-02": 7.5})
+        self.assertEqual(len(self.timesheet_handler.get_entries_between(user_id, datetime(2023, 1, 1), datetime(2023, 1, 31))), 1)
+
     def test_get_flexi_balance_with_entries_success(self):
         user_id = self.user_handler.create_user("Paul McGann", "eight@example.com", "pass890", "Finance", "User")
         timesheet_id = self.timesheet_handler.create_timesheet(user_id, "Finance", "Approved")
@@ -168,4 +206,624 @@ class TestTimesheetHandler(unittest.TestCase):
         entry_hours_min_max = 24.0
         self.timesheet_handler.create_timesheet_entry(timesheet_id, entry_date_min_max, entry_hours_min_max)
         entries = self.timesheet_handler.get_entries_by_timesheet_id(timesheet_id)
-        self.assertEqual(len(entries), 1)
\ No newline at end of file
+        self.assertEqual(len(entries), 1)
+
+    def test_get_entries_by_timesheet_ids_success(self):
+        user_id = self.user_handler.create_user("Jodie Whittaker", "thirteen@example.com", "pass321", "IT", "User")
+        timesheet_id_1 = self.timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+        timesheet_id_2 = self.timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+        self.timesheet_handler.create_timesheet_entry(timesheet_id_1, "2023-01-01", 7.5)
+        self.timesheet_handler.create_timesheet_entry(timesheet_id_1, "2023-01-02", 8.0)
+        entries = self.timesheet_handler.get_entries_by_timesheet_ids([timesheet_id_1, timesheet_id_2])
+        self.assertEqual(entries, {timesheet_id_1: {"2023-01-01": 7.5, "2023-01-02": 8.0}, timesheet_id_2: {}})
+
+    def test_get_timesheets_by_status_query_count(self):
+        user_id = self.user_handler.create_user("Ncuti Gatwa", "fifteen@example.com", "pass654", "IT", "User")
+        for _ in range(20):
+            timesheet_id = self.timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+            self.timesheet_handler.create_timesheet_entry(timesheet_id, "2023-01-01", 7.4)
+
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        timesheets = self.timesheet_handler.get_timesheets_by_status("IT", "Pending")
+        self.db_handler.conn.set_trace_callback(None)
+
+        self.assertEqual(len(timesheets), 20)
+        self.assertEqual(timesheets[0].worked_hours, {"2023-01-01": 7.4})
+        self.assertLessEqual(len(statements), 2)
+
+    def test_get_timesheet_by_id_query_count(self):
+        user_id = self.user_handler.create_user("Jo Martin", "fugitive@example.com", "pass987", "IT", "User")
+        timesheet_id = self.timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+        self.timesheet_handler.create_timesheet_entry(timesheet_id, "2023-01-01", 6.0)
+
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        timesheet = self.timesheet_handler.get_timesheet_by_id(timesheet_id)
+        self.db_handler.conn.set_trace_callback(None)
+
+        self.assertEqual(timesheet.worked_hours, {"2023-01-01": 6.0})
+        self.assertLessEqual(len(statements), 2)
+
+    def test_submit_timesheet_success(self):
+        user_id = self.user_handler.create_user("Sacha Dhawan", "master@example.com", "pass111", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        timesheet_id = self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [7.5, 7.5, 8.0, 7.0, 6.0])
+        timesheet = self.timesheet_handler.get_timesheet_by_id(timesheet_id)
+        self.assertEqual(timesheet.status, "Pending")
+        self.assertEqual(timesheet.department, "IT")
+        self.assertEqual(timesheet.worked_hours, {"2023-01-02": 7.5, "2023-01-03": 7.5, "2023-01-04": 8.0, "2023-01-05": 7.0, "2023-01-06": 6.0})
+
+    def test_submit_timesheet_single_commit(self):
+        user_id = self.user_handler.create_user("Michelle Gomez", "missy@example.com", "pass222", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [7.4] * 5)
+        self.db_handler.conn.set_trace_callback(None)
+        self.assertEqual(statements.count("COMMIT"), 1)
+
+    def test_submit_timesheet_failure_writes_nothing(self):
+        user_id = self.user_handler.create_user("Roger Delgado", "delgado@example.com", "pass333", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        timesheet_id = self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [7.4, 7.4, object(), 7.4, 7.4])
+        self.assertIsNone(timesheet_id)
+        self.assertIsNone(self.timesheet_handler.get_timesheets_by_status("IT", "Pending"))
+
+    def test_concurrent_submissions_and_approvals(self):
+        db_handler = DatabaseHandler(os.path.join(self.temp_folder, "pooled_db.sqlite"), pooled = True)
+        user_handler = UserHandler(db_handler)
+        timesheet_handler = TimesheetHandler(db_handler)
+        users = [user_handler.get_user_by_id(user_handler.create_user(f"Companion {i}", f"companion{i}@example.com", "tardis", "IT", "Employee")) for i in range(8)]
+        submitted = []
+
+        def employee(user):
+            for _ in range(10):
+                submitted.append(timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [7.4] * 5))
+
+        def manager():
+            for _ in range(20):
+                for timesheet in timesheet_handler.get_timesheets_by_status("IT", "Pending") or []:
+                    timesheet_handler.set_timesheet_status(timesheet.timesheet_id, "Approved")
+
+        threads = [threading.Thread(target=employee, args=(user,)) for user in users] + [threading.Thread(target=manager) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(submitted), 80)
+        self.assertNotIn(None, submitted)
+        self.assertAlmostEqual(timesheet_handler.get_flexi_balance(users[0].user_id), 0)
+        db_handler.close()
+
+    def test_flexi_balance_ledger_follows_status_changes(self):
+        user_id = self.user_handler.create_user("Tom Baker", "fourth@example.com", "scarf", "IT", "Employee")
+        timesheet_id = self.timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+        self.timesheet_handler.create_timesheet_entry(timesheet_id, "2023-01-01", 9.0)
+        self.timesheet_handler.create_timesheet_entry(timesheet_id, "2023-01-02", 8.0)
+        self.assertAlmostEqual(self.timesheet_handler.get_flexi_balance(user_id, daily_expected_hours=8), 1.0)
+        self.timesheet_handler.set_timesheet_status(timesheet_id, "Denied")
+        self.assertEqual(self.timesheet_handler.get_flexi_balance(user_id, daily_expected_hours=8), 0)
+        self.timesheet_handler.set_timesheet_status(timesheet_id, "Approved")
+        self.assertAlmostEqual(self.timesheet_handler.get_flexi_balance(user_id, daily_expected_hours=8), 1.0)
+        self.assertEqual(self.timesheet_handler.check_flexi_balances(), {})
+
+    def test_flexi_balance_single_query(self):
+        user_id = self.user_handler.create_user("Lalla Ward", "romana@example.com", "k9", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        for _ in range(10):
+            self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [8.4] * 5)
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        balance = self.timesheet_handler.get_flexi_balance(user_id)
+        self.db_handler.conn.set_trace_callback(None)
+        self.assertAlmostEqual(balance, 50.0)
+        self.assertEqual(len(statements), 1)
+
+    def test_calculate_flexi_balance_matches_ledger(self):
+        user_id = self.user_handler.create_user("Louise Jameson", "leela@example.com", "janis", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        for hours in ([7.0] * 5, [9.5] * 5):
+            timesheet_id = self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), hours)
+        self.timesheet_handler.set_timesheet_status(timesheet_id, "Denied")
+        self.assertAlmostEqual(self.timesheet_handler.calculate_flexi_balance(user_id), -2.0)
+        self.assertAlmostEqual(self.timesheet_handler.get_flexi_balance(user_id), -2.0)
+
+    def test_check_flexi_balances_detects_drift(self):
+        user_id = self.user_handler.create_user("Elisabeth Sladen", "sarah@example.com", "jane", "IT", "Employee")
+        timesheet_id = self.timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+        self.timesheet_handler.create_timesheet_entry(timesheet_id, "2023-01-01", 7.4)
+        self.db_handler.update_data("flexi_balances", {"hours_worked": 100}, {"user_id": user_id})
+        mismatches = self.timesheet_handler.check_flexi_balances()
+        self.assertEqual(mismatches, {user_id: ((100, 1), (7.4, 1))})
+
+    def test_cached_timesheets_invalidated_by_writes(self):
+        cache = LRUCache()
+        timesheet_handler = TimesheetHandler(self.db_handler, cache)
+        user_id = self.user_handler.create_user("Frazer Hines", "jamie@example.com", "kilt", "IT", "Employee")
+        timesheet_id = timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+        self.assertEqual(timesheet_handler.get_timesheet_by_id(timesheet_id).worked_hours, {})
+        timesheet_handler.create_timesheet_entry(timesheet_id, "2023-01-01", 7.4)
+        self.assertEqual(timesheet_handler.get_timesheet_by_id(timesheet_id).worked_hours, {"2023-01-01": 7.4})
+        timesheet_handler.set_timesheet_status(timesheet_id, "Approved")
+        self.assertEqual(timesheet_handler.get_timesheet_by_id(timesheet_id).status, "Approved")
+        self.assertEqual(cache.get_stats()["invalidations"], 2)
+
+    def test_cache_drops_timesheets_read_before_a_write(self):
+        cache = LRUCache()
+        timesheet_handler = TimesheetHandler(self.db_handler, cache)
+        writer = TimesheetHandler(self.db_handler, cache)
+        user_id = self.user_handler.create_user("Wendy Padbury", "zoe@example.com", "wheel", "IT", "Employee")
+        timesheet_id = timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+
+        # The writer commits and invalidates after the reader has read the row but before it caches it
+        get_data = self.db_handler.get_data
+        def racing_get_data(*args, **kwargs):
+            result = get_data(*args, **kwargs)
+            self.db_handler.get_data = get_data
+            writer.set_timesheet_status(timesheet_id, "Approved")
+            return result
+        self.db_handler.get_data = racing_get_data
+
+        self.assertEqual(timesheet_handler.get_timesheet_by_id(timesheet_id).status, "Pending")
+        timesheet = timesheet_handler.get_timesheet_by_id(timesheet_id)
+        self.assertEqual(timesheet.status, "Approved")
+        timesheet.status = "Denied"
+        timesheet.worked_hours["2023-01-02"] = 7.4
+        self.assertEqual(timesheet_handler.get_timesheet_by_id(timesheet_id).status, "Approved")
+        self.assertEqual(timesheet_handler.get_timesheet_by_id(timesheet_id).worked_hours, {})
+
+    def test_cached_timesheets_by_status_skip_entry_queries(self):
+        cache = LRUCache()
+        timesheet_handler = TimesheetHandler(self.db_handler, cache)
+        user_id = self.user_handler.create_user("Deborah Watling", "victoria@example.com", "waterfield", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        timesheet_ids = [timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [7.4] * 5) for _ in range(5)]
+        timesheet_handler.get_timesheets_by_status("IT", "Pending")
+        timesheet_handler.set_timesheet_status(timesheet_ids[0], "Approved")
+
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        timesheets = timesheet_handler.get_timesheets_by_status("IT", "Pending")
+        self.db_handler.conn.set_trace_callback(None)
+
+        self.assertEqual([timesheet.timesheet_id for timesheet in timesheets], timesheet_ids[1:])
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(cache.get_stats()["hits"], 4)
+
+    def test_get_timesheets_page_walks_all_pages(self):
+        user_id = self.user_handler.create_user("Carole Ann Ford", "susan@example.com", "foreman", "IT", "Employee")
+        timesheet_ids = [self.timesheet_handler.create_timesheet(user_id, "IT", "Pending") for _ in range(25)]
+        self.timesheet_handler.create_timesheet(user_id, "HR", "Pending")
+        self.timesheet_handler.set_timesheet_status(timesheet_ids[3], "Approved")
+
+        pages = []
+        cursor = None
+        while True:
+            timesheets, cursor = self.timesheet_handler.get_timesheets_page("IT", "Pending", cursor, page_size = 10)
+            pages.append([timesheet.timesheet_id for timesheet in timesheets])
+            if cursor is None:
+                break
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 4])
+        self.assertEqual(sum(pages, []), timesheet_ids[:3] + timesheet_ids[4:])
+
+    def test_get_timesheets_page_exact_fit(self):
+        user_id = self.user_handler.create_user("William Russell", "ian@example.com", "chesterton", "IT", "Employee")
+        for _ in range(10):
+            self.timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+        timesheets, cursor = self.timesheet_handler.get_timesheets_page("IT", "Pending", page_size = 10)
+        self.assertEqual(len(timesheets), 10)
+        self.assertIsNone(cursor)
+
+    def test_get_timesheets_page_needs_positive_size(self):
+        for page_size in [0, -2]:
+            with self.assertRaises(ValueError):
+                self.timesheet_handler.get_timesheets_page("IT", "Pending", page_size = page_size)
+
+    def test_get_timesheets_page_not_found(self):
+        timesheets, cursor = self.timesheet_handler.get_timesheets_page("NonexistentDepartment", "Pending")
+        self.assertEqual(timesheets, [])
+        self.assertIsNone(cursor)
+
+    def test_get_timesheets_page_uses_index(self):
+        plan, error = self.db_handler.query_data("EXPLAIN QUERY PLAN SELECT * FROM timesheets WHERE department = ? AND status = ? AND timesheet_id > ? ORDER BY timesheet_id LIMIT ?", ("IT", "Pending", 0, 11))
+        self.assertIn("idx_timesheets_department_status", plan[0]["detail"])
+        self.assertNotIn("TEMP B-TREE", " ".join(row["detail"] for row in plan))
+
+    def test_iter_entries_and_flexi_balances(self):
+        user_id = self.user_handler.create_user("Yasmin Khan", "yaz@example.com", "sheffield", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        timesheet_id = self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [8.0, 9.0])
+        self.timesheet_handler.create_timesheet(user_id, "HR", "Pending")
+        entries = list(self.timesheet_handler.iter_entries(department = "IT"))
+        self.assertEqual(entries, [(timesheet_id, user_id, "IT", "Pending", "2023-01-02", 8.0), (timesheet_id, user_id, "IT", "Pending", "2023-01-03", 9.0)])
+        self.assertEqual(len(list(self.timesheet_handler.iter_entries(user_id = user_id))), 3)
+        balances = list(self.timesheet_handler.iter_flexi_balances(department = "IT", daily_expected_hours = 8))
+        self.assertEqual(balances, [(user_id, "Yasmin Khan", "IT", 1.0)])
+        self.assertEqual(self.timesheet_handler.get_departments(), ["HR", "IT"])
+
+    def test_set_timesheets_status_single_update_and_commit(self):
+        user_id = self.user_handler.create_user("Clara Oswald", "clara@example.com", "souffle", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        timesheet_ids = [self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [8.4] * 5) for _ in range(3)]
+        self.timesheet_handler.set_timesheet_status(timesheet_ids[2], "Denied")
+        self.db_handler.instrumentation = QueryInstrumentation()
+        row_count = self.timesheet_handler.set_timesheets_status(timesheet_ids, "Approved", "Pending")
+        report = self.db_handler.instrumentation.get_report()
+        self.db_handler.instrumentation = None
+        self.assertEqual(row_count, 2)
+        self.assertEqual(report["commits"], 1)
+        self.assertEqual([statement["count"] for statement in report["statements"].values()], [1])
+        self.assertEqual([self.timesheet_handler.get_timesheet_by_id(timesheet_id).status for timesheet_id in timesheet_ids], ["Approved", "Approved", "Denied"])
+        self.assertAlmostEqual(self.timesheet_handler.get_flexi_balance(user_id), 10.0)
+        self.assertEqual(self.timesheet_handler.check_flexi_balances(), {})
+
+    def test_set_department_status_up_to_date(self):
+        user_id = self.user_handler.create_user("Danny Pink", "danny@example.com", "soldier", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        early_id = self.timesheet_handler.submit_timesheet(user, datetime(2022, 12, 26), [7.4] * 5)
+        late_id = self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 30), [7.4] * 5)
+        other_id = self.timesheet_handler.create_timesheet(user_id, "HR", "Pending")
+        self.assertEqual(self.timesheet_handler.set_department_status("IT", "Approved", up_to_date = datetime(2022, 12, 29)), 0)
+        self.assertEqual(self.timesheet_handler.set_department_status("IT", "Approved", up_to_date = datetime(2023, 1, 6)), 1)
+        self.assertEqual(self.timesheet_handler.get_timesheet_by_id(early_id).status, "Approved")
+        self.assertEqual(self.timesheet_handler.get_timesheet_by_id(late_id).status, "Pending")
+        self.assertEqual(self.timesheet_handler.set_department_status("IT", "Denied"), 1)
+        self.assertEqual(self.timesheet_handler.get_timesheet_by_id(late_id).status, "Denied")
+        self.assertEqual(self.timesheet_handler.get_timesheet_by_id(other_id).status, "Pending")
+
+    def test_set_department_status_single_update(self):
+        cache = LRUCache()
+        timesheet_handler = TimesheetHandler(self.db_handler, cache)
+        user_id = self.user_handler.create_user("Bill Potts", "bill@example.com", "chips", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        timesheet_ids = [timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [7.4] * 5) for _ in range(3)]
+        other_id = timesheet_handler.create_timesheet(user_id, "HR", "Pending")
+        timesheet_handler.get_timesheets_by_status("IT", "Pending")
+        timesheet_handler.get_timesheet_by_id(other_id)
+
+        self.db_handler.instrumentation = QueryInstrumentation()
+        row_count = timesheet_handler.set_department_status("IT", "Approved", up_to_date = datetime(2023, 1, 6))
+        report = self.db_handler.instrumentation.get_report()
+        self.db_handler.instrumentation = None
+
+        self.assertEqual(row_count, 3)
+        self.assertEqual([statement["count"] for statement in report["statements"].values()], [1])
+        self.assertEqual(report["commits"], 1)
+        self.assertEqual(cache.get_stats()["invalidations"], 3)
+        self.assertEqual([timesheet_handler.get_timesheet_by_id(timesheet_id).status for timesheet_id in timesheet_ids], ["Approved"] * 3)
+        self.assertEqual(timesheet_handler.get_timesheet_by_id(other_id).status, "Pending")
+
+    def test_handlers_check_schema_once_per_connection(self):
+        statements = []
+        self.db_handler.conn.set_trace_callback(statements.append)
+        UserHandler(self.db_handler)
+        TimesheetHandler(self.db_handler)
+        self.db_handler.conn.set_trace_callback(None)
+        self.assertEqual(statements, [])
+
+    def test_date_range_queries(self):
+        user_id = self.user_handler.create_user("River Song", "river@example.com", "spoilers", "IT", "Employee")
+        other_id = self.user_handler.create_user("Rory Williams", "rory@example.com", "centurion", "IT", "Employee")
+        user, other = self.user_handler.get_user_by_id(user_id), self.user_handler.get_user_by_id(other_id)
+        first_id = self.timesheet_handler.submit_timesheet(user, datetime(2022, 12, 26), [8.0] * 5)
+        second_id = self.timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [9.0] * 5)
+        self.timesheet_handler.submit_timesheet(other, datetime(2023, 1, 2), [6.0] * 5)
+        denied_id = self.timesheet_handler.submit_timesheet(other, datetime(2023, 1, 2), [1.0] * 5)
+        self.timesheet_handler.set_timesheet_status(denied_id, "Denied")
+
+        entries = self.timesheet_handler.get_entries_between(user_id, datetime(2022, 12, 29), datetime(2023, 1, 3))
+        self.assertEqual(entries, [(first_id, "2022-12-29", 8.0, "Pending"), (first_id, "2022-12-30", 8.0, "Pending"),
+                                   (second_id, "2023-01-02", 9.0, "Pending"), (second_id, "2023-01-03", 9.0, "Pending")])
+        self.assertAlmostEqual(self.timesheet_handler.get_flexi_balance_between(user_id, datetime(2023, 1, 1), datetime(2023, 1, 31), daily_expected_hours = 8), 5.0)
+        self.assertEqual(self.timesheet_handler.get_flexi_balance_between(user_id, datetime(2024, 1, 1), datetime(2024, 1, 31)), 0)
+        self.assertEqual(self.timesheet_handler.get_department_hours("IT", datetime(2023, 1, 2)), {user_id: 45.0, other_id: 30.0})
+
+    def test_date_range_queries_use_index(self):
+        for query in ["SELECT * FROM timesheet_entries LEFT JOIN timesheets ON timesheets.timesheet_id=timesheet_entries.timesheet_id WHERE user_id = ? AND date >= ? AND date <= ?",
+                      "SELECT user_id, SUM(hours_worked) FROM timesheet_entries JOIN timesheets ON timesheets.timesheet_id = timesheet_entries.timesheet_id WHERE department = ? AND date >= ? AND date <= ? GROUP BY user_id"]:
+            plan, error = self.db_handler.query_data(f"EXPLAIN QUERY PLAN {query}", (1, "2023-01-02", "2023-01-08"))
+            details = " ".join(row["detail"] for row in plan)
+            self.assertNotIn("SCAN timesheet_entries", details)
+            self.assertNotIn("SCAN timesheets", details)
+            self.assertIn("date>? AND date<?", details)
+
+    def test_changed_timesheets(self):
+        user_id = self.user_handler.create_user("Graham O'Brien", "graham@example.com", "bus", "IT", "Employee")
+        user = self.user_handler.get_user_by_id(user_id)
+        cache = LRUCache()
+        timesheet_handler = TimesheetHandler(self.db_handler, cache)
+        self.assertEqual(timesheet_handler.get_changed_timesheets("IT"), ([], 0))
+
+        first_id = timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [7.4] * 2)
+        second_id = timesheet_handler.create_timesheet(user_id, "IT", "Pending")
+        self.timesheet_handler.create_timesheet("HR", "HR", "Pending")
+        changes = timesheet_handler.get_changes("IT")
+        self.assertEqual([(timesheet_id, change) for sequence, timesheet_id, change in changes],
+                         [(first_id, "created"), (first_id, "entry"), (first_id, "entry"), (second_id, "created")])
+        timesheets, sequence = timesheet_handler.get_changed_timesheets("IT", 0)
+        self.assertEqual([timesheet.timesheet_id for timesheet in timesheets], [first_id, second_id])
+        self.assertEqual(sequence, changes[-1][0])
+        self.assertEqual(timesheet_handler.get_changed_timesheets("IT", sequence), ([], sequence))
+
+        # Changes made through another handler reach this one's cached timesheets
+        timesheet_handler.get_timesheet_by_id(second_id)
+        self.timesheet_handler.create_timesheet_entry(second_id, "2023-01-09", 8.0)
+        self.timesheet_handler.set_timesheets_status([first_id], "Approved")
+        self.timesheet_handler.set_timesheets_status([first_id], "Approved")
+        timesheets, sequence = timesheet_handler.get_changed_timesheets("IT", sequence)
+        self.assertEqual({timesheet.timesheet_id: (timesheet.status, timesheet.worked_hours) for timesheet in timesheets},
+                         {first_id: ("Approved", {"2023-01-02": 7.4, "2023-01-03": 7.4}), second_id: ("Pending", {"2023-01-09": 8.0})})
+        self.assertEqual(len(timesheet_handler.get_changes("IT", limit = 100)), 6)
+
+    def test_in_memory_database(self):
+        db_path = os.path.join(self.temp_folder, "memory.sqlite")
+        for durability in ("write-through", "snapshot"):
+            db_handler = DatabaseHandler(db_path, in_memory = True, durability = durability)
+            user_handler = UserHandler(db_handler)
+            timesheet_handler = TimesheetHandler(db_handler)
+            user = user_handler.get_user_by_id(user_handler.create_user("Martha Jones", f"{durability}@example.com", "doctor", "IT", "Employee"))
+            timesheet_handler.submit_timesheet(user, datetime(2023, 1, 2), [8.4] * 5)
+            db_handler.close()
+
+            db_handler = DatabaseHandler(db_path)
+            self.assertAlmostEqual(TimesheetHandler(db_handler).get_flexi_balance(user.user_id), 5.0)
+            db_handler.close()
+
+    def test_changes_use_index(self):
+        plan = self.db_handler.explain("SELECT sequence, timesheet_id, change FROM timesheet_changes WHERE department = ? AND sequence > ? ORDER BY sequence LIMIT ?", ("IT", 0, 10))
+        self.assertIn("USING INDEX idx_timesheet_changes_department_sequence", " ".join(plan))
+        self.assertNotIn("TEMP B-TREE", " ".join(plan))
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_and_put(self):
+        cache = LRUCache(max_size = 2)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get_stats()["hits"], 1)
+        self.assertEqual(cache.get_stats()["misses"], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size = 2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+    def test_ttl_expires_entries(self):
+        cache = LRUCache(ttl = 0.01)
+        cache.put("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get_stats()["expirations"], 1)
+
+    def test_invalidate(self):
+        cache = LRUCache()
+        cache.put("a", 1)
+        cache.invalidate("a")
+        cache.invalidate("missing")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get_stats()["invalidations"], 1)
+
+    def test_invalidate_where(self):
+        cache = LRUCache()
+        for key in range(4):
+            cache.put(key, key * 10)
+        cache.invalidate_where(lambda key, value: value >= 20)
+        self.assertEqual([cache.get(key) for key in range(4)], [0, 10, None, None])
+        self.assertEqual(cache.get_stats()["invalidations"], 2)
+
+    def test_put_after_invalidate_is_dropped(self):
+        cache = LRUCache(max_size = 2)
+        version = cache.version()
+        cache.invalidate("a")
+        cache.put("a", "stale", version)
+        cache.put("b", "fresh", version)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), "fresh")
+        cache.put("a", "current", cache.version())
+        self.assertEqual(cache.get("a"), "current")
+
+        # Once "a" is forgotten, every put read before its invalidation is dropped
+        version = cache.version()
+        cache.invalidate("a")
+        cache.invalidate("b")
+        cache.invalidate("c")
+        cache.put("a", "stale", version)
+        self.assertIsNone(cache.get("a"))
+
+    def test_values_are_copied(self):
+        cache = LRUCache()
+        value = {"status": "Pending"}
+        cache.put("a", value)
+        value["status"] = "Approved"
+        cache.get("a")["status"] = "Denied"
+        self.assertEqual(cache.get("a"), {"status": "Pending"})
+
+class TestBackgroundTasks(unittest.TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+
+    def test_submit_delivers_result(self):
+        tasks = BackgroundTasks(self.executor)
+        results = []
+        future = tasks.submit(sum, [1, 2, 3], on_done=lambda result, error: results.append((result, error)))
+        future.result()
+        self.executor.shutdown(wait=True)
+        self.assertEqual(results, [(6, None)])
+        self.assertEqual(tasks.pending(), 0)
+
+    def test_submit_delivers_error(self):
+        tasks = BackgroundTasks(self.executor)
+        results = []
+        tasks.submit(int, "not a number", on_done=lambda result, error: results.append((result, error)))
+        self.executor.shutdown(wait=True)
+        self.assertIsNone(results[0][0])
+        self.assertIsInstance(results[0][1], ValueError)
+
+    def test_cancel_drops_results(self):
+        tasks = BackgroundTasks(self.executor)
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def slow_load():
+            started.set()
+            release.wait()
+            return "loaded"
+
+        tasks.submit(slow_load, on_done=lambda result, error: results.append(result))
+        queued = [tasks.submit(slow_load, on_done=lambda result, error: results.append(result)) for _ in range(3)]
+        started.wait()
+        tasks.cancel()
+        release.set()
+        self.executor.shutdown(wait=True)
+        self.assertEqual(results, [])
+        self.assertTrue(any(future.cancelled() for future in queued))
+
+    def test_presenter_calls_from_worker_threads(self):
+        temp_folder = tempfile.mkdtemp()
+        db_handler = DatabaseHandler(os.path.join(temp_folder, "test_db.sqlite"), pooled = True)
+        user_handler = UserHandler(db_handler)
+        user_handler.create_user("Bill Potts", "bill@example.com", "heather", "IT", "Employee")
+        tasks = BackgroundTasks(self.executor)
+        results = []
+        for _ in range(4):
+            tasks.submit(user_handler.authenticate_user, "bill@example.com", "heather", on_done=lambda result, error: results.append(result))
+        self.executor.shutdown(wait=True)
+        db_handler.close()
+        shutil.rmtree(temp_folder)
+        self.assertEqual([user.name for user in results], ["Bill Potts"] * 4)
+
+class TestWriteBehindQueue(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.db_handler = DatabaseHandler(os.path.join(self.temp_folder, "test_db.sqlite"), pooled = True)
+        self.user_handler = UserHandler(self.db_handler)
+        self.write_behind = WriteBehindQueue(self.db_handler, max_batch_size = 50, max_delay_ms = 50)
+        self.timesheet_handler = TimesheetHandler(self.db_handler, write_behind = self.write_behind)
+        self.user = self.user_handler.get_user_by_id(self.user_handler.create_user("Ryan Sinclair", "ryan@example.com", "bike", "IT", "Employee"))
+
+    def tearDown(self):
+        self.write_behind.close()
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def test_submissions_share_commits(self):
+        self.db_handler.instrumentation = QueryInstrumentation()
+        futures = [self.timesheet_handler.submit_timesheet_async(self.user, datetime(2023, 1, 2), [7.4] * 5) for _ in range(120)]
+        timesheet_ids = [future.result(timeout = 5) for future in futures]
+        commits = self.db_handler.instrumentation.get_report()["commits"]
+        self.db_handler.instrumentation = None
+        self.assertEqual(len(set(timesheet_ids)), 120)
+        self.assertNotIn(None, timesheet_ids)
+        self.assertLessEqual(commits, 10)
+        self.assertEqual(self.write_behind.writes, 120)
+        self.assertEqual(len(self.timesheet_handler.get_timesheets_by_status("IT", "Pending")), 120)
+
+    def test_failed_write_does_not_fail_group(self):
+        good = self.timesheet_handler.submit_timesheet_async(self.user, datetime(2023, 1, 2), [7.4] * 5)
+        bad = self.timesheet_handler.submit_timesheet_async(self.user, datetime(2023, 1, 2), [7.4, object()])
+        self.write_behind.flush()
+        self.assertIsNotNone(good.result())
+        self.assertIsNone(bad.result())
+        self.assertEqual(len(self.timesheet_handler.get_timesheets_by_status("IT", "Pending")), 1)
+
+    def test_close_commits_queued_writes(self):
+        futures = [self.timesheet_handler.submit_timesheet_async(self.user, datetime(2023, 1, 2), [7.4] * 5) for _ in range(10)]
+        self.write_behind.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(len(self.timesheet_handler.get_timesheets_by_status("IT", "Pending")), 10)
+        with self.assertRaises(RuntimeError):
+            self.write_behind.submit(print)
+
+    def test_cancelled_write_is_dropped(self):
+        cancelled = self.timesheet_handler.submit_timesheet_async(self.user, datetime(2023, 1, 2), [7.4] * 5)
+        self.assertTrue(cancelled.cancel())
+        timesheet_id = self.timesheet_handler.submit_timesheet_async(self.user, datetime(2023, 1, 9), [7.4] * 5).result(timeout = 5)
+        self.assertIsNotNone(timesheet_id)
+        self.write_behind.flush(timeout = 5)
+        self.assertTrue(self.write_behind._thread.is_alive())
+        self.assertEqual([timesheet.timesheet_id for timesheet in self.timesheet_handler.get_timesheets_by_status("IT", "Pending")], [timesheet_id])
+
+    def test_close_releases_writer_connection(self):
+        self.timesheet_handler.submit_timesheet_async(self.user, datetime(2023, 1, 2), [7.4] * 5).result(timeout = 5)
+        self.assertEqual(len(self.db_handler._states), 2)
+        self.write_behind.close()
+        self.assertEqual(self.db_handler._states, [self.db_handler._state])
+
+    def test_without_write_behind(self):
+        timesheet_handler = TimesheetHandler(self.db_handler)
+        self.assertIsNotNone(timesheet_handler.submit_timesheet_async(self.user, datetime(2023, 1, 2), [7.4] * 5).result())
+
+    def test_needs_pooled_handler(self):
+        db_handler = DatabaseHandler(os.path.join(self.temp_folder, "plain.sqlite"))
+        with self.assertRaises(ValueError):
+            WriteBehindQueue(db_handler)
+        db_handler.close()
+
+class TestShardedTimesheetHandler(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.db_handler = ShardedDatabaseHandler(os.path.join(self.temp_folder, "test_db.sqlite"), max_workers = 4)
+        self.user_handler = UserHandler(self.db_handler)
+        self.timesheet_handler = TimesheetHandler(self.db_handler)
+        self.employee = self.user_handler.get_user_by_id(self.user_handler.create_user("Yasmin Khan", "yaz@example.com", "police", "IT", "Employee"))
+        self.other = self.user_handler.get_user_by_id(self.user_handler.create_user("Dan Lewis", "dan@example.com", "food", "HR", "Employee"))
+
+    def tearDown(self):
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def test_users_are_found_across_shards(self):
+        self.assertEqual(self.employee.department, "IT")
+        self.assertEqual(self.user_handler.authenticate_user("dan@example.com", "food").user_id, self.other.user_id)
+        self.assertIsNone(self.user_handler.authenticate_user("dan@example.com", "wrong"))
+
+    def test_submit_and_approve(self):
+        timesheet_id = self.timesheet_handler.submit_timesheet(self.employee, datetime(2023, 1, 2), [8.4] * 5)
+        self.timesheet_handler.submit_timesheet(self.other, datetime(2023, 1, 2), [7.4] * 5)
+
+        timesheets, next_cursor = self.timesheet_handler.get_timesheets_page("IT", "Pending")
+        self.assertEqual([timesheet.timesheet_id for timesheet in timesheets], [timesheet_id])
+        self.assertEqual(self.timesheet_handler.get_timesheet_by_id(timesheet_id).worked_hours["2023-01-02"], 8.4)
+        self.assertEqual(self.timesheet_handler.set_timesheets_status([timesheet_id], "Approved", "Pending", "HR"), 0)
+        self.assertEqual(self.timesheet_handler.set_department_status("IT", "Approved"), 1)
+        self.assertEqual(self.timesheet_handler.get_departments(), ["HR", "IT"])
+        timesheets, sequence = self.timesheet_handler.get_changed_timesheets("IT", 0)
+        self.assertEqual([(timesheet.timesheet_id, timesheet.status) for timesheet in timesheets], [(timesheet_id, "Approved")])
+
+    def test_balance_adds_up_every_shard(self):
+        # A timesheet filed under another department, as if the user had moved, lands in that department's shard
+        self.timesheet_handler.submit_timesheet(self.employee, datetime(2023, 1, 2), [8.4] * 5)
+        moved = self.user_handler.get_user_by_id(self.employee.user_id)
+        moved.department = "HR"
+        self.timesheet_handler.submit_timesheet(moved, datetime(2023, 1, 9), [8.4] * 5)
+
+        self.assertAlmostEqual(self.timesheet_handler.get_flexi_balance(self.employee.user_id), 10)
+        self.assertAlmostEqual(self.timesheet_handler.calculate_flexi_balance(self.employee.user_id), 10)
+        self.assertEqual([entry[1] for entry in self.timesheet_handler.get_entries_between(self.employee.user_id, datetime(2023, 1, 1), datetime(2023, 1, 31))],
+                         ["2023-01-02", "2023-01-03", "2023-01-04", "2023-01-05", "2023-01-06",
+                          "2023-01-09", "2023-01-10", "2023-01-11", "2023-01-12", "2023-01-13"])
+        self.assertEqual(self.timesheet_handler.check_flexi_balances(), {})
+
+    def test_write_behind(self):
+        write_behind = WriteBehindQueue(self.db_handler, max_batch_size = 20, max_delay_ms = 20)
+        timesheet_handler = TimesheetHandler(self.db_handler, write_behind = write_behind)
+        futures = [timesheet_handler.submit_timesheet_async(user, datetime(2023, 1, 2), [7.4] * 5) for user in [self.employee, self.other] * 20]
+        timesheet_ids = [future.result(timeout = 5) for future in futures]
+        write_behind.close()
+        self.assertNotIn(None, timesheet_ids)
+        self.assertEqual(len(self.timesheet_handler.get_timesheets_by_status("HR", "Pending")), 20)
@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+from model import DatabaseHandler, ShardedDatabaseHandler
+from presenter import LRUCache, UserHandler, TimesheetHandler, WriteBehindQueue
+
+# Run from the src folder with: python server.py --database database.sqlite --port 8080
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+               413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADERS = 100
+MAX_PAGE_SIZE = 100
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def user_to_dict(user):
+    return {"user_id": user.user_id, "name": user.name, "email": user.email, "department": user.department, "role": user.role}
+
+def timesheet_to_dict(timesheet):
+    return {"timesheet_id": timesheet.timesheet_id, "user_id": timesheet.employee_id, "department": timesheet.department,
+            "status": timesheet.status, "worked_hours": timesheet.worked_hours}
+
+class FlexiTimeServer:
+    def __init__(self, user_handler, timesheet_handler, executor, max_concurrent_requests = 32, keep_alive_timeout = 15,
+                 session_timeout = 8 * 60 * 60):
+        # Serves the presenters over HTTP/JSON. Requests are parsed on the event loop and the presenter calls, which
+        # block on SQLite, run on the executor's threads, so the DatabaseHandler should be pooled.
+        self.user_handler = user_handler
+        self.timesheet_handler = timesheet_handler
+        self.executor = executor
+        self.max_concurrent_requests = max_concurrent_requests
+        self.keep_alive_timeout = keep_alive_timeout
+
+        # Session token -> (User, last used), filled in by /login. Kept in order of last use, so sessions unused for
+        # session_timeout seconds are at the front and are dropped from there.
+        self.session_timeout = session_timeout
+        self.sessions = OrderedDict()
+        self._sessions_lock = threading.Lock()
+        self.routes = {
+            ("POST", "/login"): self.login,
+            ("POST", "/logout"): self.logout,
+            ("GET", "/balance"): self.balance,
+            ("POST", "/timesheets"): self.submit_timesheet,
+            ("GET", "/timesheets/pending"): self.pending_timesheets,
+            ("POST", "/timesheets/status"): self.set_timesheets_status,
+        }
+        self.server = None
+        self._request_slots = None
+
+    async def start(self, host = "127.0.0.1", port = 8080):
+        # Created here rather than in __init__ so it belongs to the running event loop on Python 3.8 and 3.9
+        self._request_slots = asyncio.Semaphore(self.max_concurrent_requests)
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    # Idle keep-alive connections, and clients that send requests too slowly, are closed after the timeout
+                    request = await asyncio.wait_for(self._read_request(reader), self.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except HTTPError as e:
+                    self._write_response(writer, e.status, {"error": str(e)}, False)
+                    await writer.drain()
+                    break
+
+                if request is None:
+                    break
+
+                method, path, version, headers, body = request
+                status, payload = await self._dispatch(method, path, headers, body)
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_line(self, reader, status, message):
+        # readline raises ValueError for a line longer than the reader's limit, which is answered as a bad request
+        try:
+            return await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            raise HTTPError(status, message)
+
+    async def _read_request(self, reader):
+        request_line = await self._read_line(reader, 400, "Request line too long")
+        if not request_line.strip():
+            return None
+
+        try:
+            method, path, version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await self._read_line(reader, 431, "Header line too long")
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HTTPError(431, "Too many headers")
+
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            content_length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if content_length > MAX_BODY_SIZE:
+            raise HTTPError(413, "Request body too large")
+
+        body = await reader.readexactly(content_length) if content_length else b""
+        return method.upper(), path, version.upper(), headers, body
+
+    def _write_response(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+
+    async def _dispatch(self, method, path, headers, body):
+        url = urlsplit(path)
+        route = self.routes.get((method, url.path))
+        if route is None:
+            return 404, {"error": f"No route for {method} {url.path}"}
+
+        user = None
+        if route != self.login:
+            user = self._session(headers.get("authorization", "").replace("Bearer ", "", 1))
+            if user is None:
+                return 401, {"error": "Log in first"}
+
+        try:
+            request = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"error": "Request body is not valid JSON"}
+        if not isinstance(request, dict):
+            return 400, {"error": "Request body must be a JSON object"}
+
+        # Requests beyond the limit wait here rather than queueing up on the executor and the database
+        async with self._request_slots:
+            try:
+                response = await asyncio.get_running_loop().run_in_executor(self.executor, route, user, parse_qs(url.query), request, headers)
+            except HTTPError as e:
+                return e.status, {"error": str(e)}
+            except Exception as e:
+                print(f"Error handling {method} {url.path}: {e}")
+                return 500, {"error": "Internal server error"}
+
+        # Routes that queue a write return a Future of the response, awaited without holding a request slot or worker thread
+        if isinstance(response, Future):
+            response = await asyncio.wrap_future(response)
+        return response
+
+    def _session(self, token):
+        # Returns the token's user and marks the session as used, or None if there's no such session or it has expired
+        with self._sessions_lock:
+            self._expire_sessions()
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            self.sessions[token] = (session[0], time.monotonic())
+            self.sessions.move_to_end(token)
+            return session[0]
+
+    def _expire_sessions(self):
+        expired_before = time.monotonic() - self.session_timeout
+        while self.sessions and next(iter(self.sessions.values()))[1] < expired_before:
+            self.sessions.popitem(last=False)
+
+    def _require_manager(self, user):
+        if user.role != "Manager":
+            raise HTTPError(403, "Only managers can do this")
+
+    def login(self, user, query, request, headers):
+        user = self.user_handler.authenticate_user(request.get("email"), request.get("password"))
+        if user is None:
+            raise HTTPError(401, "Invalid email or password")
+
+        token = secrets.token_urlsafe(32)
+        with self._sessions_lock:
+            self._expire_sessions()
+            self.sessions[token] = (user, time.monotonic())
+        return 200, {"token": token, "user": user_to_dict(user)}
+
+    def logout(self, user, query, request, headers):
+        with self._sessions_lock:
+            self.sessions.pop(headers.get("authorization", "").replace("Bearer ", "", 1), None)
+        return 200, {}
+
+    def balance(self, user, query, request, headers):
+        return 200, {"flexi_balance": self.timesheet_handler.get_flexi_balance(user.user_id)}
+
+    def submit_timesheet(self, user, query, request, headers):
+        try:
+            start_date = datetime.strptime(request["start_date"], "%Y-%m-%d")
+            hours = [float(worked_hours) for worked_hours in request["hours"]]
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, "Expected start_date as yyyy-mm-dd and hours as a list of numbers")
+        if not 0 < len(hours) <= 7 or not all(0 <= worked_hours <= 24 for worked_hours in hours):
+            raise HTTPError(400, "Expected one to seven days of 0 to 24 hours")
+
+        response = Future()
+        self.timesheet_handler.submit_timesheet_async(user, start_date, hours).add_done_callback(
+            lambda future: response.set_result(self._submitted(future)))
+        return response
+
+    def _submitted(self, future):
+        if future.exception() is not None or future.result() is None:
+            return 500, {"error": "Timesheet could not be submitted"}
+        return 201, {"timesheet_id": future.result()}
+
+    def pending_timesheets(self, user, query, request, headers):
+        self._require_manager(user)
+        try:
+            after_timesheet_id = int(query["after"][0]) if "after" in query else None
+            page_size = min(int(query.get("page_size", ["10"])[0]), MAX_PAGE_SIZE)
+        except ValueError:
+            raise HTTPError(400, "after and page_size must be integers")
+        if page_size < 1:
+            raise HTTPError(400, "page_size must be at least 1")
+
+        timesheets, next_cursor = self.timesheet_handler.get_timesheets_page(user.department, "Pending", after_timesheet_id, page_size)
+        return 200, {"timesheets": [timesheet_to_dict(timesheet) for timesheet in timesheets], "next_cursor": next_cursor}
+
+    def set_timesheets_status(self, user, query, request, headers):
+        self._require_manager(user)
+        timesheet_ids = request.get("timesheet_ids")
+        status = request.get("status")
+        if status not in ("Approved", "Denied") or not isinstance(timesheet_ids, list) or not all(isinstance(timesheet_id, int) for timesheet_id in timesheet_ids):
+            raise HTTPError(400, "Expected timesheet_ids as a list of integers and status as Approved or Denied")
+
+        # Managers can only decide on pending timesheets in their own department
+        updated = self.timesheet_handler.set_timesheets_status(timesheet_ids, status, "Pending", user.department)
+        if updated is None:
+            raise HTTPError(500, "Timesheets could not be updated")
+        return 200, {"updated": updated}
+
+async def serve(server, host, port):
+    async with await server.start(host, port) as running_server:
+        print(f"Serving on http://{host}:{port}")
+        await running_server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the flexi-time presenters over a local HTTP/JSON API.")
+    parser.add_argument("--database", default="database.sqlite")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="threads, and so database connections, running requests")
+    parser.add_argument("--max-concurrent-requests", type=int, default=32)
+    parser.add_argument("--keep-alive-timeout", type=float, default=15)
+    parser.add_argument("--session-timeout", type=float, default=8 * 60 * 60, help="seconds a login lasts without being used")
+    parser.add_argument("--sharded", action="store_true", help="keep each department in its own database file next to --database")
+    parser.add_argument("--write-behind", action="store_true", help="group timesheet submissions into shared commits")
+    parser.add_argument("--batch-size", type=int, default=500, help="most submissions per write-behind commit")
+    parser.add_argument("--batch-delay-ms", type=float, default=10, help="longest a submission waits for others to share its commit")
+    args = parser.parse_args()
+
+    db_handler = ShardedDatabaseHandler(args.database) if args.sharded else DatabaseHandler(args.database, pooled=True)
+    write_behind = WriteBehindQueue(db_handler, args.batch_size, args.batch_delay_ms) if args.write_behind else None
+    cache = LRUCache(max_size=1024, ttl=300)
+    user_handler = UserHandler(db_handler, cache)
+    timesheet_handler = TimesheetHandler(db_handler, cache, write_behind)
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    server = FlexiTimeServer(user_handler, timesheet_handler, executor, args.max_concurrent_requests, args.keep_alive_timeout,
+                             args.session_timeout)
+
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=True)
+        # Commits any submissions still queued before the connections close
+        if write_behind:
+            write_behind.close()
+        db_handler.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import unittest
+import tempfile
+import os
+import shutil
+import asyncio
+import threading
+import json
+import http.client
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from model import DatabaseHandler
+from presenter import UserHandler, TimesheetHandler
+from server import FlexiTimeServer
+
+class TestFlexiTimeServer(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.db_handler = DatabaseHandler(os.path.join(self.temp_folder, "test_db.sqlite"), pooled = True)
+        self.user_handler = UserHandler(self.db_handler)
+        self.timesheet_handler = TimesheetHandler(self.db_handler)
+        self.user_handler.create_user("Amy Pond", "amy@example.com", "fish", "IT", "Employee")
+        self.user_handler.create_user("Kate Stewart", "kate@example.com", "unit", "IT", "Manager")
+        self.user_handler.create_user("Harriet Jones", "harriet@example.com", "pm", "HR", "Manager")
+
+        self.executor = ThreadPoolExecutor(max_workers = 4)
+        self.server = FlexiTimeServer(self.user_handler, self.timesheet_handler, self.executor, max_concurrent_requests = 2, keep_alive_timeout = 5)
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target = self.loop.run_forever)
+        self.loop_thread.start()
+        running_server = asyncio.run_coroutine_threadsafe(self.server.start("127.0.0.1", 0), self.loop).result()
+        self.port = running_server.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.server.server.close()
+        asyncio.run_coroutine_threadsafe(self.server.server.wait_closed(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        self.executor.shutdown(wait = True)
+        self.db_handler.close()
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+    def request(self, connection, method, path, body = None, token = None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def login(self, connection, email, password):
+        status, payload = self.request(connection, "POST", "/login", {"email": email, "password": password})
+        self.assertEqual(status, 200)
+        return payload["token"]
+
+    def test_login_and_balance(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        status, payload = self.request(connection, "POST", "/login", {"email": "amy@example.com", "password": "wrong"})
+        self.assertEqual(status, 401)
+        token = self.login(connection, "amy@example.com", "fish")
+        status, payload = self.request(connection, "GET", "/balance", token = token)
+        self.assertEqual((status, payload), (200, {"flexi_balance": 0}))
+        connection.close()
+
+    def test_submit_list_and_approve(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        employee_token = self.login(connection, "amy@example.com", "fish")
+        status, payload = self.request(connection, "POST", "/timesheets", {"start_date": "2023-01-02", "hours": [8.4] * 5}, employee_token)
+        self.assertEqual(status, 201)
+        timesheet_id = payload["timesheet_id"]
+        status, payload = self.request(connection, "GET", "/timesheets/pending", token = employee_token)
+        self.assertEqual(status, 403)
+
+        manager_token = self.login(connection, "kate@example.com", "unit")
+        status, payload = self.request(connection, "GET", "/timesheets/pending?page_size=5", token = manager_token)
+        self.assertEqual(status, 200)
+        self.assertEqual([timesheet["timesheet_id"] for timesheet in payload["timesheets"]], [timesheet_id])
+        self.assertEqual(payload["timesheets"][0]["worked_hours"]["2023-01-02"], 8.4)
+        for page_size in ["0", "-2", "ten"]:
+            self.assertEqual(self.request(connection, "GET", f"/timesheets/pending?page_size={page_size}", token = manager_token)[0], 400)
+
+        other_token = self.login(connection, "harriet@example.com", "pm")
+        status, payload = self.request(connection, "POST", "/timesheets/status", {"timesheet_ids": [timesheet_id], "status": "Approved"}, other_token)
+        self.assertEqual((status, payload), (200, {"updated": 0}))
+        status, payload = self.request(connection, "POST", "/timesheets/status", {"timesheet_ids": [timesheet_id], "status": "Approved"}, manager_token)
+        self.assertEqual((status, payload), (200, {"updated": 1}))
+        self.assertEqual(self.timesheet_handler.get_timesheet_by_id(timesheet_id).status, "Approved")
+        connection.close()
+
+    def test_errors(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        self.assertEqual(self.request(connection, "GET", "/balance")[0], 401)
+        self.assertEqual(self.request(connection, "GET", "/missing")[0], 404)
+        token = self.login(connection, "amy@example.com", "fish")
+        self.assertEqual(self.request(connection, "POST", "/timesheets", {"start_date": "02-01-2023", "hours": [8]}, token)[0], 400)
+        self.assertEqual(self.request(connection, "POST", "/timesheets", {"start_date": "2023-01-02", "hours": [25]}, token)[0], 400)
+        connection.request("POST", "/timesheets", "not json", {"Authorization": f"Bearer {token}"})
+        response = connection.getresponse()
+        response.read()
+        self.assertEqual(response.status, 400)
+        self.request(connection, "POST", "/logout", token = token)
+        self.assertEqual(self.request(connection, "GET", "/balance", token = token)[0], 401)
+        connection.close()
+
+    def test_sessions_expire(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        old_token = self.login(connection, "amy@example.com", "fish")
+        token = self.login(connection, "amy@example.com", "fish")
+        self.server.session_timeout = 0.2
+        time.sleep(0.1)
+        self.assertEqual(self.request(connection, "GET", "/balance", token = token)[0], 200)
+        time.sleep(0.15)
+        # Using a session keeps it alive, while the unused one has expired and been dropped
+        self.assertEqual(self.request(connection, "GET", "/balance", token = token)[0], 200)
+        self.assertEqual(list(self.server.sessions), [token])
+        self.assertEqual(self.request(connection, "GET", "/balance", token = old_token)[0], 401)
+        time.sleep(0.25)
+        self.assertEqual(self.request(connection, "GET", "/balance", token = token)[0], 401)
+        self.assertEqual(len(self.server.sessions), 0)
+        connection.close()
+
+    def test_long_lines(self):
+        requests = {b"GET /" + b"a" * 70000 + b" HTTP/1.1\r\n\r\n": b"HTTP/1.1 400 Bad Request",
+                    b"GET /balance HTTP/1.1\r\nX-Long: " + b"a" * 70000 + b"\r\n\r\n": b"HTTP/1.1 431 Request Header Fields Too Large"}
+        for request, status_line in requests.items():
+            with socket.create_connection(("127.0.0.1", self.port), timeout = 5) as sock:
+                sock.sendall(request)
+                response = b""
+                while True:
+                    data = sock.recv(4096)
+                    if not data:
+                        break
+                    response += data
+            self.assertEqual(response.split(b"\r\n")[0], status_line)
+
+    def test_keep_alive_reuses_connection(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        token = self.login(connection, "amy@example.com", "fish")
+        sock = connection.sock
+        for _ in range(5):
+            self.assertEqual(self.request(connection, "GET", "/balance", token = token)[0], 200)
+        self.assertIs(connection.sock, sock)
+        connection.close()
+
+    def test_concurrent_clients(self):
+        results = []
+
+        def client():
+            connection = http.client.HTTPConnection("127.0.0.1", self.port)
+            token = self.login(connection, "amy@example.com", "fish")
+            for _ in range(5):
+                results.append(self.request(connection, "POST", "/timesheets", {"start_date": "2023-01-02", "hours": [7.4] * 5}, token)[0])
+            connection.close()
+
+        threads = [threading.Thread(target = client) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [201] * 40)
+        self.assertEqual(len(self.timesheet_handler.get_timesheets_by_status("IT", "Pending")), 40)
+
+class TestEntryPointImports(unittest.TestCase):
+    def test_entry_points_do_not_load_gui(self):
+        for module in ["main", "server", "importer", "exporter"]:
+            result = subprocess.run([sys.executable, "-c", f"import sys, {module}; print('PySimpleGUI' in sys.modules or 'tkinter' in sys.modules)"],
+                                    capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__)))
+            self.assertEqual(result.stdout.strip(), "False", module)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,15 +1,29 @@
 import PySimpleGUI as sg
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from presenter import BackgroundTasks
 
 class FlexiTimeGUI:
-    def __init__(self, user_handler, timesheet_handler, icon_path):
+    def __init__(self, user_handler, timesheet_handler, icon_path, executor = None):
         self.user_handler = user_handler
         self.timesheet_handler = timesheet_handler
         self.icon_path = icon_path
         self.user = None
-        
+
+        # Database calls run on worker threads and their results come back to each window as events
+        self.executor = executor or ThreadPoolExecutor(max_workers=4)
+
         sg.theme("LightGrey1")
 
+    def _run_in_background(self, tasks, window, event_key, function, *args):
+        def run_in_span(*args):
+            # Lets query instrumentation attribute each query to the GUI action that issued it
+            with self.user_handler.db_handler.span(function.__qualname__):
+                return function(*args)
+
+        tasks.submit(run_in_span, *args, on_done=lambda result, error: window.write_event_value(event_key, result))
+
     def main_page(self):
         layout = [
             [sg.Text("Welcome to the Flexi-Time App")],
@@ -22,6 +36,7 @@ class FlexiTimeGUI:
         ]
 
         main_window = sg.Window("Flexi-Time App", layout, icon=self.icon_path)
+        tasks = BackgroundTasks(self.executor)
 
         while True:
             event, values = main_window.read()
@@ -36,14 +51,17 @@ class FlexiTimeGUI:
                     main_window["log_in"].update(disabled=True)
 
                     if self.user.role == "Employee":
-                        flexi_balance = self.timesheet_handler.get_flexi_balance(self.user.user_id)
                         main_window["-FLEXI_TEXT-"].update(visible=True)
-                        main_window["-FLEXI_BALANCE-"].update(flexi_balance, visible=True)
-                        main_window["create_ts"].update(disabled=False)
+                        main_window["-FLEXI_BALANCE-"].update("Loading...", visible=True)
+                        self._run_in_background(tasks, main_window, "-FLEXI_BALANCE_LOADED-", self.timesheet_handler.get_flexi_balance, self.user.user_id)
 
                     elif self.user.role == "Manager":
                         main_window["view_all_ts"].update(visible=True)
 
+            elif event == "-FLEXI_BALANCE_LOADED-":
+                main_window["-FLEXI_BALANCE-"].update(values[event])
+                main_window["create_ts"].update(disabled=False)
+
             elif event == "create_ts":
                 if self.user != None:
                     self.create_timesheet_page()
@@ -52,6 +70,7 @@ class FlexiTimeGUI:
                 if self.user != None:
                     self.view_all_timesheets_page()
 
+        tasks.cancel()
         main_window.close()
 
     def login_page(self):
@@ -63,6 +82,7 @@ class FlexiTimeGUI:
         ]
 
         login_window = sg.Window("Log In", layout, icon=self.icon_path)
+        tasks = BackgroundTasks(self.executor)
         user = None
 
         while True:
@@ -75,14 +95,20 @@ class FlexiTimeGUI:
                 email = values["email"]
                 password = values["password"]
 
-                user = self.user_handler.authenticate_user(email, password)
-                
+                login_window["Submit"].update(disabled=True)
+                self._run_in_background(tasks, login_window, "-AUTHENTICATED-", self.user_handler.authenticate_user, email, password)
+
+            elif event == "-AUTHENTICATED-":
+                user = values[event]
+
                 if user == None:
+                    login_window["Submit"].update(disabled=False)
                     sg.popup("Login Failed. Please check your credentials.", title="Error")
                 else:
                     sg.popup("Login Successful", title="Success")
                     break
 
+        tasks.cancel()
         login_window.close()
         return user
 
@@ -101,6 +127,7 @@ class FlexiTimeGUI:
         ]
 
         create_timesheet_window = sg.Window("Create Timesheet", layout, icon=self.icon_path)
+        tasks = BackgroundTasks(self.executor)
 
         while True:
             event, values = create_timesheet_window.read()
@@ -118,57 +145,179 @@ class FlexiTimeGUI:
                     values["friday"]
                 ]
 
-                timesheet_id = self.timesheet_handler.create_timesheet(self.user.user_id, self.user.department, "Pending")
+                create_timesheet_window["submit_timesheet"].update(disabled=True)
+                self._run_in_background(tasks, create_timesheet_window, "-TIMESHEET_SUBMITTED-", self.timesheet_handler.submit_timesheet, self.user, start_date, weeks_worked_hours)
 
-                for i, worked_hours in enumerate(weeks_worked_hours):
-                    date = start_date + timedelta(days=i)
-
-                    self.timesheet_handler.create_timesheet_entry(timesheet_id, date.strftime("%d-%m-%Y"), worked_hours)
-
-                sg.popup("Timesheet Submitted", title="Success")
-                break
+            elif event == "-TIMESHEET_SUBMITTED-":
+                if values[event] == None:
+                    create_timesheet_window["submit_timesheet"].update(disabled=False)
+                    sg.popup("Timesheet could not be submitted. Please try again.", title="Error")
+                else:
+                    sg.popup("Timesheet Submitted", title="Success")
+                    break
 
+        tasks.cancel()
         create_timesheet_window.close()
         return 
-    
-    def view_all_timesheets_page(self):
-        timesheets = self.timesheet_handler.get_timesheets_by_status(self.user.department, "Pending")
+
+    def _timesheet_rows(self, timesheets):
         data = []
 
         if timesheets:
             for timesheet in timesheets:
                 data.append([timesheet.timesheet_id, timesheet.employee_id, timesheet.department, timesheet.status])
-        
+
+        return data
+
+    def _apply_changes(self, timesheets, changed, page_start, next_cursor, page_size):
+        # Pending timesheets that fall on the page are added or replaced and everything else is dropped. A page that
+        # grows past page_size hands its last rows on to the next page.
+        timesheets = {timesheet.timesheet_id: timesheet for timesheet in timesheets}
+        for timesheet in changed:
+            on_page = (page_start is None or timesheet.timesheet_id > page_start) and (next_cursor is None or timesheet.timesheet_id <= next_cursor)
+            if timesheet.status == "Pending" and on_page:
+                timesheets[timesheet.timesheet_id] = timesheet
+            else:
+                timesheets.pop(timesheet.timesheet_id, None)
+
+        timesheets = [timesheets[timesheet_id] for timesheet_id in sorted(timesheets)]
+        if len(timesheets) > page_size:
+            timesheets = timesheets[:page_size]
+            next_cursor = timesheets[-1].timesheet_id
+        return timesheets, next_cursor
+
+    def view_all_timesheets_page(self, page_size = 10, poll_interval_ms = 2000):
         layout = [
-            [sg.Text("Pending Timesheets")],
-            [sg.Table(values=data, headings=["Timesheet ID", "Employee ID", "Department ID", "Status"], 
-                      auto_size_columns=False, justification="right", num_rows=10, key="-TIMESHEET_TABLE-", enable_events=True)],
-            [sg.Button("Exit")]
+            [sg.Text("Pending Timesheets"), sg.Text("Loading...", key="-LOADING-")],
+            [sg.Table(values=[], headings=["Timesheet ID", "Employee ID", "Department ID", "Status"], 
+                      auto_size_columns=False, justification="right", num_rows=page_size, key="-TIMESHEET_TABLE-", enable_events=True,
+                      select_mode=sg.TABLE_SELECT_MODE_EXTENDED)],
+            [sg.Button("View", disabled=True), sg.Button("Approve Selected", disabled=True), sg.Button("Deny Selected", disabled=True),
+             sg.Button("Approve All Pending")],
+            [sg.Button("Previous", disabled=True), sg.Button("Next", disabled=True), sg.Button("Exit")]
         ]
         
-        view_all_timesheets_window = sg.Window("View All Timesheets", layout, icon=self.icon_path)
+        view_all_timesheets_window = sg.Window("View All Timesheets", layout, icon=self.icon_path, finalize=True)
+        tasks = BackgroundTasks(self.executor)
+        timesheets = []
+
+        # Cursors for the start of every page visited so far, the last one being the page on screen
+        page_cursors = [None]
+        next_cursor = None
+
+        # The table is kept up to date from the department's change feed. last_sequence is the last change applied,
+        # and only one poll runs at a time.
+        last_sequence = None
+        polling = False
+        poll_again = False
+
+        def load_page():
+            view_all_timesheets_window["-LOADING-"].update(visible=True)
+            view_all_timesheets_window["Previous"].update(disabled=True)
+            view_all_timesheets_window["Next"].update(disabled=True)
+            self._run_in_background(tasks, view_all_timesheets_window, "-TIMESHEETS_LOADED-", self.timesheet_handler.get_timesheets_page,
+                                    self.user.department, "Pending", page_cursors[-1], page_size)
+
+        def poll_changes():
+            nonlocal polling, poll_again
+            if polling:
+                poll_again = True
+                return
+            polling = True
+            self._run_in_background(tasks, view_all_timesheets_window, "-CHANGES-", self.timesheet_handler.get_changed_timesheets,
+                                    self.user.department, last_sequence)
+
+        # The page is loaded once the feed's starting point is known, so no change made in between is missed
+        poll_changes()
 
         while True:
-            event, values = view_all_timesheets_window.read()
+            event, values = view_all_timesheets_window.read(timeout=poll_interval_ms)
 
             if event == sg.WIN_CLOSED or event == "Exit":
                 break
 
-            if event == "-TIMESHEET_TABLE-":
-                if len(values["-TIMESHEET_TABLE-"]) > 0:
-                    selected_row = values["-TIMESHEET_TABLE-"][0]
-
-                    self.approve_timesheet_page(timesheets[selected_row])
-
-                    timesheets = self.timesheet_handler.get_timesheets_by_status(self.user.department, "Pending")
-                    data = []
+            if event == sg.TIMEOUT_KEY:
+                # Also retries finding the feed's starting point if that failed
+                poll_changes()
+
+            elif event == "-CHANGES-":
+                polling = False
+                changed, sequence = values[event] or ([], last_sequence)
+
+                if last_sequence is None and sequence is not None:
+                    load_page()
+                elif changed:
+                    timesheets, next_cursor = self._apply_changes(timesheets, changed, page_cursors[-1], next_cursor, page_size)
+                    if not timesheets:
+                        load_page()
+                    else:
+                        view_all_timesheets_window["-TIMESHEET_TABLE-"].update(values=self._timesheet_rows(timesheets))
+                        view_all_timesheets_window["Next"].update(disabled=next_cursor == None)
+                        # Updating the table clears its selection
+                        for button in ("View", "Approve Selected", "Deny Selected"):
+                            view_all_timesheets_window[button].update(disabled=True)
+                last_sequence = sequence
+
+                if poll_again:
+                    poll_again = False
+                    poll_changes()
+
+            elif event == "-TIMESHEETS_LOADED-":
+                timesheets, next_cursor = values[event] or ([], None)
+
+                # Approving the last timesheets on a page leaves it empty, so step back to the previous one
+                if not timesheets and len(page_cursors) > 1:
+                    page_cursors.pop()
+                    load_page()
+                    continue
+
+                view_all_timesheets_window["-LOADING-"].update(visible=False)
+                view_all_timesheets_window["-TIMESHEET_TABLE-"].update(values=self._timesheet_rows(timesheets))
+                view_all_timesheets_window["Previous"].update(disabled=len(page_cursors) == 1)
+                view_all_timesheets_window["Next"].update(disabled=next_cursor == None)
+
+            elif event == "Next":
+                page_cursors.append(next_cursor)
+                load_page()
+
+            elif event == "Previous":
+                page_cursors.pop()
+                load_page()
+
+            elif event == "-TIMESHEET_TABLE-":
+                selected_rows = values["-TIMESHEET_TABLE-"]
+                view_all_timesheets_window["View"].update(disabled=len(selected_rows) != 1)
+                view_all_timesheets_window["Approve Selected"].update(disabled=len(selected_rows) == 0)
+                view_all_timesheets_window["Deny Selected"].update(disabled=len(selected_rows) == 0)
+
+            elif event == "View":
+                self.approve_timesheet_page(timesheets[values["-TIMESHEET_TABLE-"][0]])
+
+                poll_changes()
+
+            elif event in ("Approve Selected", "Deny Selected"):
+                # Every selected timesheet changes in one UPDATE and one commit
+                status = "Approved" if event == "Approve Selected" else "Denied"
+                timesheet_ids = [timesheets[row].timesheet_id for row in values["-TIMESHEET_TABLE-"]]
+                self._run_in_background(tasks, view_all_timesheets_window, "-STATUS_SET-", self.timesheet_handler.set_timesheets_status,
+                                        timesheet_ids, status, "Pending")
+
+            elif event == "Approve All Pending":
+                if sg.popup_yes_no(f"Approve every pending timesheet in {self.user.department}?", title="Approve All") == "Yes":
+                    self._run_in_background(tasks, view_all_timesheets_window, "-STATUS_SET-", self.timesheet_handler.set_department_status,
+                                            self.user.department, "Approved")
+
+            elif event == "-STATUS_SET-":
+                if values[event] == None:
+                    sg.popup("Timesheets could not be updated. Please try again.", title="Error")
+                else:
+                    sg.popup(f"{values[event]} timesheets updated", title="Success")
 
-                    if timesheets:
-                        for timesheet in timesheets:
-                            data.append([timesheet.timesheet_id, timesheet.employee_id, timesheet.department_id, timesheet.status])
-                        
-                    view_all_timesheets_window["-TIMESHEET_TABLE-"].update(values=data)
+                for button in ("View", "Approve Selected", "Deny Selected"):
+                    view_all_timesheets_window[button].update(disabled=True)
+                poll_changes()
 
+        tasks.cancel()
         view_all_timesheets_window.close()
         return 
 
@@ -181,6 +330,7 @@ class FlexiTimeGUI:
         ]
 
         approve_timesheet_window = sg.Window("Approve Timesheet", layout, icon=self.icon_path)
+        tasks = BackgroundTasks(self.executor)
 
         while True:
             event, values = approve_timesheet_window.read()
@@ -188,15 +338,19 @@ class FlexiTimeGUI:
             if event == sg.WIN_CLOSED or event == "Exit":
                 break
 
-            elif event == "Approve":
-                self.timesheet_handler.set_timesheet_status(timesheet.timesheet_id, "Approved")
-                sg.popup("Timesheet Approved", title="Approved")
-                break
+            elif event in ("Approve", "Deny"):
+                approve_timesheet_window["Approve"].update(disabled=True)
+                approve_timesheet_window["Deny"].update(disabled=True)
+                status = "Approved" if event == "Approve" else "Denied"
+                self._run_in_background(tasks, approve_timesheet_window, "-STATUS_SET-", self.timesheet_handler.set_timesheet_status, timesheet.timesheet_id, status)
 
-            elif event == "Deny":
-                self.timesheet_handler.set_timesheet_status(timesheet.timesheet_id, "Denied")
-                sg.popup("Timesheet Denied", title="Denied")
+            elif event == "-STATUS_SET-":
+                if status == "Approved":
+                    sg.popup("Timesheet Approved", title="Approved")
+                else:
+                    sg.popup("Timesheet Denied", title="Denied")
                 break
 
+        tasks.cancel()
         approve_timesheet_window.close()
         return 